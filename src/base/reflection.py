@@ -33,11 +33,11 @@
 import typing
 import os
 import re
+import shlex
 from utils.ssh import START_TTY, END_TTY
 import logging
 from io import BytesIO, StringIO, IOBase
 from abc import ABC, abstractmethod
-from tempfile import mktemp
 
 from paramiko import client, SSHException
 from paramiko.channel import Channel
@@ -45,6 +45,7 @@ from sqlalchemy.orm import aliased
 
 from utils import ssh
 from utils.session import State
+from utils.walk_stream import WalkStreamDecoder
 from db.tables import (
     System,
     RpmDetail,
@@ -96,8 +97,6 @@ class InstalledPackageInfo(ssh.SshConnector, ABC):
             re.IGNORECASE,
         )
 
-        self.temp_dir = mktemp(prefix='reflect_', dir='/tmp')
-
         super().__init__(
             hostname=hostname,
             username=username,
@@ -155,63 +154,164 @@ class InstalledPackageInfo(ssh.SshConnector, ABC):
 
         return {'remote_hostname': hostname, 'kernel_version': kernel_info}
 
-    def get_files(self):
+    def get_files(
+            self,
+            walk_args: typing.List[str] = None,
+            walk_files: typing.Dict[str, BytesIO] = None,
+            binary: bool = False,
+    ):
+        """
+        Runs walk.py on the remote host and yields its output lines.
+
+        :param walk_args: command-line arguments passed to walk.py
+        :param walk_files: data files for walk.py, keyed by the walk.py
+            option that takes the file name.  Files are uploaded into a
+            temp directory for the duration of the walk.
+        :param binary: transfer the walk in walk.py's compressed binary
+            format.  Lines are decoded back into the text format.
+        """
 
-        walk_script = self.exec_path + 'walk.py'
+        walk_args = list(walk_args or [])
 
-        with open(walk_script, 'r') as w:
-            lines = w.readlines()
+        if binary:
+            if self.tty:
+                raise ValueError(
+                    'The binary walk format cannot be read through a tty.'
+                )
 
-        if self.tty:
-            lines.append('\n\n\nEOF\n')
+            walk_args += ['--format', 'binary']
+
+        if not walk_files:
+            yield from self._run_walk(walk_args, binary)
+            return
+
+        with self.open_sftp() as sftp:
+            remote_files = []
 
-        walk_code = ''.join(lines)
+            try:
+                for option, data in walk_files.items():
+                    remote_name = f'{self.temp_dir}/{option.lstrip("-")}'
+                    sftp.put_file_handle(remote_name, data)
+                    remote_files.append(remote_name)
+                    walk_args += [option, remote_name]
+
+                yield from self._run_walk(walk_args, binary)
+
+            finally:
+                for remote_name in remote_files:
+                    sftp.remove_file(remote_name)
+
+    def _run_walk(
+            self,
+            walk_args: typing.List[str],
+            binary: bool = False,
+    ) -> ssh.StringIterator:
+
+        walk_script = self.exec_path + 'walk.py'
+        python_command = ' '.join(
+            ['sudo python -'] + [shlex.quote(arg) for arg in walk_args]
+        )
+
+        with open(walk_script, 'r') as w:
+            walk_code = w.read()
 
         print('Walking filesystem.')
 
+        # the walker can be silent for a long time while it hashes a large
+        # file or is rate limited, so the walk has no idle timeout
+
         if self.tty:
-            command = (
-                'sudo python << EOF ; echo "exit_code=$?"; exit\n'
-                f'{walk_code}'
-            )
+            command = ssh.make_tty_script_command(python_command, walk_code)
 
-            for line in self.run_tty_command(command=command):
+            for line in self.run_tty_command(
+                    command=command,
+                    timeout_seconds=None,
+            ):
                 yield line
+        elif binary:
+
+            remote = self.stream_remote_command(
+                command=python_command,
+                stdin_data=BytesIO(
+                    walk_code.encode("utf-8"),
+                ),
+                timeout_seconds=None,
+            )
+
+            yield from WalkStreamDecoder().decode(byte_stream=remote)
         else:
 
             remote = self.run_remote_command(
-                command="sudo python",
+                command=python_command,
                 stdin_data=BytesIO(
                     walk_code.encode("utf-8"),
-                )
+                ),
+                timeout_seconds=None,
             )
-            line = next(remote)
-
-            if line.startswith(START_TTY):
-                line = next(remote)
 
             # remove START and END blocks from walk results
             # these were needed with centos's old sudo
             # but 7.4/7.5 removes requiretty from /etc/sudoers
-            next_line = None
-            while line:
-                try:
-                    next_line = next(remote)
-                except StopIteration:
-                    if not line.startswith(END_TTY):
-                        yield line
-                    else:
-                        raise
+            for line in remote:
+                if line.startswith(START_TTY) or line.startswith(END_TTY):
+                    continue
 
                 yield line
-                line = next_line
 
 
 class InstalledRpmInfo(InstalledPackageInfo):
 
+    # rpm's PGPHASHALGO values for the digests walk.py can compute
+    digest_algorithms = {
+        '1': 'md5',
+        '8': 'sha256',
+    }
+
     def get_packages(self) -> ssh.StringIterator:
         return self.get_rpm_info()
 
+    def get_file_digest_algorithm(self) -> str:
+        """
+        Finds which file digest algorithms the installed packages use, so
+        the walker only has to compute those.
+
+        :return: 'md5' or 'sha256' when every package with files uses that
+            algorithm, otherwise 'both'
+        """
+
+        algorithms = set()
+
+        try:
+            for line in self.run_remote_command(
+                    command=(
+                        "rpm -qa --queryformat "
+                        "'%{FILEDIGESTALGO}\\t%|BASENAMES?{files}:{none}|\\n'"
+                    )
+            ):
+                algorithm, _, files = line.strip().partition('\t')
+
+                if files != 'files':
+                    continue
+
+                # packages built before rpm recorded the algorithm have no
+                # FILEDIGESTALGO tag, and their digests are md5
+                if algorithm == '(none)':
+                    algorithm = '1'
+
+                algorithms.add(algorithm)
+
+        except ssh.SSHRunException:
+            log.warning(
+                'Unable to query the rpm file digest algorithm; '
+                'computing both digests.'
+            )
+            return 'both'
+
+        if len(algorithms) == 1:
+            return self.digest_algorithms.get(algorithms.pop(), 'both')
+
+        return 'both'
+
     def get_rpm_info(self) -> ssh.StringIterator:
         command = (
             'rpm -qa --queryformat '
@@ -264,11 +364,24 @@ class GetModifiedFilesFromRemoteHost(RpmGatherer):
     def __init__(self, **kwargs):
         super().__init__(**kwargs)
 
-    def process_user_content(self):
+    def process_user_content(self, transfer: str = 'sftp'):
+        """
+        Stores the contents of the system's user files
+
+        :param transfer: 'sftp' fetches each file over SFTP; 'tar' streams
+            them all through sudo tar, which also reads root-only files
+        """
 
         session = State.get_db_session()
         system: System = State.get_system()
 
+        if transfer == 'tar' and system.use_tty:
+            log.warning(
+                f"sudo on {system.name} needs a tty, which would mangle a "
+                f"tar stream; fetching user files over SFTP."
+            )
+            transfer = 'sftp'
+
         try:
             # TODO: Done in another method, maybe consolidate
             # log.info("Deleting prior art...")
@@ -320,45 +433,64 @@ class GetModifiedFilesFromRemoteHost(RpmGatherer):
             log.info("Deleted.")
             session.flush()
 
-            log.info("Opening SFTPCLient")
-
-            sftp = ssh.SftpWrapper(
-                open_sftp_client=State.get_ssh_session().get_sftp_client(),
-            )
+            files: typing.Dict[str, typing.List[FileDetail]] = {}
 
             file: FileDetail
 
             for file in query.all():
-                log.info(f"Fetching {file.file_location} from {system.name}.")
-                file_handle = sftp.get_file_handle(file.file_location)
-
-                file_storage: FileStorage = FileStorage(file_type="C")
-
-                if (
-                    type(file_handle) is BytesIO
-                ):
-                    log.debug("file result is type BytesIO")
-                    file_handle.seek(0)
-                    log.debug("reading data into file_storage")
-                    file_storage.file_data = file_handle.read()
-                else:
-                    log.debug("file result is not type BytesIO")
-                    file_storage.file_data = b""
-                    log.debug("file stored as empty file.")
-
-                file_link = FileDetailStorageLink(
-                    file_detail=file,
-                    file_storage=file_storage,
-                    file_type="C",
-                )
+                files.setdefault(file.file_location, []).append(file)
+
+            log.info(
+                f"Fetching {len(files)} user files from {system.name} "
+                f"over {transfer}."
+            )
+
+            connector = State.get_ssh_session()
+            fetched = 0
+            failed = 0
+
+            if transfer == 'tar':
+                fetched_files = connector.fetch_files_tar(files)
+            else:
+                fetched_files = connector.fetch_files(files)
+
+            for file_location, file_data in fetched_files:
+                # an unreadable file has no content to store
+                if file_data is None:
+                    log.warning(
+                        f"Unable to fetch {file_location}; no content stored."
+                    )
+                    failed += 1
+                    continue
+
+                for file in files[file_location]:
+                    file_storage: FileStorage = FileStorage(
+                        file_type="C",
+                        file_data=file_data,
+                    )
+
+                    file_link = FileDetailStorageLink(
+                        file_detail=file,
+                        file_storage=file_storage,
+                        file_type="C",
+                    )
+
+                    session.add(file_storage)
+                    session.add(file_link)
+
+                fetched += 1
 
-                log.info(f"Storing {file.file_location} from {system.name}.")
+                if fetched % 1000 == 0:
+                    log.info(f"Fetched {fetched} of {len(files)} files.")
+                    session.flush()
 
-                session.add(file_storage)
-                session.add(file_link)
-                log.debug("SQLAlchemy session flushing.")
-                session.flush()
-                log.debug("SQLAlchemy session flushed.")
+            session.flush()
+
+            if failed:
+                log.warning(
+                    f"{failed} of {len(files)} user files could not be "
+                    "fetched."
+                )
 
             log.info("Fetching user files has been completed.")
 
@@ -382,9 +514,7 @@ class GetModifiedFilesFromRemoteHost(RpmGatherer):
         self.file_difference.clear_system_file_storage()
         modified_rpms = self.file_difference.fetch_flagged_rpms()
 
-        sftp = ssh.SftpWrapper(
-            open_sftp_client=State.get_ssh_session().get_sftp_client(),
-        )
+        sftp = State.get_ssh_session().open_sftp()
 
         for rpm in modified_rpms:
 
@@ -40,6 +40,7 @@ from sqlalchemy.sql.expression import (
     func,
     not_,
     and_,
+    or_,
     exists,
     select,
     join,
@@ -65,6 +66,37 @@ from base.enums import FileOrigin
 log = LogConfig.get_logger(__name__)
 
 
+def is_fully_hashed(fd: FileDetail):
+    """
+    Files gathered before hash policies existed have a null policy and
+    were always fully hashed.
+    """
+    return coalesce(fd.hash_policy, "F") == "F"
+
+
+def file_matches_rpm(rd: RpmDetail, fd: FileDetail):
+    """
+    SQL expression that is true when the file on the system matches the
+    file in the rpm.  Only fully hashed files are compared by digest,
+    using the algorithm matching the length of the rpm digest; files the
+    walker sampled or did not hash are compared by size, and flagged as
+    unverified by fetch_unverified_rpm_details.
+    """
+    return or_(
+        is_fully_hashed(fd) & (
+            rd.digest == case(
+                {
+                    32: fd.md5_digest,
+                    64: fd.sha256_digest,
+                },
+                value=func.length(coalesce(rd.digest, "")),
+                else_=None,
+            )
+        ),
+        ~is_fully_hashed(fd) & (rd.file_size == fd.file_size),
+    )
+
+
 class FileDifference(object):
     """
     Class loads file differences by system and
@@ -84,11 +116,15 @@ class FileDifference(object):
         dml = RpmDetail.__table__.update().where(
             RpmDetail.system == self.system
         ).values(
-            file_changed=False
+            file_changed=False,
+            file_unverified=False,
         )
 
         result = self._session.execute(dml)
-        log.info(f"Cleared file_changed attribute for {result.rowcount} rows.")
+        log.info(
+            f"Cleared file_changed and file_unverified attributes for "
+            f"{result.rowcount} rows."
+        )
 
     def clear_data_for_current_system(self):
         p = alias(FileStorage)
@@ -238,13 +274,18 @@ class FileDifference(object):
         ).filter(
             system == self.system.system_id,
             rd.rpm_detail_id == sub_rd.rpm_detail_id,
-            coalesce(sub_rd.digest, 'x') == case(
-                {
-                    32: fd.md5_digest,
-                    64: fd.sha256_digest
-                },
-                value=func.length(rd.digest),
-                else_='x'
+            or_(
+                is_fully_hashed(fd) & (
+                    coalesce(sub_rd.digest, 'x') == case(
+                        {
+                            32: fd.md5_digest,
+                            64: fd.sha256_digest
+                        },
+                        value=func.length(rd.digest),
+                        else_='x'
+                    )
+                ),
+                ~is_fully_hashed(fd) & (sub_rd.file_size == fd.file_size),
             ),
         )
 
@@ -280,20 +321,7 @@ class FileDifference(object):
             fd,
             (fd.file_type == "F") &
             (rdl.file_detail_id == fd.file_detail_id) &
-            (
-                rd.digest == case({
-                        32: fd.md5_digest,
-                        64: fd.sha256_digest,
-                    },
-                    value=func.length(
-                        coalesce(
-                            rd.digest,
-                            ""
-                        )
-                    ),
-                    else_=None,
-                )
-            )
+            file_matches_rpm(rd, fd)
         ).filter(
             (s.system_id == self.system.system_id) &
             (fd.file_detail_id == None) &
@@ -305,6 +333,38 @@ class FileDifference(object):
 
         return result
 
+    def fetch_unverified_rpm_details(self) -> ResultProxy:
+        """
+        Fetches the package files that only match the file on the system
+        by size, as the walker sampled or did not hash it.  A tampered
+        file of the same size would not be found.
+        """
+
+        rd: RpmDetail = aliased(RpmDetail)
+        fd: FileDetail = aliased(FileDetail)
+        rdl: RpmFileDetailLink = aliased(RpmFileDetailLink)
+
+        query = self._session.query(
+            rd
+        ).join(
+            rdl,
+            (rdl.rpm_detail_id == rd.rpm_detail_id),
+        ).join(
+            fd,
+            (fd.file_type == "F") &
+            (rdl.file_detail_id == fd.file_detail_id),
+        ).filter(
+            (rd.system_id == self.system.system_id) &
+            ~is_fully_hashed(fd) &
+            (rd.file_size == fd.file_size) &
+            (func.coalesce(rd.file_info, "") != "directory") &
+            (~func.coalesce(rd.file_info, "").startswith("symbolic link"))
+        ).distinct()
+
+        result: ResultProxy = query.all()
+
+        return result
+
     def fetch_modified_rpms(self) -> ResultProxy:
 
         ri: RpmInfo = aliased(RpmInfo)
@@ -324,16 +384,7 @@ class FileDifference(object):
         ).outerjoin(
             fd,
             (rdl.file_detail_id == fd.file_detail_id) &
-            (
-                rd.digest == case(
-                    {
-                        32: fd.md5_digest,
-                        64: fd.sha256_digest,
-                    },
-                    value=func.length(coalesce(rd.digest, "")),
-                    else_=None,
-                )
-            )
+            file_matches_rpm(rd, fd)
         ).filter(
             (ri.rpm_info_id == rd.rpm_info_id) &
             (fd.file_detail_id == None) &
@@ -372,7 +423,7 @@ class FileDifference(object):
 
         return result
 
-    def clear_system_file_storage(self):
+    def clear_system_file_storage(self, commit: bool = True):
 
         count = self._session.query(
             RpmDetailPatchStorageLink.file_storage_id
@@ -394,8 +445,9 @@ class FileDifference(object):
 
         log.debug("clear_system_file_storage_2: %s" % pformat(count))
 
-        self._session.commit()
-        log.debug("clear_system_file_storage_3: commited")
+        if commit:
+            self._session.commit()
+            log.debug("clear_system_file_storage_3: commited")
 
         return count
 
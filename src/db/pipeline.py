@@ -0,0 +1,127 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+import threading
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from utils.session import State
+from db.tables import PipelineStage
+
+
+def get_schema_revision() -> str:
+    """
+    :return: the alembic revision the database is at
+    """
+
+    return State.get_db_session().execute(
+        "SELECT version_num FROM alembic_version"
+    ).scalar()
+
+
+class PipelineStageCache(object):
+    """
+    Keeps the completed pipeline stages of each system in pipeline_stage
+    for the main.py scheduler.  The scheduler threads share the one
+    database session, so access to it is serialized.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+
+    def get_output(
+            self,
+            system_name: str,
+            stage: str,
+            fingerprint: str,
+            max_age: float = None,
+    ) -> Optional[str]:
+        """
+        :param max_age: seconds a completed run stays current, if limited
+        :return: the recorded output of the stage if it last completed with
+            this input fingerprint, otherwise None
+        """
+
+        with self._lock:
+            row = State.get_db_session().query(PipelineStage).get(
+                (system_name, stage)
+            )
+
+            if row is None or row.fingerprint != fingerprint:
+                return None
+
+            if max_age is not None and (
+                    datetime.now(timezone.utc) - row.completed_at >
+                    timedelta(seconds=max_age)
+            ):
+                return None
+
+            return row.output
+
+    def complete(
+            self,
+            system_name: str,
+            stage: str,
+            fingerprint: str,
+            output: str,
+    ):
+
+        with self._lock:
+            session = State.get_db_session()
+            session.merge(
+                PipelineStage(
+                    system_name=system_name,
+                    stage=stage,
+                    fingerprint=fingerprint,
+                    output=output,
+                    completed_at=datetime.now(timezone.utc),
+                )
+            )
+            session.commit()
+
+    def forget(self, system_name: str, stage: str = None):
+        """
+        Drops the record of a stage, or of every stage of the system, so
+        it runs again
+        """
+
+        with self._lock:
+            session = State.get_db_session()
+            query = session.query(PipelineStage).filter(
+                PipelineStage.system_name == system_name
+            )
+
+            if stage is not None:
+                query = query.filter(PipelineStage.stage == stage)
+
+            query.delete(synchronize_session=False)
+            session.commit()
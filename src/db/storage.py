@@ -32,8 +32,9 @@
 
 import logging
 import os
+import zlib
 from dateutil import parser
-from io import StringIO
+from io import StringIO, BytesIO
 from csv import DictReader
 from utils.session import State
 from sqlalchemy.engine.result import ResultProxy
@@ -65,11 +66,17 @@ log = LogConfig.get_logger(__name__)
 
 
 class StorageBase(object):
+    """
+    Commits its changes on exit, or rolls them back on an error.  With
+    commit=False the changes are left for the caller to commit, so several
+    stores can make up one transaction.
+    """
 
     def __init__(self, **kwargs):
 
         name = kwargs.get("name")
         gather = kwargs.get("gather", False)
+        self.commits: bool = kwargs.get("commit", True)
 
         self.system: System = State.get_system(name=name, gather=gather)
         if not gather:
@@ -83,13 +90,25 @@ class StorageBase(object):
         if exception_value:
             log.error('Rolling back transaction.')
             State.get_db_session().rollback()
-        else:
+        elif self.commits:
             log.info('Committing transaction.')
             State.get_db_session().commit()
             log.info('Transaction committed.')
+        else:
+            State.get_db_session().flush()
 
         return False
 
+    def commit_step(self):
+        """
+        Commits a step of a load, unless the caller commits the whole load
+        """
+
+        State.get_db_session().flush()
+
+        if self.commits:
+            State.get_db_session().commit()
+
     def analyze_database(self):
         State.get_db_session().execute("ANALYZE;")
 
@@ -126,6 +145,9 @@ class FlagModifiedFiles(StorageBaseSystem):
     def fetch_modified_rpm_details(self) -> ResultProxy:
         return self.file_difference.fetch_modified_rpm_details()
 
+    def fetch_unverified_rpm_details(self) -> ResultProxy:
+        return self.file_difference.fetch_unverified_rpm_details()
+
     def fetch_modified_files_in_rpm(self, rpm_info_id) -> ResultProxy:
         return self.file_difference.fetch_modified_files(
             rpm_info_id=rpm_info_id
@@ -154,6 +176,33 @@ class FlagModifiedFiles(StorageBaseSystem):
 
         return count
 
+    def process_unverified_files(
+            self,
+            unverified_rpm_files: ResultProxy
+    ) -> int:
+        """
+        Flags package files that were only compared by size, as the hash
+        policy sampled or skipped their digest
+        """
+
+        count = 0
+
+        for rpm_file in unverified_rpm_files:
+            rpm_file.file_unverified = True
+            State.get_db_session().add(rpm_file)
+            count += 1
+
+        if count:
+            log.warning(
+                f"{count} package files were not verified by digest, as "
+                f"their digest was sampled or skipped; only their size "
+                f"matches the package."
+            )
+
+        State.get_db_session().flush()
+
+        return count
+
 
 class StorePackageResults(StorageBase):
     """
@@ -196,6 +245,55 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
 
         return system
 
+    def build_file_manifest(self, system: System) -> BytesIO:
+        """
+        Builds the manifest walk.py uses to reuse the digests of files that
+        have not changed since the last gather.  Only rows stored with a stat
+        fingerprint are included.
+
+        :param system: system the manifest is built for
+        :return: zlib compressed, tab separated manifest
+        """
+
+        query = State.get_db_session().query(
+            FileDetail.file_location,
+            FileDetail.file_size,
+            FileDetail.file_mtime_ns,
+            FileDetail.file_ctime_ns,
+            FileDetail.file_inode,
+            FileDetail.file_device,
+            FileDetail.file_info,
+            FileDetail.md5_digest,
+            FileDetail.sha256_digest,
+            FileDetail.hash_policy,
+        ).filter(
+            (FileDetail.system_id == system.system_id) &
+            (FileDetail.file_type == "F") &
+            (FileDetail.file_mtime_ns != None) &
+            (FileDetail.file_ctime_ns != None) &
+            (FileDetail.file_inode != None) &
+            (FileDetail.file_device != None) &
+            (FileDetail.file_size != None)
+        )
+
+        manifest = BytesIO()
+        compressor = zlib.compressobj()
+        count = 0
+
+        for row in query.yield_per(50000):
+            line = '\t'.join(
+                '' if value is None else str(value) for value in row
+            )
+            manifest.write(compressor.compress(f'{line}\n'.encode('utf-8')))
+            count += 1
+
+        manifest.write(compressor.flush())
+        manifest.seek(0)
+
+        log.info(f"Built a manifest of {count} files.")
+
+        return manifest
+
     def store_files(self, **kwargs):
         file_iter = kwargs.get("file_iter")
 
@@ -222,7 +320,9 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
         log.info(f"Pruned {State.get_db_session().execute(delete_fdl).rowcount} links.")
 
         # delete FileStorage links
-        FileDifference(system=self.system).clear_system_file_storage()
+        FileDifference(system=self.system).clear_system_file_storage(
+            commit=self.commits,
+        )
 
         system_files = State.get_db_session().query(FileDetail).filter(
             FileDetail.system == self.system)
@@ -231,8 +331,7 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
 
         log.info("Pruned existing FileDetails.")
 
-        State.get_db_session().flush()
-        State.get_db_session().commit()
+        self.commit_step()
 
         objects = []
 
@@ -266,6 +365,13 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
                 "file_info": file_dict['info'] or None,
                 "file_perm_mode": file_dict['perm'] or None,
                 "origin": src.name,
+                "file_size": self._get_int(file_dict, 'size'),
+                "file_mtime_ns": self._get_int(file_dict, 'mtime_ns'),
+                "file_ctime_ns": self._get_int(file_dict, 'ctime_ns'),
+                "file_inode": self._get_int(file_dict, 'inode'),
+                "file_device": self._get_int(file_dict, 'dev'),
+                "hash_policy": file_dict.get('hash_policy') or None,
+                "hardlink_of": file_dict.get('link_of') or None,
             }
 
             objects.append(file_rec)
@@ -282,8 +388,7 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
             State.get_db_session().bulk_insert_mappings(FileDetail, objects)
 
         objects.clear()
-        State.get_db_session().flush()
-        State.get_db_session().commit()
+        self.commit_step()
 
         log.info('..done')
 
@@ -326,8 +431,7 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
         system_rpm_info.delete()
         log.info("Pruned existing RpmInfo records.")
 
-        State.get_db_session().flush()
-        State.get_db_session().commit()
+        self.commit_step()
 
         fieldnames = (
             'package_name',
@@ -409,6 +513,7 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
                     "file_flag": file['flag'],
                     "system_id": self.system.system_id,
                     "file_changed": None,
+                    "file_unverified": None,
                 }
             )
 
@@ -424,11 +529,22 @@ REFRESH MATERIALIZED VIEW resolved_symlinks WITH DATA;
             State.get_db_session().bulk_insert_mappings(RpmDetail, objects)
 
         objects.clear()
-        State.get_db_session().flush()
-        State.get_db_session().commit()
+        self.commit_step()
 
         log.info('..done')
 
+    @staticmethod
+    def _get_int(row: dict, key: str):
+        """
+        Returns a column as an int, or None for missing and empty columns.
+        Files gathered by older walkers do not have every column.
+        """
+
+        try:
+            return int((row.get(key) or '').strip())
+        except ValueError:
+            return None
+
     def _convert_results(
             self,
             file_iter: ssh.StringIterator = None,
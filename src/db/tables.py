@@ -224,6 +224,8 @@ class RpmDetail(Base):
     file_info = Column(String(length=1024))
     file_flag = Column(String(length=64))
     file_changed = Column(Boolean())
+    # matched by size only, as the walker sampled or skipped its digest
+    file_unverified = Column(Boolean())
     file_exists = Column(Boolean())
 
     rpm_info = relationship(
@@ -318,6 +320,15 @@ class FileDetail(Base):
         ForeignKey("rpm_info.rpm_info_id"),
         nullable=True,
     )
+    file_size = Column(BigInteger)
+    file_mtime_ns = Column(BigInteger)
+    file_ctime_ns = Column(BigInteger)
+    file_inode = Column(BigInteger)
+    file_device = Column(BigInteger)
+    # F=Full digest, S=Sampled digest, N=Not hashed
+    hash_policy = Column(String(1))
+    # earlier path of the same inode, whose digests this record reuses
+    hardlink_of = Column(String(1024))
 
     __table_args__ = (
         UniqueConstraint(
@@ -670,6 +681,35 @@ System.app_data_link = relationship(
 )
 
 
+class PipelineStage(Base):
+    """
+    The last completed run of a main.py pipeline stage for a system.  A
+    stage is skipped while its input fingerprint is unchanged.  Rows are
+    keyed by system name, as the system row does not exist until gather
+    has run.
+    """
+
+    schema = "iac"
+    __tablename__ = "pipeline_stage"
+
+    system_name = Column(String(length=128), primary_key=True)
+    stage = Column(String(length=32), primary_key=True)
+    fingerprint = Column(String(length=64), nullable=False)
+    output = Column(String(length=64), nullable=False)
+    completed_at = Column(DateTime(timezone=True), nullable=False)
+
+    def __repr__(self):
+        return (
+            '<PipelineStage(system_name="{}", stage="{}", fingerprint="{}", '
+            'completed_at="{}")>'
+        ).format(
+            self.system_name,
+            self.stage,
+            self.fingerprint,
+            self.completed_at,
+        )
+
+
 #class SystemServices(Base):
 #    """
 #    Table contains the list of defined system services and their start up
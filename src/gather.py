@@ -32,16 +32,416 @@
 #------------------------------------------------------------------------------
 
 
+import json
+import logging
 import os
 import sys
 import timeit
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from tempfile import TemporaryFile
+from io import BytesIO
 
 import db.tables as t
 from base.reflection import InstalledRpmInfo
 from db.storage import StorePackageResults
 import utils.os
+from utils.ssh import CHECKPOINT, TELEMETRY, StringIterator
+from load_details import finish_load
 from utils.time import seconds_to_minutes_with_seconds
 
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
+log = logging.getLogger(__name__)
+
+
+def get_walk_args(args) -> list:
+    """
+    Translates gather arguments into walk.py command-line arguments
+    """
+
+    walk_args = []
+
+    if args.walk_workers:
+        walk_args += [
+            '--workers', str(args.walk_workers),
+            '--worker-type', args.walk_worker_type,
+        ]
+
+    if args.walk_shards:
+        walk_args += ['--shards', str(args.walk_shards)]
+
+    for fstypes in args.walk_prune_fstypes:
+        walk_args += ['--prune-fstype', fstypes]
+
+    if args.walk_prune_default_fstypes:
+        walk_args.append('--prune-default-fstypes')
+
+    for device in args.walk_prune_devices:
+        walk_args += ['--prune-dev', str(device)]
+
+    if args.walk_xdev:
+        walk_args.append('--xdev')
+
+    if args.walk_hardlink_cache is not None:
+        walk_args += ['--hardlink-cache', str(args.walk_hardlink_cache)]
+
+    if args.walk_rate_limit:
+        walk_args += ['--rate-limit', args.walk_rate_limit]
+
+    if args.walk_nice:
+        walk_args += ['--nice', str(args.walk_nice)]
+
+    if args.walk_ionice_idle:
+        walk_args.append('--ionice-idle')
+
+    if args.walk_fadvise_dontneed:
+        walk_args.append('--fadvise-dontneed')
+
+    if args.walk_hash_sample_over:
+        walk_args += ['--hash-sample-over', args.walk_hash_sample_over]
+
+    if args.walk_hash_skip_over:
+        walk_args += ['--hash-skip-over', args.walk_hash_skip_over]
+
+    for option, values in (
+            ('--hash-full-glob', args.walk_hash_full_globs),
+            ('--hash-sample-glob', args.walk_hash_sample_globs),
+            ('--hash-skip-glob', args.walk_hash_skip_globs),
+            ('--hash-sample-mime', args.walk_hash_sample_mimes),
+            ('--hash-skip-mime', args.walk_hash_skip_mimes),
+    ):
+        for value in values:
+            walk_args += [option, value]
+
+    return walk_args
+
+
+@contextmanager
+def package_lines(
+        rpm_info: InstalledRpmInfo,
+        system: t.System,
+        args,
+        owned_paths: set = None,
+):
+    """
+    Yields the package listing lines of the system, which are written to
+    the listing file as they are read.  The paths owned by the packages
+    are added to owned_paths when it is given.
+    """
+
+    s = timeit.default_timer()
+
+    lines = rpm_info.get_packages()
+
+    if owned_paths is not None:
+        lines = add_owned_paths(lines, owned_paths)
+
+    with open_listing(f'{system.name}_packages.txt', args) as f:
+        if f is not None:
+            lines = tee_lines(lines, f)
+
+        yield lines
+
+    e = timeit.default_timer()
+
+    elapsed_r = seconds_to_minutes_with_seconds(s, e)
+
+    print(
+        f'Time to gather rpms was {elapsed_r["minutes"]} '
+        f'minutes and {elapsed_r["seconds"]} seconds.'
+    )
+
+
+def gather_packages(
+        rpm_info: InstalledRpmInfo,
+        system: t.System,
+        args,
+        owned_paths: set = None,
+):
+    """
+    Writes the package listing of the system, or with --direct-load loads
+    it into the database as it arrives.  The paths owned by the packages
+    are added to owned_paths when it is given.
+    """
+
+    with package_lines(rpm_info, system, args, owned_paths) as lines:
+        if args.direct_load:
+            # committed by finish_load
+            with StorePackageResults(name=system.name, commit=False) as store:
+                store.store_packages(pkg_data=lines)
+        else:
+            drain(lines)
+
+
+def add_owned_paths(lines: StringIterator, owned_paths: set):
+
+    for line in lines:
+        fields = line.split('\t')
+
+        if len(fields) > 6 and fields[6] != '(none)':
+            owned_paths.add(fields[6])
+
+        yield line
+
+
+def fetch_packages(
+        rpm_info: InstalledRpmInfo,
+        system: t.System,
+        args,
+):
+    """
+    Writes the package listing of the system while the files are gathered
+    on another channel.  With --direct-load the listing is spooled to a
+    temporary file instead, as the database session cannot be shared with
+    the file load, and load_packages stores it afterwards.
+
+    :return: the rewound spool with --direct-load, otherwise None
+    """
+
+    spool = (
+        TemporaryFile('w+', errors='surrogateescape')
+        if args.direct_load else None
+    )
+
+    with package_lines(rpm_info, system, args) as lines:
+        if spool is not None:
+            lines = tee_lines(lines, spool)
+
+        drain(lines)
+
+    if spool is not None:
+        spool.seek(0)
+
+    return spool
+
+
+def load_packages(system: t.System, spool):
+
+    # committed by finish_load
+    with spool, StorePackageResults(name=system.name, commit=False) as store:
+        store.store_packages(pkg_data=spool)
+
+
+def gather_files(
+        rpm_info: InstalledRpmInfo,
+        system: t.System,
+        args,
+        walk_args: list,
+        walk_files: dict,
+):
+    """
+    Writes the file listing of the system, or with --direct-load loads it
+    into the database as it arrives.  With --walk-checkpoint-every the
+    last walker checkpoint and the size of the listing up to it are kept
+    in a side file, which --resume uses to continue a dropped walk.
+
+    :return: the walker's last telemetry record, with the peak RSS seen,
+        or None without --walk-telemetry
+    """
+
+    files_name = f'{system.name}_files.txt'
+    checkpoint_name = f'{system.name}_files.ckpt'
+
+    walk_args = list(walk_args)
+    mode = 'w'
+    header = None
+    telemetry = {}
+
+    if args.walk_telemetry:
+        walk_args += ['--telemetry', str(args.walk_telemetry)]
+
+    if args.walk_checkpoint_every:
+        walk_args += ['--checkpoint-every', str(args.walk_checkpoint_every)]
+
+    checkpoint = read_checkpoint(checkpoint_name) if args.resume else None
+
+    if checkpoint:
+        offset, dir_path = checkpoint
+
+        with open(files_name, 'r+') as f:
+            header = f.readline()
+            f.truncate(offset)
+
+        mode = 'a'
+        walk_args += ['--resume-after', dir_path]
+
+        print(f'Resuming the walk after {dir_path}.')
+
+    with open_listing(files_name, args, mode) as f:
+        lines = walk_lines(
+            rpm_info.get_files(
+                walk_args=walk_args,
+                walk_files=walk_files,
+                binary=args.binary_walk,
+            ),
+            f,
+            checkpoint_name,
+            header,
+            telemetry,
+        )
+
+        if args.direct_load:
+            # committed by finish_load, so a walk that fails part way
+            # leaves the system's previous load in place
+            with StorePackageResults(name=system.name, commit=False) as store:
+                store.store_files(file_iter=lines)
+        else:
+            drain(lines)
+
+    if os.path.exists(checkpoint_name):
+        os.remove(checkpoint_name)
+
+    return telemetry or None
+
+
+def walk_lines(
+        lines: StringIterator,
+        f,
+        checkpoint_name: str,
+        header: str,
+        telemetry: dict,
+) -> StringIterator:
+    """
+    Yields the record lines of a walk, writing them to f when it is given.
+    Checkpoint lines are kept in the checkpoint file, telemetry lines are
+    logged and the last one is kept in telemetry, and the header line a
+    resumed walk repeats is dropped.
+    """
+
+    for line in lines:
+        if line.startswith(CHECKPOINT):
+            if f is not None:
+                f.flush()
+                write_checkpoint(
+                    checkpoint_name,
+                    f.tell(),
+                    line[len(CHECKPOINT) + 1:].rstrip('\n'),
+                )
+            continue
+
+        if line.startswith(TELEMETRY):
+            record = json.loads(line[len(TELEMETRY) + 1:])
+            record['peak_rss_bytes'] = max(
+                telemetry.get('peak_rss_bytes', 0),
+                record['rss_bytes'],
+            )
+            telemetry.update(record)
+            log.info(format_telemetry(record))
+            continue
+
+        # a resumed walk repeats the header line
+        if header is not None:
+            skip = line == header
+            header = None
+
+            if skip:
+                continue
+
+        if f is not None:
+            f.write(line)
+
+        yield line
+
+
+def open_listing(file_name: str, args, mode: str = 'w'):
+    """
+    Opens a listing file, unless --direct-load is used without --tee
+    """
+
+    if args.direct_load and not args.tee:
+        return nullcontext()
+
+    return open(file_name, mode, errors='surrogateescape')
+
+
+def tee_lines(lines: StringIterator, f) -> StringIterator:
+
+    for line in lines:
+        f.write(line)
+        yield line
+
+
+def drain(lines: StringIterator):
+
+    for line in lines:
+        pass
+
+
+def format_telemetry(telemetry: dict) -> str:
+    return (
+        f'Walk: {telemetry["files"]} files, '
+        f'{telemetry["files_per_second"]:.0f} files/s, '
+        f'{telemetry["bytes_per_second"] / 1048576:.1f} MiB/s hashed, '
+        f'RSS {telemetry["rss_bytes"] / 1048576:.0f} MiB, '
+        f'in {telemetry["current_dir"]}'
+    )
+
+
+def print_walk_breakdown(telemetry: dict):
+    """
+    Prints where the walker spent its time.  With parallel walker workers
+    the stat, magic and hash times can add up to more than the elapsed
+    time.
+    """
+
+    elapsed = max(telemetry['elapsed_seconds'], 1e-6)
+
+    print(
+        f'Walker read {telemetry["files"]} files at '
+        f'{telemetry["files"] / elapsed:.0f} files/s and hashed '
+        f'{telemetry["bytes_hashed"] / 1048576:.0f} MiB at '
+        f'{telemetry["bytes_hashed"] / 1048576 / elapsed:.1f} MiB/s; '
+        f'peak RSS was {telemetry["peak_rss_bytes"] / 1048576:.0f} MiB.'
+    )
+
+    print(
+        f'Walker read {telemetry["bytes_read"] / 1048576:.0f} MiB of file '
+        f'content at {telemetry["bytes_read"] / 1048576 / elapsed:.1f} MiB/s.'
+    )
+
+    for name in ('stat', 'magic', 'hash', 'throttle'):
+        seconds = telemetry[f'{name}_seconds']
+        print(
+            f'  {name}: {seconds:.1f} seconds, '
+            f'{100 * seconds / elapsed:.0f}% of the walk'
+        )
+
+
+def read_checkpoint(checkpoint_name: str):
+    """
+    Returns the (offset, directory) of the last checkpoint or None
+    """
+
+    try:
+        with open(checkpoint_name, 'r') as f:
+            offset, dir_path = f.read().rstrip('\n').split('\t', 1)
+    except (OSError, ValueError):
+        return None
+
+    return int(offset), dir_path
+
+
+def write_checkpoint(checkpoint_name: str, offset: int, dir_path: str):
+
+    with open(f'{checkpoint_name}.tmp', 'w') as f:
+        f.write(f'{offset}\t{dir_path}\n')
+
+    os.replace(f'{checkpoint_name}.tmp', checkpoint_name)
+
+
+def build_path_list(paths) -> BytesIO:
+    """
+    Builds the zlib compressed path list read by walk.py's
+    --hash-only-paths
+    """
+
+    return BytesIO(zlib.compress('\n'.join(sorted(paths)).encode('utf-8')))
+
 
 def main():
 
@@ -65,10 +465,20 @@ def main():
         exec_path=exec_path,
         tty=args.tty,
     ) as rpm_info:
-        with StorePackageResults(gather=True) as store_results:
+        with StorePackageResults(gather=True) as store_results, \
+                ThreadPoolExecutor(max_workers=3) as executor:
+
+            # the remote queries are independent, so each runs on its own
+            # channel of the one connection
+            host_info = executor.submit(rpm_info.get_host_info)
+            os_info = executor.submit(rpm_info.get_os_info)
+            digest = None
+
+            if args.walk_single_digest and not args.insert_only:
+                digest = executor.submit(
+                    rpm_info.get_file_digest_algorithm
+                )
 
-            info = rpm_info.get_host_info()
-            os_info = rpm_info.get_os_info()
             system = store_results.store_system_info(
                 name=args.name,
                 hostname=args.hostname or args.name,
@@ -76,18 +486,49 @@ def main():
                 username=args.username or os.getlogin(),
                 key_file=args.key_file,
                 use_tty=args.tty,
-                **{**info, **os_info}
+                **{**host_info.result(), **os_info.result()}
             )
 
             if args.insert_only:
                 print("Exiting after system insert")
                 return
 
+            walk_args = get_walk_args(args)
+
+            if digest is not None:
+                print(f'Computing {digest.result()} file digests.')
+                walk_args += ['--digest', digest.result()]
+
+            walk_files = {}
+            packages = None
+
+            if args.walk_hash_owned_only:
+                # the walk needs the package file list first
+                owned_paths = set()
+                gather_packages(rpm_info, system, args, owned_paths)
+                walk_files['--hash-only-paths'] = build_path_list(owned_paths)
+            else:
+                packages = executor.submit(
+                    fetch_packages,
+                    rpm_info,
+                    system,
+                    args,
+                )
+
+            if args.incremental:
+                walk_files['--manifest'] = store_results.build_file_manifest(
+                    system
+                )
+
             sf = timeit.default_timer()
 
-            with open(f'{system.name}_files.txt', 'w') as f:
-                for line in rpm_info.get_files():
-                    f.write(line)
+            telemetry = gather_files(
+                rpm_info,
+                system,
+                args,
+                walk_args,
+                walk_files,
+            )
 
             ef = timeit.default_timer()
 
@@ -98,20 +539,17 @@ def main():
                 f'minutes and {elapsed_f["seconds"]} seconds.'
             )
 
-            s = timeit.default_timer()
+            if telemetry is not None:
+                print_walk_breakdown(telemetry)
 
-            with open(f'{system.name}_packages.txt', 'w') as f:
-                for line in rpm_info.get_packages():
-                    f.write(line)
+            if packages is not None:
+                spool = packages.result()
 
-            e = timeit.default_timer()
+                if spool is not None:
+                    load_packages(system, spool)
 
-            elapsed_r = seconds_to_minutes_with_seconds(s, e)
-
-            print(
-                f'Time to gather rpms was {elapsed_r["minutes"]} '
-                f'minutes and {elapsed_r["seconds"]} seconds.'
-            )
+            if args.direct_load:
+                finish_load(system.name)
 
 
 if __name__ == '__main__':
@@ -30,6 +30,7 @@
 # DM19-0055
 #------------------------------------------------------------------------------
 
+import asyncio
 import re
 import os
 from io import BytesIO
@@ -37,6 +38,7 @@ from typing import List
 from sqlalchemy.orm.session import Session
 from sqlalchemy.sql import func
 from utils.session import State
+from utils.ssh import AsyncSshConnector
 from base.exceptions import RpmFileNotFound
 from db.tables import (
     RpmInfo,
@@ -45,7 +47,6 @@ from db.tables import (
     System,
 )
 from base.enums import FileOrigin, OSDistro
-from utils.ssh import SftpWrapper
 
 
 def package_installed(package_name: str) -> List[RpmInfo]:
@@ -180,7 +181,7 @@ def path_rehydrate_as_bytes(path_spec) -> BytesIO:
     """
     Return the contents of a modified file.
     """
-    with SftpWrapper(State.get_ssh_session().get_sftp_client()) as sftp:
+    with State.get_ssh_session().open_sftp() as sftp:
         fh = sftp.get_file_handle(remote_name=path_spec)
 
         return fh
@@ -193,6 +194,25 @@ def path_rehydrate(path_spec) -> str:
     return path_rehydrate_as_bytes(path_spec).getvalue().decode('utf-8')
 
 
+def path_rehydrate_many(path_specs, max_in_flight: int = 16) -> dict:
+    """
+    Return the contents of several modified text files, keyed by path.
+    The files are fetched concurrently.
+    """
+
+    async def fetch_all():
+        async with AsyncSshConnector(
+                State.get_ssh_session(),
+                max_in_flight=max_in_flight,
+        ) as remote:
+            return await remote.fetch_many(path_specs)
+
+    return {
+        path_spec: fh.getvalue().decode('utf-8')
+        for path_spec, fh in asyncio.run(fetch_all()).items()
+    }
+
+
 def conf_file_field(conf_file, field_name):
     """
     Return a field value from a Linux configuration file
@@ -89,16 +89,19 @@ class SystemdMUTargetCentOS(RuleBase):
             if f.file_location[-8:] == '.service':
                 s.append(f.file_location.rpartition('/')[2])
         
-        for f in s:
-            if not f in known_services:
-                self._process_service_def(mu_dir_path + '/' + f)
+        # fetch the unknown service files together
+        svc_files = hutils.path_rehydrate_many(
+            mu_dir_path + '/' + f for f in s if not f in known_services
+        )
+
+        for path_spec, svc_file in svc_files.items():
+            self._process_service_def(path_spec, svc_file)
         
         self._log_complete()
     
-    def _process_service_def(self, path_spec):
+    def _process_service_def(self, path_spec, svc_file):
         # We assume that path_spec points to file, and file exists
         self._log('Found possible user-defined service ' + path_spec)
-        svc_file = hutils.path_rehydrate(path_spec)
         # find the ExecStart
         m = re.search(r'^ExecStart=.+', svc_file, re.M)
         if m == None:
@@ -74,24 +74,41 @@ def main():
     log.info("Storing package results.")
     with StorePackageResults(name=args.name) as store:
 
-        with open(f'{exec_path}/{args.name}_files.txt', 'r') as f:
+        with open(
+                f'{exec_path}/{args.name}_files.txt',
+                'r',
+                errors='surrogateescape',
+        ) as f:
             store.store_files(file_iter=f)
 
         with open(f'{exec_path}/{args.name}_packages.txt', 'r') as f:
             store.store_packages(pkg_data=f)
 
+    finish_load(args.name)
+
+
+def finish_load(name: str):
+    """
+    Runs the steps that follow storing a system's files and packages, for
+    load_details.py and gather.py --direct-load.  gather.py leaves its
+    load uncommitted, so the first step commits it.
+    """
+
+    with StorePackageResults(name=name) as store:
         # refresh the materialized view
         store.refresh_mviews()
         store.analyze_database()
 
-    with UpdateFileDetail(name=args.name) as up:
+    with UpdateFileDetail(name=name) as up:
         up.populate_rpm_detail()
 
-    with FlagModifiedFiles(name=args.name) as linker:
+    with FlagModifiedFiles(name=name) as linker:
         flagged = linker.process_modified_files(
             linker.fetch_modified_rpm_details()
         )
-
+        linker.process_unverified_files(
+            linker.fetch_unverified_rpm_details()
+        )
 
 
 if __name__ == '__main__':
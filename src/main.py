@@ -34,49 +34,96 @@
 """
 Main script for DRAT Tool.
 """
-from subprocess import call
+import logging
 import utils.os
+from db.pipeline import PipelineStageCache, get_schema_revision
+from utils.fleet import (
+    RULE_SET,
+    FleetScheduler,
+    build_stages,
+    format_summary,
+    hash_tree,
+    read_config,
+)
 from utils.session import State
 
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+)
+
 
 def main():
-    args = utils.os.GetArguments().parse()
-    
-    # Require one argument - name of configuration file
-    conf_file = args.name
-    with open(conf_file) as f:
-        gather_args = f.read()
-    f.close()
-    gather_args = gather_args.splitlines()
-    
+    args = utils.os.GetFleetArguments().parse()
+
     # Each line in the configuration file is an argument string for gather.py
-    # One line per system to gather and analyze.
-    for line in gather_args:
-        # support commenting-out a line
-        if not line[0] == '#':
-            name = line.strip().split(" ")[-1]
-
-            print(f"System name: {name}")
-
-            print("Running gather.py")
-            cmd = line.strip().split(" ")
-            cmd.insert(0, "./gather.py")
-            call(cmd)
-    
-            # load_details.py just wants the system name (no SSH connection)
-            # This is a hack - we assume that the last word in each gather
-            # argument is the system name.
-            print("Running load_details.py")
-            call(["./load_details.py", name])
-    
-            # run_analysis.py takes the full configuration string
-            print("Running run_analysis.py")
-            cmd = line.rstrip().split(" ")
-            call(["./run_analysis.py", name])
-
-            # generate ansible yaml
-            print("Running generate.py")
-            call(["./generate.py", "-o output", name])
+    # One line per system to gather and analyze.  The system name is the
+    # last word of the line.
+    systems = read_config(args.name)
+
+    if args.systems:
+        missing = set(args.systems) - set(systems)
+
+        if missing:
+            raise SystemExit(
+                f"Not in {args.name}: {', '.join(sorted(missing))}"
+            )
+
+        systems = {
+            name: gather_args
+            for name, gather_args in systems.items()
+            if name in args.systems
+        }
+
+    cache = PipelineStageCache()
+
+    if args.invalidate:
+        for name in systems:
+            for stage in args.invalidate:
+                cache.forget(name, stage)
+
+        print(
+            f"Invalidated {', '.join(args.invalidate)} for "
+            f"{len(systems)} systems."
+        )
+        return
+
+    versions = {
+        'schema': get_schema_revision(),
+        'rules': hash_tree(RULE_SET),
+    }
+
+    scheduler = FleetScheduler(
+        ssh_jobs=args.ssh_jobs,
+        db_jobs=args.db_jobs,
+        retries=args.retries,
+        retry_delay=args.retry_delay,
+        log_dir=args.system_log_dir,
+        cache=None if args.no_cache else cache,
+        force=args.force,
+    )
+
+    print(
+        f"Running {len(systems)} systems, {args.ssh_jobs} SSH and "
+        f"{args.db_jobs} database stages at a time.  The output of each "
+        f"system is in {args.system_log_dir}/<system>.log."
+    )
+
+    statuses = scheduler.run({
+        name: build_stages(
+            gather_args,
+            versions,
+            content_transfer=args.content_transfer,
+            gather_max_age=args.gather_max_age * 3600,
+        )
+        for name, gather_args in systems.items()
+    })
+
+    for line in format_summary(statuses):
+        print(line)
+
+    if any(status.state != 'done' for status in statuses):
+        raise SystemExit(1)
 
 
 if __name__ == '__main__':
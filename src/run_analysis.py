@@ -65,12 +65,12 @@ def main(args):
     # All of the pattern matching, etc. has been pushed down into the rules
     run_rules.main()
 
-    fetch_files.process_user_content()
+    fetch_files.process_user_content(transfer=args.content_transfer)
 
 
 if __name__ == '__main__':
     try:
-        arguments = utils.os.GetMinimumSshArguments().parse()
+        arguments = utils.os.GetAnalysisArguments().parse()
 
         LogConfig.initialize(
             path="logs/run_analysis.log",
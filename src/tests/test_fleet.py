@@ -0,0 +1,190 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+import threading
+import time
+from utils.fleet import (
+    DB,
+    SSH,
+    FleetScheduler,
+    build_stages,
+    format_summary,
+    read_config,
+)
+
+
+def test_read_config_and_stages(tmp_path):
+    conf = tmp_path / "systems.conf"
+    conf.write_text(
+        "-n host1 -u root one\n"
+        "\n"
+        "# -n host2 two\n"
+        "-n host3 --direct-load three\n"
+    )
+
+    systems = read_config(conf.as_posix())
+
+    assert list(systems) == ["one", "three"]
+    assert [s.name for s in build_stages(systems["one"])] == [
+        "gather", "load", "analyze", "generate",
+    ]
+
+    gather = build_stages(systems["three"])[0]
+    assert gather.command == ["./gather.py", "-n", "host3", "--direct-load",
+                              "three"]
+    assert gather.resources == (SSH, DB)
+
+
+def test_limits_and_retry():
+    lock = threading.Lock()
+    running = {SSH: 0, DB: 0}
+    peak = {SSH: 0, DB: 0}
+    failed_once = set()
+
+    def runner(name, stage):
+        with lock:
+            for resource in stage.resources:
+                running[resource] += 1
+                peak[resource] = max(peak[resource], running[resource])
+
+        time.sleep(0.02)
+
+        with lock:
+            for resource in stage.resources:
+                running[resource] -= 1
+
+        if name == "bad" and stage.name == "load":
+            return 1
+
+        if name == "flaky" and stage.name not in failed_once:
+            failed_once.add(stage.name)
+            return 1
+
+        return 0
+
+    scheduler = FleetScheduler(
+        ssh_jobs=2, db_jobs=1, retries=1, retry_delay=0, runner=runner
+    )
+
+    statuses = scheduler.run({
+        name: build_stages(["-n", name, name])
+        for name in ("a", "b", "c", "d", "bad", "flaky")
+    })
+
+    assert peak == {SSH: 2, DB: 1}
+
+    by_name = {status.name: status for status in statuses}
+    assert by_name["a"].state == "done"
+    assert by_name["flaky"].state == "done"
+    assert by_name["flaky"].attempts == {
+        "gather": 2, "load": 2, "analyze": 2, "generate": 2,
+    }
+    assert by_name["bad"].state == "failed"
+    assert by_name["bad"].stage == "load"
+    assert "analyze" not in by_name["bad"].attempts
+
+    summary = format_summary(statuses)
+    assert summary[-1] == "5 of 6 systems completed."
+
+
+class MemoryCache(object):
+
+    def __init__(self):
+        self.rows = {}
+
+    def get_output(self, system_name, stage, fingerprint, max_age=None):
+        row = self.rows.get((system_name, stage))
+
+        if not row or row[0] != fingerprint:
+            return None
+
+        if max_age is not None and time.time() - row[2] > max_age:
+            return None
+
+        return row[1]
+
+    def complete(self, system_name, stage, fingerprint, output):
+        self.rows[(system_name, stage)] = (fingerprint, output, time.time())
+
+    def forget(self, system_name, stage=None):
+        self.rows.pop((system_name, stage), None)
+
+
+def test_skip_unchanged(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    ran = []
+    remote = {"files": "files\n"}
+
+    def runner(name, stage):
+        ran.append(stage.name)
+
+        if stage.name == "gather":
+            (tmp_path / f"{name}_files.txt").write_text(remote["files"])
+            (tmp_path / f"{name}_packages.txt").write_text("packages\n")
+
+        return 0
+
+    cache = MemoryCache()
+
+    def run(rules="1", force=(), gather_max_age=0):
+        ran.clear()
+        FleetScheduler(runner=runner, cache=cache, force=force).run({
+            "one": build_stages(
+                ["one"],
+                {"schema": "a", "rules": rules},
+                gather_max_age=gather_max_age,
+            )
+        })
+        return list(ran)
+
+    assert run() == ["gather", "load", "analyze", "generate"]
+
+    # every run gathers again, and unchanged listings are not reloaded
+    assert run() == ["gather"]
+
+    # a rule change reruns the analysis and what follows it
+    assert run(rules="2") == ["gather", "analyze", "generate"]
+
+    # a recent enough collection is reused
+    assert run(rules="2", gather_max_age=3600) == []
+    assert run(rules="2", gather_max_age=3600, force=("gather",)) == [
+        "gather",
+    ]
+
+    # a changed listing reloads
+    remote["files"] = "changed\n"
+    assert run(rules="2") == ["gather", "load", "analyze", "generate"]
+
+    # a listing that no longer matches its gather is gathered again
+    (tmp_path / "one_files.txt").write_text("edited\n")
+    assert run(rules="2", gather_max_age=3600) == ["gather"]
@@ -0,0 +1,113 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+from types import SimpleNamespace
+import pytest
+import gather
+from utils.ssh import CHECKPOINT
+
+HEADER = "path\tsize\n"
+
+
+class WalkRemote(object):
+    """
+    Stands in for InstalledRpmInfo.get_files with canned walker output.
+    A walk given an exception raises it once its lines are read, as a
+    dropped connection would.
+    """
+
+    def __init__(self, *walks):
+        self.walks = list(walks)
+        self.walk_args = []
+
+    def get_files(self, walk_args=None, walk_files=None, binary=False):
+        self.walk_args.append(walk_args)
+        lines, error = self.walks.pop(0)
+
+        yield from lines
+
+        if error is not None:
+            raise error
+
+
+def gather_args(**kwargs):
+    return SimpleNamespace(**{
+        "resume": False,
+        "walk_telemetry": 0,
+        "walk_checkpoint_every": 2,
+        "direct_load": False,
+        "tee": False,
+        "binary_walk": False,
+        **kwargs,
+    })
+
+
+def test_gather_files_resumes_from_checkpoint(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    system = SimpleNamespace(name="one")
+
+    remote = WalkRemote(
+        (
+            [
+                HEADER,
+                "/a/1\t1\n",
+                "/a/2\t2\n",
+                f"{CHECKPOINT}\t/a\n",
+                "/b/3\t3\n",
+            ],
+            ConnectionError("dropped"),
+        ),
+        # the resumed walk repeats the header and starts after /a
+        ([HEADER, "/b/3\t3\n", "/b/4\t4\n"], None),
+    )
+
+    with pytest.raises(ConnectionError):
+        gather.gather_files(remote, system, gather_args(), [], {})
+
+    listing = tmp_path / "one_files.txt"
+    checkpoint = tmp_path / "one_files.ckpt"
+
+    # the records after the checkpoint were written, and are dropped on
+    # resume
+    assert listing.read_text().endswith("/b/3\t3\n")
+    assert gather.read_checkpoint(checkpoint.as_posix()) == (
+        len(HEADER + "/a/1\t1\n/a/2\t2\n"), "/a"
+    )
+
+    gather.gather_files(remote, system, gather_args(resume=True), [], {})
+
+    assert remote.walk_args[1][-2:] == ["--resume-after", "/a"]
+    assert listing.read_text() == (
+        HEADER + "/a/1\t1\n/a/2\t2\n/b/3\t3\n/b/4\t4\n"
+    )
+    assert not checkpoint.exists()
@@ -0,0 +1,147 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+import io
+import os
+import subprocess
+import tarfile
+import threading
+from types import SimpleNamespace
+
+from utils.ssh import (
+    ByteStreamLineSplitter,
+    ByteStreamReader,
+    ByteStreamStringParser,
+    PooledConnection,
+    TAR_FILES_COMMAND,
+    read_tar_files,
+)
+
+
+def chunks_of(data: bytes, size: int):
+    return [data[pos:pos + size] for pos in range(0, len(data), size)]
+
+
+def test_parse_stream_lines():
+    data = "café\r\n\n/usr/bin/€\tF\nlast".encode("utf-8")
+
+    # every chunk size, including ones that split the multi-byte characters
+    for size in range(1, len(data) + 1):
+        assert list(
+            ByteStreamStringParser().parse_stream(iter(chunks_of(data, size)))
+        ) == ["café\n", "\n", "/usr/bin/€\tF\n", "last"]
+
+
+def test_split_stream_bytes():
+    data = b"a\r\nb\r\r\nc\nd"
+
+    for size in range(1, len(data) + 1):
+        assert list(
+            ByteStreamLineSplitter().split_stream(iter(chunks_of(data, size)))
+        ) == [b"a\n", b"b\r\n", b"c\n", b"d"]
+
+
+def test_read_tar_stream():
+    archive = io.BytesIO()
+
+    with tarfile.open(fileobj=archive, mode="w:gz") as tar:
+        for name, data in (("/etc/a", b"x" * 70000), ("/etc/b", b"")):
+            member = tarfile.TarInfo(name)
+            member.size = len(data)
+            tar.addfile(member, io.BytesIO(data))
+
+    with tarfile.open(
+            fileobj=io.BufferedReader(ByteStreamReader(
+                iter(chunks_of(archive.getvalue(), 1000))
+            )),
+            mode="r|gz",
+    ) as tar:
+        assert [
+            (member.name, len(tar.extractfile(member).read()))
+            for member in tar
+        ] == [("/etc/a", 70000), ("/etc/b", 0)]
+
+
+def test_read_tar_files_with_hardlinks(tmp_path):
+    first = tmp_path / "first"
+    first.write_bytes(b"linked\n" * 1000)
+    os.link(first.as_posix(), (tmp_path / "second").as_posix())
+    (tmp_path / "other").write_bytes(b"")
+
+    names = [(tmp_path / name).as_posix() for name in (
+        "first", "second", "other", "missing",
+    )]
+
+    archive = subprocess.run(
+        TAR_FILES_COMMAND,
+        shell=True,
+        input=b"".join(name.encode("utf-8") + b"\0" for name in names),
+        stdout=subprocess.PIPE,
+        check=True,
+    ).stdout
+
+    assert list(read_tar_files(iter(chunks_of(archive, 4096)))) == [
+        (names[0], b"linked\n" * 1000),
+        (names[1], b"linked\n" * 1000),
+        (names[2], b""),
+    ]
+
+
+class FakeSshClient:
+    def __init__(self):
+        self.opened = []
+
+    def open_sftp(self):
+        sftp_client = SimpleNamespace(
+            sock=SimpleNamespace(closed=False),
+            close=lambda: None,
+        )
+        self.opened.append(sftp_client)
+        return sftp_client
+
+
+def test_pooled_connection_sftp_session_per_thread():
+    connection = PooledConnection(FakeSshClient())
+
+    main_client = connection.get_sftp_client()
+    assert connection.get_sftp_client() is main_client
+
+    other_clients = []
+    thread = threading.Thread(
+        target=lambda: other_clients.append(connection.get_sftp_client())
+    )
+    thread.start()
+    thread.join()
+
+    assert other_clients[0] is not main_client
+    assert len(connection.client.opened) == 2
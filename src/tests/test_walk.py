@@ -0,0 +1,450 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+import hashlib
+import os
+import subprocess
+import sys
+import threading
+import time
+import zlib
+from io import StringIO
+from pathlib import Path
+import pytest
+import walk
+from utils.ssh import make_tty_script_command
+
+
+def test_walk_script_survives_tty_heredoc():
+    script = Path(walk.__file__).read_text()
+
+    # cat stands in for sudo python, so the output is the script as the
+    # remote python would read it from the here-document
+    result = subprocess.run(
+        ["bash"],
+        input=make_tty_script_command("cat", script),
+        stdout=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+
+    assert result.stdout == script + "\n\n\nexit_code=0\n"
+
+    namespace = {"__name__": "walk_heredoc"}
+    exec(compile(result.stdout, "walk.py", "exec"), namespace)
+
+    assert namespace["unescape_mount"](r"/mnt/a\040b\134c") == "/mnt/a b\\c"
+
+
+@pytest.mark.parametrize("use_scandir", [True, False])
+def test_pooled_walk_reuses_hardlink_digests(tmp_path, monkeypatch,
+                                             use_scandir):
+    tmp_path.joinpath("first").write_bytes(b"linked\n" * 100)
+    os.link(
+        tmp_path.joinpath("first").as_posix(),
+        tmp_path.joinpath("second").as_posix(),
+    )
+
+    walk.UNAME = "Linux"
+    walk.HARDLINKS.clear()
+
+    # the os.walk fallback of targets without scandir has no stat to pass
+    if not use_scandir:
+        monkeypatch.setattr(walk, "scandir", None)
+
+    records = {
+        rec["path"]: rec
+        for rec in walk.walk_filesystem_pooled(tmp_path.as_posix())
+    }
+
+    first, second = (
+        records[tmp_path.joinpath(name).as_posix()]
+        for name in ("first", "second")
+    )
+
+    # whichever name was walked second reuses the digests of the first
+    linked = [rec for rec in (first, second) if rec["link_of"]]
+    assert len(linked) == 1
+    assert linked[0]["link_of"] in (first["path"], second["path"])
+    assert linked[0]["link_of"] != linked[0]["path"]
+    assert first["md5"] == second["md5"] != ""
+
+
+def test_telemetry_while_no_records_are_written():
+    stream = StringIO()
+    reporter = walk.TelemetryReporter(walk.TextRecordWriter(stream), 0.05)
+
+    # as when one large file is being hashed
+    reporter.begin()
+    time.sleep(0.3)
+    reporter.end()
+
+    lines = stream.getvalue().splitlines()
+
+    assert len(lines) >= 3
+    assert all(line.startswith(walk.TELEMETRY_MARKER) for line in lines)
+
+
+def test_telemetry_counts_from_threads():
+    telemetry = walk.Telemetry()
+
+    def count():
+        for _ in range(10000):
+            telemetry.count("bytes_read", 1)
+
+    threads = [threading.Thread(target=count) for _ in range(8)]
+
+    for thread in threads:
+        thread.start()
+
+    for thread in threads:
+        thread.join()
+
+    assert telemetry.counts()["bytes_read"] == 80000
+
+
+@pytest.fixture()
+def tree(tmp_path: Path):
+    for name in ("a/x/f1", "a/x/f2", "a/f3", "b/y/f4", "b/f5", "f6"):
+        path = tmp_path / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(name)
+
+    tmp_path.joinpath("c").mkdir()
+
+    walk.UNAME = "Linux"
+    walk.HARDLINKS.clear()
+
+    return tmp_path
+
+
+def write_checkpointed_walk(root: Path, checkpoint_every: int):
+    """
+    :return: the record paths and (checkpoint directory, number of records
+        before it) of a walk of root
+    """
+
+    stream = StringIO()
+    walk.write_records(
+        walk.walk_filesystem(root.as_posix()),
+        walk.TextRecordWriter(stream),
+        checkpoint_every=checkpoint_every,
+    )
+
+    paths = []
+    checkpoints = []
+
+    for line in stream.getvalue().splitlines()[1:]:
+        if line.startswith(walk.CHECKPOINT_MARKER):
+            checkpoints.append((line.split("\t", 1)[1], len(paths)))
+        else:
+            paths.append(line.split("\t", 1)[0])
+
+    return paths, checkpoints
+
+
+def test_checkpoints_follow_finished_directories(tree, monkeypatch):
+    monkeypatch.setattr(walk, "SORTED", True)
+
+    paths, checkpoints = write_checkpointed_walk(tree, 2)
+
+    assert len(checkpoints) >= 3
+
+    for dir_path, written in checkpoints:
+        key = walk.get_path_key(dir_path)
+
+        # every entry of the directory is written before its checkpoint
+        assert {
+            os.path.join(dir_path, name) for name in os.listdir(dir_path)
+        } <= set(paths[:written])
+
+        # and none of the directories up to it has entries after it
+        assert all(
+            walk.get_path_key(os.path.dirname(path)) > key
+            for path in paths[written:]
+        )
+
+    keys = [walk.get_path_key(dir_path) for dir_path, _ in checkpoints]
+    assert keys == sorted(keys)
+
+
+@pytest.mark.parametrize("use_scandir", [True, False])
+def test_resume_after_checkpoint(tree, monkeypatch, use_scandir):
+    monkeypatch.setattr(walk, "SORTED", True)
+
+    if not use_scandir:
+        monkeypatch.setattr(walk, "scandir", None)
+
+    paths, checkpoints = write_checkpointed_walk(tree, 1)
+
+    assert len(checkpoints) >= 3
+
+    for dir_path, written in checkpoints:
+        monkeypatch.setattr(
+            walk, "RESUME_AFTER", walk.get_path_key(dir_path)
+        )
+
+        resumed = [
+            rec["path"] for rec in walk.walk_filesystem(tree.as_posix())
+        ]
+
+        # nothing is dropped or written twice
+        assert paths[:written] + resumed == paths
+
+
+@pytest.mark.parametrize("worker_type", ["thread", "process"])
+def test_pooled_walk_matches_serial_walk(tree, worker_type):
+    serial = list(walk.walk_filesystem(tree.as_posix()))
+    walk.HARDLINKS.clear()
+
+    assert list(walk.walk_filesystem_pooled(
+        tree.as_posix(),
+        workers=3,
+        worker_type=worker_type,
+    )) == serial
+
+
+def test_sharded_walk_matches_serial_walk(tree, monkeypatch):
+    # small units, so shards hand directories back as new units
+    monkeypatch.setattr(walk, "SHARD_UNIT_ENTRIES", 2)
+
+    serial = list(walk.walk_filesystem(tree.as_posix()))
+    sharded = list(walk.walk_filesystem_sharded(tree.as_posix(), shards=3))
+
+    # records come out grouped by work unit, so only the root is in order
+    assert sharded[0] == serial[0]
+    assert sorted(sharded, key=lambda rec: rec["path"]) == sorted(
+        serial, key=lambda rec: rec["path"]
+    )
+
+
+@pytest.mark.skipif(not os.path.isdir("/proc/self"), reason="needs /proc")
+def test_walk_prunes_its_own_processes():
+    child = subprocess.Popen(["sleep", "30"])
+
+    try:
+        names = [
+            "cpuinfo", "self", "thread-self", str(os.getpid()), str(child.pid),
+        ]
+        walk.remove_skipped(dest="/proc", dirs=names)
+    finally:
+        child.kill()
+        child.wait()
+
+    assert names == ["cpuinfo"]
+
+
+def test_manifest_reuses_unchanged_digests(tree, monkeypatch):
+    records = list(walk.walk_filesystem(tree.as_posix()))
+
+    # a manifest of the walk, with a digest no file has for f3, so reused
+    # digests can be told apart from computed ones
+    lines = []
+
+    for rec in records:
+        if rec["type"] != "F":
+            continue
+
+        if rec["path"].endswith("/f3"):
+            rec = dict(rec, md5="0" * 32)
+
+        lines.append("\t".join(str(rec[name]) for name in (
+            "path", "size", "mtime_ns", "ctime_ns", "inode", "dev", "info",
+            "md5", "sha256", "hash_policy",
+        )))
+
+    manifest = tree / "manifest.z"
+    manifest.write_bytes(zlib.compress("\n".join(lines).encode("utf-8")))
+
+    monkeypatch.setattr(walk, "MANIFEST", walk.load_manifest(
+        manifest.as_posix()
+    ))
+
+    # a new mtime, and a new size with the old mtime
+    f1 = tree / "a/x/f1"
+    os.utime(f1.as_posix(), ns=(0, f1.stat().st_mtime_ns + 10 ** 9))
+
+    f2 = tree / "a/x/f2"
+    mtime_ns = f2.stat().st_mtime_ns
+    f2.write_text("longer a/x/f2")
+    os.utime(f2.as_posix(), ns=(0, mtime_ns))
+
+    read = []
+    get_file_content = walk.get_file_content
+
+    def counted_file_content(file_path, size=0):
+        read.append(file_path)
+        return get_file_content(file_path, size)
+
+    monkeypatch.setattr(walk, "get_file_content", counted_file_content)
+    walk.HARDLINKS.clear()
+
+    rewalked = {
+        rec["path"]: rec for rec in walk.walk_filesystem(tree.as_posix())
+    }
+
+    # the manifest itself is new to the walk as well
+    assert sorted(read) == [
+        f1.as_posix(), f2.as_posix(), manifest.as_posix(),
+    ]
+    assert rewalked[f2.as_posix()]["md5"] == hashlib.md5(
+        b"longer a/x/f2"
+    ).hexdigest()
+    assert rewalked[(tree / "a/f3").as_posix()]["md5"] == "0" * 32
+
+
+POLICY = walk.HashPolicy(
+    sample_over=100,
+    skip_over=1000,
+    full_globs=["/opt/full/*"],
+    sample_globs=["*.iso"],
+    skip_globs=["/var/log/*"],
+    sample_mimes=["video/"],
+    skip_mimes=["application/x-sqlite3"],
+)
+
+
+@pytest.mark.parametrize("path, size, info, policy", [
+    ("/usr/bin/ls", 50, "application/x-executable", walk.HASH_FULL),
+    ("/usr/lib/big", 500, "", walk.HASH_SAMPLED),
+    ("/usr/lib/huge", 5000, "", walk.HASH_NONE),
+    ("/opt/full/huge", 5000, "video/mp4", walk.HASH_FULL),
+    ("/var/log/messages", 10, "text/plain", walk.HASH_NONE),
+    ("/var/log/disk.iso", 10, "", walk.HASH_NONE),
+    ("/srv/disk.iso", 10, "", walk.HASH_SAMPLED),
+    ("/srv/movie", 10, "video/mp4", walk.HASH_SAMPLED),
+    ("/srv/movie.db", 10, "application/x-sqlite3", walk.HASH_NONE),
+])
+def test_hash_policy(path, size, info, policy):
+    assert POLICY.get_policy(path, size, info) == policy
+
+
+def test_hash_policy_of_owned_paths():
+    owned = walk.HashPolicy(owned_paths=frozenset(["/usr/bin/ls"]))
+
+    assert owned.get_policy("/usr/bin/ls", 50) == walk.HASH_FULL
+    assert owned.get_policy("/etc/passwd", 50) == walk.HASH_NONE
+
+
+def test_walk_records_hash_policy(tree, monkeypatch):
+    big = os.urandom(200)
+    tree.joinpath("big").write_bytes(big)
+    tree.joinpath("skip.log").write_text("log\n")
+
+    monkeypatch.setattr(walk, "SAMPLE_SIZE", 16)
+    monkeypatch.setattr(walk, "HASH_POLICY", walk.HashPolicy(
+        sample_over=100,
+        skip_globs=["*.log"],
+    ))
+
+    records = {
+        rec["path"]: rec for rec in walk.walk_filesystem(tree.as_posix())
+    }
+
+    full = records[tree.joinpath("f6").as_posix()]
+    assert full["hash_policy"] == walk.HASH_FULL
+    assert full["md5"] == hashlib.md5(b"f6").hexdigest()
+
+    sampled = records[tree.joinpath("big").as_posix()]
+    assert sampled["hash_policy"] == walk.HASH_SAMPLED
+    assert sampled["md5"] not in ("", hashlib.md5(big).hexdigest())
+
+    skipped = records[tree.joinpath("skip.log").as_posix()]
+    assert skipped["hash_policy"] == walk.HASH_NONE
+    assert skipped["md5"] == skipped["sha256"] == ""
+
+
+ELF_PATHS = [
+    os.path.realpath(sys.executable),
+    getattr(zlib, "__file__", ""),
+]
+
+
+@pytest.mark.skipif(not walk.is_magic, reason="libmagic is not available")
+@pytest.mark.parametrize("head_size", [walk.HEAD_SIZE, 128])
+@pytest.mark.parametrize("path", ELF_PATHS)
+def test_elf_mime_type_matches_libmagic(path, head_size):
+    if walk.MAGIC_VERSION < walk.ELF_MAGIC_VERSION:
+        pytest.skip("libmagic names ELF files by older rules")
+
+    if not os.path.isfile(path):
+        pytest.skip(f"{path} is not a file")
+
+    with open(path, "rb") as f:
+        head = walk.read_content(f, head_size)
+
+        if not head.startswith(walk.ELF_MAGIC):
+            pytest.skip(f"{path} is not an ELF file")
+
+        info = walk.get_mime_type(path, f, head)
+        assert f.tell() == len(head)
+
+    assert info == walk.from_file(path, mime=True)
+
+
+@pytest.mark.skipif(not walk.is_magic, reason="libmagic is not available")
+@pytest.mark.parametrize("path", ELF_PATHS)
+def test_elf_mime_type_from_older_libmagic(path, monkeypatch):
+    if not os.path.isfile(path):
+        pytest.skip(f"{path} is not a file")
+
+    monkeypatch.setattr(walk, "MAGIC_VERSION", walk.ELF_MAGIC_VERSION - 1)
+    monkeypatch.setattr(walk, "get_elf_mime_type", None)
+
+    with open(path, "rb") as f:
+        head = walk.read_content(f, walk.HEAD_SIZE)
+
+        if not head.startswith(walk.ELF_MAGIC):
+            pytest.skip(f"{path} is not an ELF file")
+
+        info = walk.get_mime_type(path, f, head)
+        assert f.tell() == len(head)
+
+    assert info == walk.from_file(path, mime=True)
+
+
+@pytest.mark.parametrize("argv", [
+    [],
+    [
+        "--workers", "4", "--worker-type", "process", "--rate-limit", "2m",
+        "--prune-dev", "5", "--prune-dev", "6", "--hash-skip-glob", "*.log",
+        "--digest", "md5", "--telemetry", "1.5", "--checkpoint-every", "10",
+    ],
+])
+def test_parse_args_without_argparse(argv, monkeypatch):
+    expected = vars(walk.parse_args(list(argv)))
+
+    # as on python 2.6
+    monkeypatch.setitem(sys.modules, "argparse", None)
+
+    assert vars(walk.parse_args(list(argv))) == expected
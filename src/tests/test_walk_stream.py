@@ -0,0 +1,118 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+import os
+from io import BytesIO, StringIO
+from pathlib import Path
+import pytest
+import walk
+from utils.ssh import ByteStreamStringParser
+from utils.walk_stream import WalkStreamDecoder
+
+
+@pytest.fixture()
+def walk_records(tmp_path: Path):
+    tmp_path.joinpath("etc").mkdir()
+    tmp_path.joinpath("etc/hosts").write_text("127.0.0.1 localhost\n")
+    tmp_path.joinpath("etc/empty").write_bytes(b"")
+    tmp_path.joinpath("etc/data.bin").write_bytes(bytes(range(256)) * 64)
+    tmp_path.joinpath("hosts").symlink_to("etc/hosts")
+    # a name that is not UTF-8
+    tmp_path.joinpath(os.fsdecode(b"caf\xe9")).write_text("latin-1\n")
+
+    walk.UNAME = "Linux"
+
+    return list(walk.walk_filesystem(tmp_path.as_posix()))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 7, 4096])
+def test_binary_walk_decodes_to_text(walk_records, chunk_size):
+    text = StringIO()
+    text_writer = walk.TextRecordWriter(text)
+
+    binary = BytesIO()
+    binary_writer = walk.BinaryRecordWriter(binary, flush_every=2)
+
+    for index, rec in enumerate(walk_records):
+        text_writer.write_record(rec)
+        binary_writer.write_record(rec)
+
+        if index == 1:
+            text_writer.write_checkpoint(rec["path"])
+            binary_writer.write_checkpoint(rec["path"])
+            text_writer.write_telemetry({"files": 2})
+            binary_writer.write_telemetry({"files": 2})
+
+    text_writer.close()
+    binary_writer.close()
+
+    data = binary.getvalue()
+    chunks = (
+        data[i:i + chunk_size] for i in range(0, len(data), chunk_size)
+    )
+
+    lines = list(WalkStreamDecoder().decode(byte_stream=chunks))
+
+    assert "".join(lines) == text.getvalue()
+
+
+def test_text_walk_keeps_path_bytes(walk_records):
+    text = StringIO()
+    text_writer = walk.TextRecordWriter(text)
+
+    for rec in walk_records:
+        text_writer.write_record(rec)
+
+    text_writer.close()
+
+    # as walk.py writes its text format to stdout
+    data = text.getvalue().encode("utf-8", "surrogateescape")
+
+    lines = list(ByteStreamStringParser().parse_stream(iter([data])))
+
+    assert "".join(lines) == text.getvalue()
+    assert any("caf\udce9" in line for line in lines)
+
+
+def test_truncated_binary_walk(walk_records):
+    binary = BytesIO()
+    binary_writer = walk.BinaryRecordWriter(binary)
+
+    for rec in walk_records:
+        binary_writer.write_record(rec)
+
+    binary_writer.flush()
+
+    data = binary.getvalue()
+
+    with pytest.raises(EOFError):
+        list(WalkStreamDecoder().decode(byte_stream=iter([data[:-3]])))
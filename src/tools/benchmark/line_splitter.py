@@ -0,0 +1,152 @@
+#!/usr/bin/env python3
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+"""
+Microbenchmark of splitting a remote command's output into lines.  Compares
+the chunk-decoding parser ByteStreamStringParser used to be with the
+current one and with ByteStreamLineSplitter, over walk.py-like output fed
+in FetchChannelStream's 8 KiB blocks.
+
+Run from the src directory:
+
+    python tools/benchmark/line_splitter.py [--lines N] [--crlf]
+"""
+
+import argparse
+import os
+import sys
+from timeit import default_timer
+
+sys.path.insert(
+    0,
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', '..'),
+)
+
+from utils.ssh import ByteStreamLineSplitter, ByteStreamStringParser
+
+
+def legacy_parse_stream(byte_stream):
+    """
+    The parser before the byte-level splitter
+    """
+
+    holdover_buf = []
+
+    for chunk in byte_stream:
+        line = chunk.decode('utf-8')
+
+        if line.find('\n') < 0:
+            holdover_buf.append(line)
+            continue
+
+        chunks = line.split('\n')
+
+        if not chunks[-1]:
+            chunks.pop()
+
+        if holdover_buf:
+            holdover_buf.append(chunks[0])
+            chunks[0] = ''.join(holdover_buf)
+            holdover_buf.clear()
+
+        if not line.endswith('\n'):
+            holdover_buf.append(chunks.pop())
+
+        output = [x if not x.endswith('\r') else x[:-1] for x in chunks]
+
+        for rec in output:
+            yield ''.join([rec, '\n'])
+
+    if holdover_buf:
+        yield ''.join(holdover_buf)
+
+
+def make_output(lines: int, crlf: bool) -> bytes:
+
+    newline = '\r\n' if crlf else '\n'
+
+    return ''.join(
+        f'/usr/share/doc/package-{i % 977}/file-{i}.txt\tF\t{i * 37}\t'
+        f'1571234567\t0644\troot\troot\ttext/plain; charset=us-ascii\t'
+        f'{i:032x}\t{i:064x}{newline}'
+        for i in range(lines)
+    ).encode('utf-8')
+
+
+def chunked(data: bytes, block_size: int = 8192):
+
+    for pos in range(0, len(data), block_size):
+        yield data[pos:pos + block_size]
+
+
+def measure(name: str, parse, data: bytes, repeat: int = 3) -> float:
+
+    best = None
+
+    for _ in range(repeat):
+        start = default_timer()
+        count = sum(1 for _ in parse(chunked(data)))
+        elapsed = default_timer() - start
+        best = elapsed if best is None else min(best, elapsed)
+
+    print(f'{name:<28} {count / best:>12,.0f} lines/s')
+
+    return count / best
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--lines', type=int, default=500000)
+    parser.add_argument('--crlf', action='store_true',
+                        help='Use the \\r\\n line endings of a tty')
+    args = parser.parse_args()
+
+    data = make_output(args.lines, args.crlf)
+
+    print(f'{args.lines} lines, {len(data) / 1048576:.1f} MiB')
+
+    legacy = measure('legacy str parser', legacy_parse_stream, data)
+    current = measure(
+        'ByteStreamStringParser',
+        ByteStreamStringParser().parse_stream,
+        data,
+    )
+    measure('ByteStreamLineSplitter', ByteStreamLineSplitter().split_stream,
+            data)
+
+    print(f'ByteStreamStringParser is {current / legacy:.1f}x the legacy parser')
+
+
+if __name__ == '__main__':
+    main()
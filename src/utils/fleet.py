@@ -0,0 +1,520 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+"""
+Runs the DRAT pipeline for a fleet of systems in parallel.  Each system
+runs its stages in order, and each stage holds a slot of the SSH or
+database limits, or both, while it runs.
+
+With a stage cache, a stage is skipped when the fingerprint of its inputs
+matches its last completed run.  The inputs are the stage's own (the
+gather arguments, the schema revision, the rule set version) and the
+output of the stage before it: the hash of the gather listings, or a
+token that changes each time a database stage runs.  A stage with a
+max_age is only skipped while its last run is younger than that, so by
+default gather always collects the system again, and the database stages
+after it are skipped when the listings come back unchanged.
+"""
+
+import hashlib
+import json
+import logging
+import os
+import subprocess
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from timeit import default_timer
+from typing import Callable, Dict, List, Optional
+from uuid import uuid4
+
+log = logging.getLogger(__name__)
+
+SSH = 'ssh'
+DB = 'db'
+
+# slots are always taken in this order, so no two stages can deadlock
+RESOURCES = (SSH, DB)
+
+STAGES = ('gather', 'load', 'analyze', 'generate')
+
+# the files that make up the rule set version
+RULE_SET = ('heuristics', 'run_rules.py')
+
+
+class Stage(object):
+    """
+    One pipeline step of a system: the command it runs and the resources
+    it holds
+    """
+
+    def __init__(
+            self,
+            name: str,
+            command: List[str],
+            resources: tuple,
+            inputs: dict = None,
+            outputs: List[str] = None,
+            max_age: float = None,
+    ):
+        """
+        :param max_age: seconds a completed run stays current; None for no
+            limit, and 0 runs the stage every time
+        """
+
+        self.name = name
+        self.command = command
+        self.resources = resources
+        self.inputs = inputs or {}
+        self.outputs = outputs or []
+        self.max_age = max_age
+
+    def __repr__(self):
+        return f'Stage({self.name!r}, {self.command!r}, {self.resources!r})'
+
+
+class SystemStatus(object):
+    """
+    Where one system is in the pipeline
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self.state = 'pending'
+        self.stage = None
+        self.attempts = {}
+        self.skipped = []
+        self.elapsed_seconds = 0.0
+
+
+def read_config(conf_file: str) -> Dict[str, List[str]]:
+    """
+    Reads a main.py configuration file.  Each line holds the gather.py
+    arguments of one system and ends with the system name.  Blank lines
+    and lines starting with # are skipped.
+
+    :return: the gather.py arguments keyed by system name, in file order
+    """
+
+    systems = OrderedDict()
+
+    with open(conf_file) as f:
+        for line in f:
+            gather_args = line.split()
+
+            if not gather_args or gather_args[0].startswith('#'):
+                continue
+
+            name = gather_args[-1]
+
+            if name in systems:
+                log.warning(f'{name} is configured twice; using the last.')
+
+            systems[name] = gather_args
+
+    return systems
+
+
+def build_stages(
+        gather_args: List[str],
+        versions: Dict[str, str] = None,
+        content_transfer: str = 'sftp',
+        gather_max_age: float = 0,
+) -> List[Stage]:
+    """
+    Builds the pipeline of one system from its gather.py arguments
+
+    :param versions: the 'schema' revision and 'rules' version the
+        database stages depend on
+    :param content_transfer: how run_analysis.py fetches user file contents
+    :param gather_max_age: seconds a collection of the system is reused
+        for; 0 gathers on every run, as the system may have changed
+    """
+
+    versions = versions or {}
+    schema = {'schema': versions.get('schema')}
+    name = gather_args[-1]
+    listings = [f'{name}_files.txt', f'{name}_packages.txt']
+    stages = []
+
+    # gather.py --direct-load loads the system itself
+    if '--direct-load' in gather_args:
+        stages.append(
+            Stage(
+                'gather',
+                ['./gather.py'] + gather_args,
+                (SSH, DB),
+                inputs={'args': gather_args, **schema},
+                outputs=listings if '--tee' in gather_args else None,
+                max_age=gather_max_age,
+            )
+        )
+    else:
+        stages.append(
+            Stage(
+                'gather',
+                ['./gather.py'] + gather_args,
+                (SSH,),
+                inputs={'args': gather_args},
+                outputs=listings,
+                max_age=gather_max_age,
+            )
+        )
+        stages.append(
+            Stage('load', ['./load_details.py', name], (DB,), inputs=schema)
+        )
+
+    # run_analysis.py fetches content over SSH and runs the rules in the
+    # database
+    stages.append(
+        Stage(
+            'analyze',
+            [
+                './run_analysis.py',
+                '--content-transfer',
+                content_transfer,
+                name,
+            ],
+            (SSH, DB),
+            inputs={
+                **schema,
+                'rules': versions.get('rules'),
+                'content_transfer': content_transfer,
+            },
+        )
+    )
+    stages.append(
+        Stage(
+            'generate',
+            ['./generate.py', '-o output', name],
+            (DB,),
+            inputs=schema,
+        )
+    )
+
+    return stages
+
+
+def get_fingerprint(inputs: dict) -> str:
+
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode('utf-8')
+    ).hexdigest()
+
+
+def hash_files(paths: List[str]) -> Optional[str]:
+    """
+    :return: the SHA-256 of the files' contents, or None if one is missing
+    """
+
+    digest = hashlib.sha256()
+
+    for path in paths:
+        try:
+            with open(path, 'rb') as f:
+                for block in iter(lambda: f.read(1048576), b''):
+                    digest.update(block)
+        except FileNotFoundError:
+            return None
+
+        digest.update(b'\0')
+
+    return digest.hexdigest()
+
+
+def hash_tree(paths: List[str]) -> str:
+    """
+    Hashes the names and contents of files and the files under
+    directories, for versioning source such as the rule set
+    """
+
+    files = []
+
+    for path in paths:
+        if os.path.isdir(path):
+            for dir_path, dir_names, file_names in os.walk(path):
+                dir_names[:] = [d for d in dir_names if d != '__pycache__']
+                files.extend(
+                    os.path.join(dir_path, file_name)
+                    for file_name in file_names
+                    if not file_name.endswith('.pyc')
+                )
+        else:
+            files.append(path)
+
+    digest = hashlib.sha256()
+
+    for path in sorted(files):
+        digest.update(path.encode('utf-8') + b'\0')
+        digest.update((hash_files([path]) or '').encode('utf-8'))
+
+    return digest.hexdigest()
+
+
+class FleetScheduler(object):
+    """
+    Runs the stages of many systems at once, with separate limits on the
+    stages that use SSH and those that use the database.  A failed stage
+    is retried, and the system stops at a stage that keeps failing.
+
+    The cache, such as db.pipeline.PipelineStageCache, records completed
+    stages so unchanged ones are skipped.  Stages named in force always
+    run.
+    """
+
+    def __init__(
+            self,
+            ssh_jobs: int = 4,
+            db_jobs: int = 2,
+            retries: int = 2,
+            retry_delay: float = 30.0,
+            log_dir: str = 'logs',
+            runner: Callable[[str, Stage], int] = None,
+            cache=None,
+            force: tuple = (),
+    ):
+
+        if ssh_jobs < 1 or db_jobs < 1:
+            raise ValueError('The SSH and database limits must be at least 1')
+
+        self.limits = {
+            SSH: threading.BoundedSemaphore(ssh_jobs),
+            DB: threading.BoundedSemaphore(db_jobs),
+        }
+        self.workers = ssh_jobs + db_jobs
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.log_dir = log_dir
+        self.runner = runner or self.run_command
+        self.cache = cache
+        self.force = set(force)
+
+    def run(self, systems: Dict[str, List[Stage]]) -> List[SystemStatus]:
+        """
+        Runs the pipelines of the systems, keyed by system name
+
+        :return: the final status of each system
+        """
+
+        statuses = [SystemStatus(name) for name in systems]
+
+        with ThreadPoolExecutor(max_workers=self.workers) as executor:
+            for status in statuses:
+                executor.submit(self.run_system, status, systems[status.name])
+
+        return statuses
+
+    def run_system(self, status: SystemStatus, stages: List[Stage]):
+
+        start = default_timer()
+        status.state = 'running'
+
+        # the output of the stage before, which is an input of the next
+        upstream = None
+
+        try:
+            for stage in stages:
+                status.stage = stage.name
+                fingerprint = get_fingerprint(
+                    {**stage.inputs, 'upstream': upstream}
+                )
+                output = self.get_current_output(
+                    status.name,
+                    stage,
+                    fingerprint,
+                )
+
+                if output is not None:
+                    log.info(f'{status.name}: {stage.name} is unchanged.')
+                    status.skipped.append(stage.name)
+                    upstream = output
+                    continue
+
+                # a stage that fails part way must not look complete
+                if self.cache is not None:
+                    self.cache.forget(status.name, stage.name)
+
+                if not self.run_stage(status, stage):
+                    status.state = 'failed'
+                    break
+
+                if stage.outputs:
+                    upstream = hash_files(stage.outputs) or uuid4().hex
+                else:
+                    upstream = uuid4().hex
+
+                if self.cache is not None:
+                    self.cache.complete(
+                        status.name,
+                        stage.name,
+                        fingerprint,
+                        upstream,
+                    )
+            else:
+                status.state = 'done'
+                status.stage = None
+
+        except Exception:
+            log.exception(f'{status.name}: {status.stage} raised')
+            status.state = 'failed'
+
+        status.elapsed_seconds = default_timer() - start
+
+        log.info(
+            f'{status.name}: {status.state} after '
+            f'{status.elapsed_seconds:.0f} seconds.'
+        )
+
+    def get_current_output(
+            self,
+            name: str,
+            stage: Stage,
+            fingerprint: str,
+    ) -> Optional[str]:
+        """
+        :return: the output of the stage's last run if the stage can be
+            skipped, otherwise None
+        """
+
+        if (
+                self.cache is None or
+                stage.name in self.force or
+                stage.max_age == 0
+        ):
+            return None
+
+        output = self.cache.get_output(
+            name,
+            stage.name,
+            fingerprint,
+            max_age=stage.max_age,
+        )
+
+        # the listings must still be what the stage wrote
+        if output is not None and stage.outputs:
+            if hash_files(stage.outputs) != output:
+                return None
+
+        return output
+
+    def run_stage(self, status: SystemStatus, stage: Stage) -> bool:
+
+        for attempt in range(1, self.retries + 2):
+            status.attempts[stage.name] = attempt
+
+            with self.hold(stage.resources):
+                log.info(f'{status.name}: running {stage.name}.')
+                exit_code = self.runner(status.name, stage)
+
+            if exit_code == 0:
+                return True
+
+            log.warning(
+                f'{status.name}: {stage.name} exited with {exit_code} '
+                f'on attempt {attempt}.'
+            )
+
+            if attempt <= self.retries:
+                time.sleep(self.retry_delay)
+
+        return False
+
+    def hold(self, resources: tuple) -> ExitStack:
+        """
+        Takes a slot of each resource, in RESOURCES order
+        """
+
+        stack = ExitStack()
+
+        for resource in RESOURCES:
+            if resource in resources:
+                stack.enter_context(self.limits[resource])
+
+        return stack
+
+    def run_command(self, name: str, stage: Stage) -> int:
+        """
+        Runs a stage's command with its output appended to the system's
+        log file, as the output of parallel systems would interleave
+        """
+
+        os.makedirs(self.log_dir, exist_ok=True)
+
+        with open(os.path.join(self.log_dir, f'{name}.log'), 'a') as f:
+            f.write(f'==> {stage.name}: {" ".join(stage.command)}\n')
+            f.flush()
+
+            try:
+                return subprocess.call(
+                    stage.command,
+                    stdout=f,
+                    stderr=subprocess.STDOUT,
+                )
+            except OSError as e:
+                f.write(f'Unable to run {stage.name}: {e}\n')
+                return -1
+
+
+def format_summary(statuses: List[SystemStatus]) -> List[str]:
+
+    lines = []
+
+    for status in statuses:
+        line = f'{status.name}: {status.state}'
+
+        if status.stage:
+            line += f' in {status.stage}'
+
+        retried = {
+            stage: attempts
+            for stage, attempts in status.attempts.items()
+            if attempts > 1
+        }
+
+        if status.skipped:
+            line += ', skipped unchanged ' + ', '.join(status.skipped)
+
+        if retried:
+            line += ', retried ' + ', '.join(
+                f'{stage} {attempts - 1}x'
+                for stage, attempts in retried.items()
+            )
+
+        lines.append(f'{line}, {status.elapsed_seconds:.0f} seconds')
+
+    done = sum(status.state == 'done' for status in statuses)
+    lines.append(f'{done} of {len(statuses)} systems completed.')
+
+    return lines
@@ -31,6 +31,7 @@
 #------------------------------------------------------------------------------
 
 import argparse
+from utils.fleet import STAGES
 
 
 class GetArguments(object):
@@ -100,6 +101,114 @@ class GetIaCArguments(GetArguments):
         )
 
 
+class GetFleetArguments(GetArguments):
+    """
+    Adds arguments for running the pipeline for a fleet of systems
+    """
+    def add_args(self):
+        self._parser.add_argument(
+            "--ssh-jobs",
+            dest="ssh_jobs",
+            help="Number of SSH stages (gather, content fetch) run at once",
+            default=4,
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--db-jobs",
+            dest="db_jobs",
+            help=(
+                "Number of database stages (load, analysis, generate) run "
+                "at once"
+            ),
+            default=2,
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--retries",
+            dest="retries",
+            help="Number of times a failed stage of a system is retried",
+            default=2,
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--retry-delay",
+            dest="retry_delay",
+            help="Seconds to wait before retrying a failed stage",
+            default=30.0,
+            type=float,
+        )
+
+        self._parser.add_argument(
+            "--system-log-dir",
+            dest="system_log_dir",
+            help="Directory of the per-system output logs",
+            default="logs",
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--system",
+            dest="systems",
+            help="Only run this system of the configuration file",
+            default=[],
+            action="append",
+        )
+
+        self._parser.add_argument(
+            "--force",
+            dest="force",
+            help=(
+                "Run a stage even if its inputs are unchanged since it last "
+                "completed"
+            ),
+            choices=STAGES,
+            default=[],
+            action="append",
+        )
+
+        self._parser.add_argument(
+            "--invalidate",
+            dest="invalidate",
+            help=(
+                "Forget that a stage completed, so the next run runs it, "
+                "and exit"
+            ),
+            choices=STAGES,
+            default=[],
+            action="append",
+        )
+
+        self._parser.add_argument(
+            "--no-cache",
+            dest="no_cache",
+            help="Run every stage, without skipping unchanged ones",
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--gather-max-age",
+            dest="gather_max_age",
+            help=(
+                "Reuse a system's collection for this many hours instead of "
+                "gathering it again; by default every run gathers"
+            ),
+            default=0.0,
+            type=float,
+        )
+
+        self._parser.add_argument(
+            "--content-transfer",
+            dest="content_transfer",
+            help="How the analysis fetches user file contents",
+            choices=("sftp", "tar"),
+            default="sftp",
+        )
+
+
 class GetMinimumSshArguments(GetArguments):
     """
     Added custom parameters
@@ -122,6 +231,25 @@ class GetMinimumSshArguments(GetArguments):
         )
 
 
+class GetAnalysisArguments(GetMinimumSshArguments):
+    """
+    Adds arguments for analyzing a system
+    """
+    def add_args(self):
+        super().add_args()
+        self._parser.add_argument(
+            "--content-transfer",
+            dest="content_transfer",
+            help=(
+                "Fetch user file contents one file at a time over SFTP, or "
+                "as one tar stream written by sudo tar, which also reads "
+                "root-only files"
+            ),
+            choices=("sftp", "tar"),
+            default="sftp",
+        )
+
+
 class GetSshArguments(GetMinimumSshArguments):
     """
     Added custom parameters
@@ -157,3 +285,304 @@ class GetGatherArguments(GetSshArguments):
             default=False,
             action="store_true",
         )
+
+        self._parser.add_argument(
+            "--walk-workers",
+            dest="walk_workers",
+            help="Hash and identify remote files with a pool of workers",
+            default=0,
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--walk-worker-type",
+            dest="walk_worker_type",
+            help="Run the remote hashing workers as threads or processes",
+            choices=("thread", "process"),
+            default="thread",
+        )
+
+        self._parser.add_argument(
+            "--walk-shards",
+            dest="walk_shards",
+            help=(
+                "Walk the remote directory tree with this many processes; "
+                "cannot be combined with --walk-workers and not available "
+                "with --tty"
+            ),
+            default=0,
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--incremental",
+            dest="incremental",
+            help=(
+                "Reuse digests stored by the last gather for files whose "
+                "size, times, inode and device have not changed"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--binary-walk",
+            dest="binary_walk",
+            help=(
+                "Transfer the remote walk in the compressed binary format; "
+                "not available with --tty"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-prune-fstype",
+            dest="walk_prune_fstypes",
+            help=(
+                "Do not walk into remote mounts of these filesystem types; "
+                "comma separated, may be repeated"
+            ),
+            action="append",
+            default=[],
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-prune-default-fstypes",
+            dest="walk_prune_default_fstypes",
+            help=(
+                "Do not walk into network, memory backed, pseudo and "
+                "overlay filesystems"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-prune-dev",
+            dest="walk_prune_devices",
+            help="Do not walk into this remote device id; may be repeated",
+            action="append",
+            default=[],
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--walk-xdev",
+            dest="walk_xdev",
+            help="Only walk the remote root filesystem",
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-sample-over",
+            dest="walk_hash_sample_over",
+            help=(
+                "Sample the digest (size, head and tail) of remote files "
+                "larger than this size; accepts k, m and g suffixes"
+            ),
+            metavar="SIZE",
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-skip-over",
+            dest="walk_hash_skip_over",
+            help=(
+                "Do not hash remote files larger than this size; accepts "
+                "k, m and g suffixes"
+            ),
+            metavar="SIZE",
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-full-glob",
+            dest="walk_hash_full_globs",
+            help="Always fully hash remote paths matching this glob",
+            action="append",
+            default=[],
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-sample-glob",
+            dest="walk_hash_sample_globs",
+            help="Sample the digest of remote paths matching this glob",
+            action="append",
+            default=[],
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-skip-glob",
+            dest="walk_hash_skip_globs",
+            help="Do not hash remote paths matching this glob",
+            action="append",
+            default=[],
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-sample-mime",
+            dest="walk_hash_sample_mimes",
+            help="Sample the digest of files whose mime type starts with this",
+            action="append",
+            default=[],
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-skip-mime",
+            dest="walk_hash_skip_mimes",
+            help="Do not hash files whose mime type starts with this",
+            action="append",
+            default=[],
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-single-digest",
+            dest="walk_single_digest",
+            help=(
+                "Only compute the digest algorithm used by the remote "
+                "rpm database"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-hash-owned-only",
+            dest="walk_hash_owned_only",
+            help=(
+                "Gather packages before files and only hash files owned by "
+                "a package"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-checkpoint-every",
+            dest="walk_checkpoint_every",
+            help=(
+                "Walk in sorted order and checkpoint the walk about every "
+                "this many files"
+            ),
+            default=0,
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--resume",
+            dest="resume",
+            help=(
+                "Continue the file walk from the last checkpoint of a walk "
+                "that was cut off; use the same walk options as before"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-telemetry",
+            dest="walk_telemetry",
+            help=(
+                "Log the walker's throughput and resource usage every this "
+                "many seconds"
+            ),
+            default=0,
+            type=float,
+        )
+
+        self._parser.add_argument(
+            "--walk-rate-limit",
+            dest="walk_rate_limit",
+            help=(
+                "Limit the walker's file reads to this many bytes/s; "
+                "k, m and g suffixes are allowed.  Not available with --tty"
+            ),
+            type=str,
+        )
+
+        self._parser.add_argument(
+            "--walk-nice",
+            dest="walk_nice",
+            help="Add this to the walker's nice value",
+            default=0,
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--walk-ionice-idle",
+            dest="walk_ionice_idle",
+            help=(
+                "Run the walker in the idle I/O scheduling class; "
+                "not available with --tty"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-fadvise-dontneed",
+            dest="walk_fadvise_dontneed",
+            help="Have the walker drop each file it reads from the page cache",
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--walk-hardlink-cache",
+            dest="walk_hardlink_cache",
+            help=(
+                "Number of multiply linked files whose digests the walker "
+                "keeps for later links; 0 turns the cache off"
+            ),
+            type=int,
+        )
+
+        self._parser.add_argument(
+            "--direct-load",
+            dest="direct_load",
+            help=(
+                "Load the files and packages into the database as they are "
+                "gathered instead of writing them for load_details.py"
+            ),
+            default=False,
+            action="store_true",
+        )
+
+        self._parser.add_argument(
+            "--tee",
+            dest="tee",
+            help="With --direct-load, also write the file and package lists",
+            default=False,
+            action="store_true",
+        )
+
+    def parse(self) -> argparse.Namespace:
+        args = super().parse()
+
+        if args.direct_load and args.resume:
+            self._parser.error(
+                "--resume appends to a file list and cannot be used with "
+                "--direct-load"
+            )
+
+        # these make the walker write to stderr, which a tty merges into
+        # the file list
+        if args.tty:
+            for option, value in (
+                    ("--binary-walk", args.binary_walk),
+                    ("--walk-shards", args.walk_shards),
+                    ("--walk-rate-limit", args.walk_rate_limit),
+                    ("--walk-ionice-idle", args.walk_ionice_idle),
+            ):
+                if value:
+                    self._parser.error(f"{option} is not available with --tty")
+
+        return args
@@ -30,17 +30,27 @@
 # DM19-0055
 #------------------------------------------------------------------------------
 
+import asyncio
+import atexit
 import logging
 import sys
 import os
 import logging
-import time
+import threading
 import re
+import select
+import tarfile
 import tempfile
-from io import BytesIO
+from io import BufferedReader, BytesIO, RawIOBase
 from tempfile import mktemp
-from typing import Iterator, IO, BinaryIO
-from timeit import default_timer
+from concurrent.futures import (
+    FIRST_COMPLETED,
+    ThreadPoolExecutor,
+    as_completed,
+    wait,
+)
+from typing import Dict, Iterable, Iterator, IO, BinaryIO, List, Optional
+from typing import Tuple
 from paramiko import SSHException, Channel, SSHClient, client
 from paramiko.sftp_client import SFTPClient
 
@@ -51,20 +61,52 @@ ByteIterator = Iterator[bytes]
 
 START_TTY = f'{"/" * 40} START TTY {"/" * 40}'
 END_TTY = f'{"/" * 40} END TTY {"/" * 40}'
+# walk.py checkpoint lines are this marker, a tab and a directory path
+CHECKPOINT = f'{"/" * 40} CHECKPOINT {"/" * 40}'
+# walk.py telemetry lines are this marker, a tab and a JSON object
+TELEMETRY = f'{"/" * 40} TELEMETRY {"/" * 40}'
+
+
+# writes the files named by the null separated paths on stdin as a
+# gzipped tar stream.  Hard links are stored as copies, so every file is a
+# regular member even when it shares an inode with one before it.
+TAR_FILES_COMMAND = (
+    'tar --null --no-recursion --absolute-names --hard-dereference '
+    '--ignore-failed-read -T - -czf -'
+)
+
+
+def make_tty_script_command(command: str, script: str) -> str:
+    """
+    Returns the shell input that runs command with script as its stdin in
+    a run_tty_command session, which has no stdin of its own, then prints
+    the exit code and ends the shell.  The here-document delimiter is
+    quoted, so the shell passes the script on without expanding
+    backslashes, $ or backquotes in it.
+    """
+
+    return (
+        f"{command} << 'EOF' ; echo \"exit_code=$?\"; exit\n"
+        f"{script}\n\n\nEOF\n"
+    )
 
 
 class FetchChannelStream(object):
     """
     This takes a paramiko channel and
-    yields byte arrays from it.
+    yields byte arrays from it.  The reader blocks in select on the
+    channel, which wakes on stdout or stderr data and on EOF.  Reads start
+    at block_size and double while they come back full, up to the
+    channel's receive window.  TimeoutError is raised when the channel
+    is silent for timeout_seconds; None waits as long as it takes.
     """
 
     def __init__(
             self,
             channel: Channel = None,
-            timeout_seconds: int = 600,
+            timeout_seconds: Optional[float] = 600,
             block_size: int = 8192,
-            sleep_period: float = .2,
+            max_block_size: int = None,
     ):
 
         if not channel:
@@ -73,48 +115,147 @@ class FetchChannelStream(object):
         self.channel = channel
         self.timeout_seconds = timeout_seconds
         self.block_size = block_size
-        self.sleep_period = sleep_period
+        self.max_block_size = max(
+            max_block_size or channel.in_window_size,
+            block_size,
+        )
         self.exit_status = None
         self.is_read_complete = False
+        self._stderr_buf = b''
 
-    @staticmethod
-    def sleep_timeout(start_time: float = None):
-        if start_time is None:
-            raise ValueError('Must have a start time')
+    def wait_readable(self):
+        """
+        Blocks until the channel has data or EOF
+        """
 
-            time.sleep(self.sleep_period)
+        readable, _, _ = select.select(
+            [self.channel], [], [], self.timeout_seconds
+        )
 
-            if default_timer() - start_time > self.timeout_seconds:
-                raise TimeoutError('Timed out waiting for stream')
+        if not readable:
+            raise TimeoutError(
+                f'No data from the channel in {self.timeout_seconds} seconds'
+            )
 
     def read_channel(self):
 
-        st = default_timer()
-        # Chill until we have data or an exit status
+        # yield data until the pipe runs dry
         while True:
+            self.wait_readable()
+            self.log_stderr()
+
             if self.channel.recv_ready():
-                break
-            if self.channel.exit_status_ready():
+                data = self.channel.recv(self.block_size)
+
+                # a full read means more is waiting; read more at a time
+                if (
+                        len(data) == self.block_size and
+                        self.block_size < self.max_block_size
+                ):
+                    self.block_size = min(
+                        self.block_size * 2,
+                        self.max_block_size,
+                    )
+
+                yield data
+                continue
+
+            if self.channel.eof_received:
                 break
 
-            self.sleep_timeout(st)
+        self.is_read_complete = True
 
-        # yield data until the pipe runs dry
-        data=None
-        while True:
-            data = self.channel.recv(self.block_size)
+        if not self.channel.status_event.wait(self.timeout_seconds):
+            raise TimeoutError('Timed out waiting for the exit status')
+
+        self.log_stderr()
+
+        self.exit_status = self.channel.recv_exit_status()
+        return f'End of stream, exit code is {self.exit_status}.'
+
+    def log_stderr(self):
+        """
+        Logs whatever the remote command has written to stderr so far, such
+        as the walker's progress, so it does not use up the channel window
+        """
+
+        while self.channel.recv_stderr_ready():
+            data = self.channel.recv_stderr(self.block_size)
 
             if not data:
                 break
 
-            yield data
+            self._stderr_buf += data
 
-        st = default_timer()
-        while not self.channel.exit_status_ready():
-            self.sleep_timeout(st)
+        *lines, self._stderr_buf = self._stderr_buf.split(b'\n')
+
+        for line in lines:
+            log.info(f"remote: {line.decode('utf-8', 'replace')}")
 
-        self.exit_status = self.channel.recv_exit_status()
-        return f'End of stream, exit code is {self.exit_status}.'
+
+class ByteStreamReader(RawIOBase):
+    """
+    Reads a byte stream, such as stream_remote_command's output, as a
+    file, for readers like tarfile's stream mode
+    """
+
+    def __init__(self, byte_stream: ByteIterator):
+        self._byte_stream = byte_stream
+        self._chunk = memoryview(b'')
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+
+        while not self._chunk:
+            chunk = next(self._byte_stream, None)
+
+            if chunk is None:
+                return 0
+
+            self._chunk = memoryview(chunk)
+
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+
+        return size
+
+
+def read_tar_files(byte_stream: ByteIterator) -> Iterator[Tuple[str, bytes]]:
+    """
+    Yields the name and contents of each regular file of a gzipped tar
+    stream, such as TAR_FILES_COMMAND's output, as it arrives
+    """
+
+    with tarfile.open(
+            fileobj=BufferedReader(ByteStreamReader(byte_stream), 65536),
+            mode='r|gz',
+    ) as archive:
+        for member in archive:
+            if member.isfile():
+                yield member.name, archive.extractfile(member).read()
+
+
+class ByteStreamLineSplitter(object):
+    """
+    Splits a byte stream into lines on b'\\n' without decoding it.  The
+    complete lines of each chunk are split out together; a partial line is
+    held in a bytearray until the chunk that ends it.  Lines keep their
+    newline, with a \\r before it removed, and a last line without a
+    newline is yielded as is.
+    """
+
+    def split_stream(self, byte_stream: ByteIterator = None) -> ByteIterator:
+
+        if byte_stream is None:
+            raise ValueError('Need a byte stream to split')
+
+        for region in split_regions(byte_stream):
+            yield from BytesIO(region)
+
+        return 'End of stream'
 
 
 class ByteStreamStringParser(object):
@@ -124,45 +265,53 @@ class ByteStreamStringParser(object):
     paramiko channel
     '''
 
-    def __init__(self):
-        self._holdover_buf = []
-
     def parse_stream(self, byte_stream: ByteIterator = None) -> StringIterator:
 
         if byte_stream is None:
             raise ValueError('Need a byte stream to parse')
 
-        for chunk in byte_stream:
-            line = chunk.decode('utf-8')
+        # lines are split as bytes and each is decoded once whole, so a
+        # character split across chunks is never decoded in halves.  Bytes
+        # that are not UTF-8, as in some paths, are kept as surrogates.
+        for region in split_regions(byte_stream):
+            for line in BytesIO(region):
+                yield line.decode('utf-8', 'surrogateescape')
 
-            if line.find('\n') < 0:
-                self._holdover_buf.append(line)
-                continue
+        # StopIteration will contain the following for the exception string
+        return 'End of stream'
+
+
+def split_regions(byte_stream: ByteIterator) -> ByteIterator:
+    """
+    Yields the complete lines of a byte stream in runs that end on a
+    newline, with \\r\\n made \\n, then any partial last line
+    """
 
-            chunks = line.split('\n')
+    holdover = bytearray()
 
-            if not chunks[-1]:
-                chunks.pop()
+    for chunk in byte_stream:
+        end = chunk.rfind(b'\n') + 1
 
-            if self._holdover_buf:
-                self._holdover_buf.append(chunks[0])
-                chunks[0] = ''.join(self._holdover_buf)
-                self._holdover_buf.clear()
+        if not end:
+            holdover += chunk
+            continue
 
-            if not line.endswith('\n'):
-                self._holdover_buf.append(chunks.pop())
+        if holdover:
+            holdover += memoryview(chunk)[:end]
+            region = bytes(holdover)
+            holdover.clear()
+        else:
+            region = chunk[:end] if end < len(chunk) else bytes(chunk)
 
-            output = [x if not x.endswith('\r') else x[:-1] for x in chunks]
+        holdover += memoryview(chunk)[end:]
 
-            for rec in output:
-                yield ''.join([rec, '\n'])
+        if b'\r' in region:
+            region = region.replace(b'\r\n', b'\n')
 
-        # if anything is left in the buffer, flush it
-        if self._holdover_buf:
-            yield ''.join(self._holdover_buf)
+        yield region
 
-        # StopIteration will contain the following for the exception string
-        return 'End of stream'
+    if holdover:
+        yield bytes(holdover)
 
 
 class HeaderTrailerFilter(object):
@@ -224,28 +373,257 @@ class HeaderTrailerFilter(object):
         raise EOFError('Did not receive good exit code.')
 
 
-class SshConnector(object):
+class PooledConnection(object):
+    """
+    A live SSH connection of the pool, with the remote temp directory its
+    users share.  A paramiko SFTP session cannot serve requests from
+    several threads, so each thread gets its own.
+    """
 
-    def __enter__(self):
+    def __init__(self, ssh_client: SSHClient):
+        self.client = ssh_client
+        self.users = 0
+        self.sftp_clients: Dict[int, SFTPClient] = {}
+        self.temp_dir: str = None
+        self._lock = threading.Lock()
 
-        self._client.set_missing_host_key_policy(client.AutoAddPolicy())
+    def is_active(self) -> bool:
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
 
-        logging.info(
-            f"Connecting to {self.username}@{self.hostname}:{self.port}."
-        )
+    def get_sftp_client(self) -> SFTPClient:
+        """
+        :return: the calling thread's SFTP session on the connection
+        """
+
+        thread_id = threading.get_ident()
+
+        with self._lock:
+            sftp_client = self.sftp_clients.get(thread_id)
+
+            if sftp_client is None or sftp_client.sock.closed:
+                sftp_client = self.client.open_sftp()
+                self.sftp_clients[thread_id] = sftp_client
+
+            return sftp_client
+
+    def get_temp_dir(self) -> str:
+        sftp_client = self.get_sftp_client()
+
+        with self._lock:
+            if self.temp_dir is None:
+                temp_dir = mktemp(prefix='reflect_', dir='/tmp')
+                sftp_client.mkdir(temp_dir, 0o700)
+                self.temp_dir = temp_dir
+
+            return self.temp_dir
+
+    def close(self):
+        try:
+            if self.temp_dir is not None and self.is_active():
+                self.get_sftp_client().rmdir(self.temp_dir)
+        except (IOError, SSHException):
+            log.warning(f'Unable to remove {self.temp_dir}.')
+
+        for sftp_client in self.sftp_clients.values():
+            sftp_client.close()
+
+        self.sftp_clients.clear()
+
+        try:
+            self.client.close()
+        except SSHException:
+            pass
+
+
+class SshConnectionPool(object):
+    """
+    Shares one live SSH connection among the SshConnectors of a process
+    that reach the same host, port, user and key, so each stage does not
+    pay for a new handshake.  Idle connections are kept, with keepalives,
+    until the process exits, and a connection that has dropped is
+    reopened.
+    """
+
+    def __init__(self, keepalive_seconds: int = 30):
+        self.keepalive_seconds = keepalive_seconds
+        self._lock = threading.Lock()
+        self._connections = {}
+
+        atexit.register(self.close_all)
+
+    def acquire(self, key: tuple) -> PooledConnection:
+        """
+        :param key: hostname, port, username and key file
+        :return: a live connection, counted as used until released
+        """
 
-        self._client.connect(
-            hostname=self.hostname,
-            username=self.username,
-            key_filename=self.key_file,
-            port=self.port
+        with self._lock:
+            connection = self._connections.get(key)
+
+            if connection is not None and not connection.is_active():
+                log.info(f"Reconnecting to {key[2]}@{key[0]}:{key[1]}.")
+                connection.close()
+                connection = None
+
+            if connection is None:
+                connection = PooledConnection(self.connect(*key))
+                self._connections[key] = connection
+
+            connection.users += 1
+
+            return connection
+
+    def release(self, key: tuple):
+
+        with self._lock:
+            connection = self._connections.get(key)
+
+            if connection is not None:
+                connection.users = max(connection.users - 1, 0)
+
+    def connect(
+            self,
+            hostname: str,
+            port: int,
+            username: str,
+            key_file: str,
+    ) -> SSHClient:
+
+        ssh_client = client.SSHClient()
+        ssh_client.set_missing_host_key_policy(client.AutoAddPolicy())
+
+        logging.info(f"Connecting to {username}@{hostname}:{port}.")
+
+        ssh_client.connect(
+            hostname=hostname,
+            username=username,
+            key_filename=key_file,
+            port=port
         )
 
+        ssh_client.get_transport().set_keepalive(self.keepalive_seconds)
+
+        return ssh_client
+
+    def close_all(self):
+
+        with self._lock:
+            for key, connection in self._connections.items():
+                logging.info(f"Closing connection to {key[0]}.")
+                connection.close()
+
+            self._connections.clear()
+
+
+CONNECTION_POOL = SshConnectionPool()
+
+
+class SshConnector(object):
+
+    def __enter__(self):
+
+        self._connection = self._pool.acquire(self.pool_key)
+        self._client = self._connection.client
+
         return self
 
+    @property
+    def pool_key(self) -> tuple:
+        return self.hostname, self.port, self.username, self.key_file
+
+    @property
+    def temp_dir(self) -> str:
+        """
+        Remote temp directory, shared by the users of the connection and
+        removed when it closes
+        """
+
+        return self._connection.get_temp_dir()
+
     def get_sftp_client(self):
+        """
+        Opens a new SFTP session, which the caller closes.  open_sftp
+        reuses the calling thread's session of the connection.
+        """
+
         return self._client.open_sftp()
 
+    def open_sftp(self):
+        """
+        :return: an SftpWrapper on the calling thread's SFTP session of
+            the connection, which is left open on exit
+        """
+
+        return SftpWrapper(self._connection.get_sftp_client(), shared=True)
+
+    def fetch_files(
+            self,
+            remote_names: Iterable[str],
+            in_flight: int = 8,
+    ) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """
+        Fetches many files with in_flight of them in progress at a time.
+        See SftpBulkFetcher.
+        """
+
+        return SftpBulkFetcher(self, in_flight=in_flight).fetch(remote_names)
+
+    def fetch_files_tar(
+            self,
+            remote_names: Iterable[str],
+    ) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """
+        Fetches many files as one gzipped tar stream, written by sudo tar
+        on the remote host from the list of names.  There are no per-file
+        round trips, and files only root can read are included.  Needs
+        sudo without a password or tty.
+
+        Yields (remote name, contents) pairs as the members arrive.  Names
+        missing from the archive, such as files removed since the walk,
+        are yielded last with None.
+        """
+
+        remote_names = list(dict.fromkeys(remote_names))
+
+        if not remote_names:
+            return
+
+        name_list = BytesIO(
+            b''.join(name.encode('utf-8') + b'\0' for name in remote_names)
+        )
+
+        # tar exits 1 when a file changed while it was read, which is
+        # fine for a snapshot of the contents
+        remote = self.stream_remote_command(
+            command=f'sudo -n {TAR_FILES_COMMAND} ; test $? -le 1',
+            stdin_data=name_list,
+        )
+
+        missing = set(remote_names)
+
+        try:
+            for remote_name, file_data in read_tar_files(remote):
+                if remote_name in missing:
+                    missing.discard(remote_name)
+
+                    yield remote_name, file_data
+
+        except tarfile.ReadError as e:
+            raise SSHRunException(
+                f'No tar stream from {self.hostname} ({e}); sudo may need '
+                'a password or tty there.'
+            ) from e
+
+        # read to the end of the command, so its exit status is checked
+        for _ in remote:
+            pass
+
+        for remote_name in remote_names:
+            if remote_name in missing:
+                log.warning(f'{remote_name} was not in the tar stream.')
+                yield remote_name, None
+
     def get_default_private_key(self, key_file: str=None) -> str:
 
         if key_file and os.path.isfile(key_file):
@@ -259,20 +637,10 @@ class SshConnector(object):
 
         return key_path if os.path.isfile(key_path) else None
 
-    def _close_channel(self):
-
-        if self._client:
-            try:
-                self._client.close()
-            except SSHException:
-                pass
-
     def __exit__(self, exception_type, exception_value, traceback):
 
-        logging.info(
-            f"Closing connection to {self.hostname}."
-        )
-        self._close_channel()
+        # the pool keeps the connection for the next user
+        self._pool.release(self.pool_key)
         return False
 
     def __init__(
@@ -281,22 +649,53 @@ class SshConnector(object):
             username: str = None,
             key_file: str = None,
             port: int = 22,
+            pool: SshConnectionPool = None,
     ):
 
-        self._client = client.SSHClient()
+        self._pool = pool or CONNECTION_POOL
+        self._connection: PooledConnection = None
+        self._client: SSHClient = None
         self.hostname = hostname
         self.username = username or os.getlogin()
         self.port = port
         self.key_file = self.get_default_private_key(key_file=key_file)
-        self.temp_dir = mktemp(prefix='reflect_', dir='/tmp')
 
     def run_remote_command(
         self,
         command: str = None,
         get_pty: bool = False,
         stdin_data: BytesIO = None,
+        timeout_seconds: Optional[float] = 600,
     ) -> StringIterator:
 
+        string_parser = ByteStreamStringParser()
+
+        yield from string_parser.parse_stream(
+            byte_stream=self.stream_remote_command(
+                command=command,
+                get_pty=get_pty,
+                stdin_data=stdin_data,
+                timeout_seconds=timeout_seconds,
+            )
+        )
+
+        return 'End of command output'
+
+    def stream_remote_command(
+        self,
+        command: str = None,
+        get_pty: bool = False,
+        stdin_data: BytesIO = None,
+        timeout_seconds: Optional[float] = 600,
+    ) -> ByteIterator:
+        """
+        Runs a command and yields its raw stdout.  Use this for binary
+        output; run_remote_command yields decoded lines.
+
+        :param timeout_seconds: how long the command may go without
+            output before TimeoutError is raised; None for no limit
+        """
+
         if not command:
             raise ValueError("Command cannot be empty")
 
@@ -309,20 +708,29 @@ class SshConnector(object):
 
             logging.info("Waiting for results.")
 
-            if stdin_data:
-                data = stdin_data.read(1024)
-                while data:
-                    stdin.channel.send(data)
-                    data = stdin_data.read(1024)
+            feeder = None
 
-            stdin.flush()
-            stdin.channel.shutdown_write()
+            if stdin_data:
+                # fed from a thread, so a command that writes output while
+                # it reads its input cannot stall on both channel windows
+                feeder = threading.Thread(
+                    target=self.feed_stdin,
+                    args=(stdin.channel, stdin_data),
+                    daemon=True,
+                )
+                feeder.start()
+            else:
+                stdin.channel.shutdown_write()
+
+            byte_stream = FetchChannelStream(
+                channel=stdout.channel,
+                timeout_seconds=timeout_seconds,
+            )
 
-            byte_stream = FetchChannelStream(channel=stdout.channel)
-            string_parser = ByteStreamStringParser()
+            yield from byte_stream.read_channel()
 
-            for string in string_parser.parse_stream(byte_stream=byte_stream.read_channel()):
-                yield string
+            if feeder is not None:
+                feeder.join()
 
             exit_status = byte_stream.exit_status
 
@@ -337,6 +745,17 @@ class SshConnector(object):
             logging.error("Unable to gather results")
             logging.error("Exception was thrown", ex)
 
+    @staticmethod
+    def feed_stdin(channel: Channel, stdin_data: BytesIO):
+
+        try:
+            for data in iter(lambda: stdin_data.read(65536), b''):
+                channel.sendall(data)
+
+            channel.shutdown_write()
+        except (OSError, SSHException) as e:
+            log.error(f"Unable to send the command input: {e}")
+
     def run_tty_command(
             self,
             command=None,
@@ -345,9 +764,13 @@ class SshConnector(object):
             in_file: str = None,
             out_file: str = None,
             success_code: int=0,
+            timeout_seconds: Optional[float] = 600,
     ) -> BytesIO:
         """
         Running command that needs a pty
+
+        :param timeout_seconds: how long the command may go without
+            output before TimeoutError is raised; None for no limit
         """
 
         if not command:
@@ -355,13 +778,16 @@ class SshConnector(object):
 
         channel: Channel = self._client.invoke_shell(width=1000)
 
-        with SftpWrapper(self._client.open_sftp(), self.temp_dir) as sftp:
+        with self.open_sftp() as sftp:
             if in_file and input_file_data:
                 sftp.put_file_handle(in_file, input_file_data)
 
             channel.send(command)
 
-            channel_fetcher = FetchChannelStream(channel=channel)
+            channel_fetcher = FetchChannelStream(
+                channel=channel,
+                timeout_seconds=timeout_seconds,
+            )
             stream_parser = ByteStreamStringParser()
             stream_filter = HeaderTrailerFilter(success_code=success_code)
 
@@ -404,9 +830,16 @@ class SftpWrapper(object):
     def upload_callback(self, bytes_xferd: int, bytes_total: int):
         log.info(f'Uploaded {bytes_xferd}/{bytes_total}.')
 
-    def __init__(self, open_sftp_client: SFTPClient, temp_dir: str=None):
+    def __init__(
+            self,
+            open_sftp_client: SFTPClient,
+            temp_dir: str=None,
+            shared: bool=False,
+    ):
         self._sftp_client: SFTPClient = open_sftp_client
         self.temp_dir = temp_dir
+        # a shared client belongs to a pooled connection and stays open
+        self.shared = shared
 
     def put_file_handle(self, remote_name: str, file_handle: BytesIO):
         size = len(file_handle.getvalue())
@@ -444,4 +877,219 @@ class SftpWrapper(object):
         if self.temp_dir:
             self._sftp_client.rmdir(self.temp_dir)
 
-        self._sftp_client.close()
+        if not self.shared:
+            self._sftp_client.close()
+
+
+class AsyncSshConnector(object):
+    """
+    asyncio interface to an entered SshConnector.  Commands and file
+    fetches run on a thread executor, each on a channel of its own, with
+    at most max_in_flight running at once.  A paramiko SFTP session
+    cannot serve requests from several threads, so each concurrent fetch
+    takes an SFTP session of its own, kept for the next fetch.
+
+        async with AsyncSshConnector(connector) as remote:
+            files = await remote.fetch_many(paths)
+    """
+
+    def __init__(self, connector: SshConnector, max_in_flight: int = 16):
+
+        if max_in_flight < 1:
+            raise ValueError('max_in_flight must be at least 1')
+
+        self.connector = connector
+        self.max_in_flight = max_in_flight
+        self._executor = ThreadPoolExecutor(max_workers=max_in_flight)
+        self._semaphore: asyncio.Semaphore = None
+        self._sftp_lock = threading.Lock()
+        self._idle_sftp_clients: List[SFTPClient] = []
+        self._sftp_clients: List[SFTPClient] = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exception_type, exception_value, traceback):
+        self.close()
+        return False
+
+    async def run(
+            self,
+            command: str,
+            stdin_data: BytesIO = None,
+    ) -> List[str]:
+        """
+        :return: the output lines of the command
+        """
+
+        return await self._call(
+            lambda: list(
+                self.connector.run_remote_command(
+                    command=command,
+                    stdin_data=stdin_data,
+                )
+            )
+        )
+
+    async def run_tty(self, command: str, success_code: int = 0) -> List[str]:
+        """
+        :return: the output lines of a command run through a tty
+        """
+
+        return await self._call(
+            lambda: list(
+                self.connector.run_tty_command(
+                    command=command,
+                    success_code=success_code,
+                )
+            )
+        )
+
+    async def fetch(self, remote_name: str) -> BytesIO:
+        """
+        :return: the contents of a remote file
+        """
+
+        return await self._call(self._fetch, remote_name)
+
+    async def fetch_many(
+            self,
+            remote_names: Iterable[str],
+    ) -> Dict[str, BytesIO]:
+        """
+        :return: the contents of the remote files, keyed by name
+        """
+
+        remote_names = list(dict.fromkeys(remote_names))
+
+        contents = await asyncio.gather(
+            *(self.fetch(remote_name) for remote_name in remote_names)
+        )
+
+        return dict(zip(remote_names, contents))
+
+    async def _call(self, func, *args):
+
+        # made here, as it must belong to the running event loop
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.max_in_flight)
+
+        async with self._semaphore:
+            return await asyncio.get_running_loop().run_in_executor(
+                self._executor,
+                func,
+                *args,
+            )
+
+    def _fetch(self, remote_name: str) -> BytesIO:
+
+        with self._sftp_lock:
+            if self._idle_sftp_clients:
+                sftp_client = self._idle_sftp_clients.pop()
+            else:
+                sftp_client = None
+
+        if sftp_client is None:
+            sftp_client = self.connector.get_sftp_client()
+
+            with self._sftp_lock:
+                self._sftp_clients.append(sftp_client)
+
+        try:
+            return SftpWrapper(sftp_client, shared=True).get_file_handle(
+                remote_name
+            )
+        finally:
+            with self._sftp_lock:
+                self._idle_sftp_clients.append(sftp_client)
+
+    def close(self):
+
+        self._executor.shutdown(wait=True)
+
+        for sftp_client in self._sftp_clients:
+            sftp_client.close()
+
+        self._sftp_clients.clear()
+        self._idle_sftp_clients.clear()
+
+
+class SftpBulkFetcher(object):
+    """
+    Fetches many remote files, keeping in_flight of them in progress so
+    the round trips of one file overlap those of the others.  A paramiko
+    SFTP session cannot serve requests from several threads, so each
+    worker has an SFTP session of its own on the connection.  Each file
+    is read with SFTPFile.prefetch, which pipelines its reads.
+    """
+
+    def __init__(self, connector: SshConnector, in_flight: int = 8):
+
+        if in_flight < 1:
+            raise ValueError('in_flight must be at least 1')
+
+        self.connector = connector
+        self.in_flight = in_flight
+        self._local = threading.local()
+        self._lock = threading.Lock()
+        self._sftp_clients: List[SFTPClient] = []
+
+    def fetch(
+            self,
+            remote_names: Iterable[str],
+    ) -> Iterator[Tuple[str, Optional[bytes]]]:
+        """
+        Yields (remote name, contents) pairs as the files finish, which is
+        not the order they were given in.  The contents are None for a
+        file that could not be read, such as one removed or truncated
+        since the walk.
+        """
+
+        pending = set()
+
+        try:
+            with ThreadPoolExecutor(max_workers=self.in_flight) as executor:
+                for remote_name in remote_names:
+                    pending.add(executor.submit(self._fetch, remote_name))
+
+                    # keep the queue short, so results are not held up
+                    if len(pending) >= self.in_flight * 2:
+                        done, pending = wait(
+                            pending,
+                            return_when=FIRST_COMPLETED,
+                        )
+
+                        for future in done:
+                            yield future.result()
+
+                for future in as_completed(pending):
+                    yield future.result()
+
+        finally:
+            for sftp_client in self._sftp_clients:
+                sftp_client.close()
+
+            self._sftp_clients.clear()
+
+    def _fetch(self, remote_name: str) -> Tuple[str, Optional[bytes]]:
+
+        sftp_client = getattr(self._local, 'sftp_client', None)
+
+        if sftp_client is None:
+            sftp_client = self._local.sftp_client = (
+                self.connector.get_sftp_client()
+            )
+
+            with self._lock:
+                self._sftp_clients.append(sftp_client)
+
+        # the file may have changed since the walk, so prefetch stats it
+        # for its current size
+        try:
+            with sftp_client.open(remote_name, 'rb') as f:
+                f.prefetch()
+                return remote_name, f.read()
+
+        except (IOError, EOFError, SSHException) as e:
+            log.warning(f'Unable to fetch {remote_name}: {e}')
+            return remote_name, None
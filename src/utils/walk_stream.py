@@ -0,0 +1,204 @@
+#------------------------------------------------------------------------------
+# DRAT Prototype Tool Source Code
+# 
+# Copyright 2019 Carnegie Mellon University. All Rights Reserved.
+# 
+# NO WARRANTY. THIS CARNEGIE MELLON UNIVERSITY AND SOFTWARE ENGINEERING 
+# INSTITUTE MATERIAL IS FURNISHED ON AN "AS-IS" BASIS. CARNEGIE MELLON
+# UNIVERSITY MAKES NO WARRANTIES OF ANY KIND, EITHER EXPRESSED OR IMPLIED, AS
+# TO ANY MATTER INCLUDING, BUT NOT LIMITED TO, WARRANTY OF FITNESS FOR PURPOSE
+# OR MERCHANTABILITY, EXCLUSIVITY, OR RESULTS OBTAINED FROM USE OF THE
+# MATERIAL. CARNEGIE MELLON UNIVERSITY DOES NOT MAKE ANY WARRANTY OF ANY KIND
+# WITH RESPECT TO FREEDOM FROM PATENT, TRADEMARK, OR COPYRIGHT INFRINGEMENT.
+# 
+# Released under a MIT (SEI)-style license, please see license.txt or contact
+# permission@sei.cmu.edu for full terms.
+# 
+# [DISTRIBUTION STATEMENT A] This material has been approved for public
+# release and unlimited distribution.  Please see Copyright notice for non-US
+# Government use and distribution.
+# 
+# This Software includes and/or makes use of the following Third-Party
+# Software subject to its own license:
+# 
+# 1. Python 3.7 (https://docs.python.org/3/license.html)
+# Copyright 2001-2019 Python Software Foundation.
+# 
+# 2. SQL Alchemy (https://github.com/sqlalchemy/sqlalchemy/blob/master/LICENSE)
+# Copyright 2005-2019 SQLAlchemy authors and contributor.
+# 
+# DM19-0055
+#------------------------------------------------------------------------------
+
+
+import binascii
+import zlib
+from utils.ssh import (
+    ByteIterator,
+    StringIterator,
+    CHECKPOINT,
+    TELEMETRY,
+)
+
+FRAME_HEADER = ord(b'H')
+FRAME_STRING = ord(b'S')
+FRAME_RECORD = ord(b'R')
+FRAME_CHECKPOINT = ord(b'C')
+FRAME_TELEMETRY = ord(b'T')
+
+VALUE_TEXT = 0
+VALUE_INT = 1
+VALUE_INTERNED = 2
+VALUE_HEX = 3
+
+
+class WalkStreamDecoder(object):
+    """
+    Decodes the compressed binary output of walk.py (walk.py --format
+    binary) back into the tab separated lines of the text format, so the
+    rest of the gather and load code does not need to know which format
+    was used on the wire.  The frame layout must match
+    BinaryRecordWriter in walk.py.
+    """
+
+    def __init__(self):
+        self._strings = []
+        self._keys = None
+
+    def decode(self, byte_stream: ByteIterator = None) -> StringIterator:
+
+        if byte_stream is None:
+            raise ValueError('Need a byte stream to decode')
+
+        decompressor = zlib.decompressobj()
+        buf = bytearray()
+
+        for chunk in byte_stream:
+            buf.extend(decompressor.decompress(chunk))
+            yield from self._read_frames(buf)
+
+        buf.extend(decompressor.flush())
+        yield from self._read_frames(buf)
+
+        if not decompressor.eof:
+            raise EOFError('Walk stream ended before it was closed.')
+
+        if buf:
+            raise EOFError(
+                f'Walk stream ended inside a frame; {len(buf)} bytes left.'
+            )
+
+        return 'End of stream'
+
+    def _read_frames(self, buf: bytearray) -> StringIterator:
+        """
+        Yields the lines of every complete frame in buf and removes the
+        frames from the buffer.  A partial frame is left for the next
+        chunk.
+        """
+
+        pos = 0
+
+        try:
+            while pos < len(buf):
+                kind = buf[pos]
+
+                try:
+                    length, start = read_varint(buf, pos + 1)
+                except IndexError:
+                    break
+
+                end = start + length
+
+                if end > len(buf):
+                    break
+
+                line = self._read_frame(kind, bytes(buf[start:end]))
+                pos = end
+
+                if line is not None:
+                    yield line
+        finally:
+            del buf[:pos]
+
+    def _read_frame(self, kind: int, payload: bytes):
+
+        if kind == FRAME_STRING:
+            self._strings.append(decode_text(payload))
+            return None
+
+        if kind == FRAME_HEADER:
+            self._keys = decode_text(payload).split('\t')
+            return '\t'.join(self._keys) + '\n'
+
+        if kind == FRAME_RECORD:
+            return '\t'.join(self._read_values(payload)) + '\n'
+
+        if kind == FRAME_CHECKPOINT:
+            return f'{CHECKPOINT}\t{decode_text(payload)}\n'
+
+        if kind == FRAME_TELEMETRY:
+            return f'{TELEMETRY}\t{decode_text(payload)}\n'
+
+        raise ValueError(f'Unknown walk stream frame {kind!r}')
+
+    def _read_values(self, payload: bytes) -> list:
+
+        values = []
+        pos = 0
+
+        while pos < len(payload):
+            value_type, pos = read_varint(payload, pos)
+
+            if value_type == VALUE_INTERNED:
+                index, pos = read_varint(payload, pos)
+                values.append(self._strings[index])
+            elif value_type == VALUE_INT:
+                value, pos = read_varint(payload, pos)
+                values.append(str(unzigzag(value)))
+            elif value_type in (VALUE_TEXT, VALUE_HEX):
+                length, pos = read_varint(payload, pos)
+                raw = payload[pos:pos + length]
+                pos += length
+
+                if value_type == VALUE_HEX:
+                    values.append(binascii.hexlify(raw).decode('ascii'))
+                else:
+                    values.append(decode_text(raw))
+            else:
+                raise ValueError(f'Unknown walk stream value {value_type}')
+
+        return values
+
+
+def read_varint(buf, pos: int) -> tuple:
+    """
+    Reads a varint at pos.  Returns the value and the position after it;
+    raises IndexError if buf ends inside the varint.
+    """
+
+    result = 0
+    shift = 0
+
+    while True:
+        byte = buf[pos]
+        pos += 1
+        result |= (byte & 0x7f) << shift
+
+        if not byte & 0x80:
+            return result, pos
+
+        shift += 7
+
+
+def unzigzag(value: int) -> int:
+    if value & 1:
+        return -((value + 1) >> 1)
+
+    return value >> 1
+
+
+def decode_text(raw: bytes) -> str:
+    # as ByteStreamStringParser does for the text format, so a path that
+    # is not UTF-8 keeps its bytes
+    return raw.decode('utf-8', 'surrogateescape')
@@ -37,17 +37,46 @@ import os
 import os.path
 import sys, errno
 import stat
+import io
 import platform as plat
 from hashlib import sha256, md5
+from collections import deque
 import grp
 import pwd
 import re
+import zlib
+import binascii
+import fnmatch
+import json
+import time
+import threading
+import subprocess
+import struct
 
 try:
     broken_pipe_error = BrokenPipeError
 except NameError:
     broken_pipe_error = IOError
 
+try:
+    text_type = unicode
+    long_type = long
+except NameError:
+    text_type = str
+    long_type = int
+
+try:
+    from collections import OrderedDict
+except ImportError:
+    # python 2.6 has no OrderedDict; see remember_hardlink()
+    OrderedDict = dict
+
+try:
+    from os import scandir
+except ImportError:
+    # python 2 falls back to os.walk
+    scandir = None
+
 try:
     """
     magic is a wrapper around the libmagic file identification library.
@@ -71,7 +100,6 @@ try:
     import glob
     import ctypes
     import ctypes.util
-    import threading
 
     from ctypes import c_char_p, c_int, c_size_t, c_void_p
 
@@ -135,6 +163,16 @@ try:
                 except MagicException as e:
                     return self._handle509Bug(e)
 
+        def from_descriptor(self, fd):
+            """
+            Identify the contents of the open file descriptor `fd`
+            """
+            with self.lock:
+                try:
+                    return maybe_decode(magic_descriptor(self.cookie, fd))
+                except MagicException as e:
+                    return self._handle509Bug(e)
+
         def _handle509Bug(self, e):
             # libmagic 5.09 has a bug where it might fail to identify the
             # mimetype of a file and returns null from magic_file (and
@@ -159,12 +197,17 @@ try:
                 magic_close(self.cookie)
                 self.cookie = None
 
-    _instances = {}
+    # each thread gets its own libmagic cookie, so walker threads do not
+    # wait on each other's Magic.lock
+    _local = threading.local()
 
     def _get_magic_type(mime):
-        i = _instances.get(mime)
+        instances = getattr(_local, 'instances', None)
+        if instances is None:
+            instances = _local.instances = {}
+        i = instances.get(mime)
         if i is None:
-            i = _instances[mime] = Magic(mime=mime)
+            i = instances[mime] = Magic(mime=mime)
         return i
 
     def from_file(filename, mime=False):
@@ -191,6 +234,15 @@ try:
         m = _get_magic_type(mime)
         return m.from_buffer(buffer)
 
+    def from_descriptor(fd, mime=False):
+        """
+        Accepts an open file descriptor and returns the detected filetype.
+        Return value is the mimetype if mime=True, otherwise a human
+        readable name.
+        """
+        m = _get_magic_type(mime)
+        return m.from_descriptor(fd)
+
 
 
 
@@ -298,6 +350,14 @@ try:
     def magic_buffer(cookie, buf):
         return _magic_buffer(cookie, buf, len(buf))
 
+    _magic_descriptor = libmagic.magic_descriptor
+    _magic_descriptor.restype = c_char_p
+    _magic_descriptor.argtypes = [magic_t, c_int]
+    _magic_descriptor.errcheck = errorcheck_null
+
+    def magic_descriptor(cookie, fd):
+        return _magic_descriptor(cookie, fd)
+
 
     _magic_load = libmagic.magic_load
     _magic_load.restype = c_int
@@ -319,6 +379,15 @@ try:
     magic_compile.restype = c_int
     magic_compile.argtypes = [magic_t, c_char_p]
 
+    # magic_version is missing from old libmagic releases
+    if hasattr(libmagic, 'magic_version'):
+        magic_version = libmagic.magic_version
+        magic_version.restype = c_int
+        magic_version.argtypes = []
+        MAGIC_VERSION = magic_version()
+    else:
+        MAGIC_VERSION = 0
+
 
 
     MAGIC_NONE = 0x000000 # No flags
@@ -348,22 +417,383 @@ try:
 
 except ImportError:
     is_magic = False
+    MAGIC_VERSION = 0
 
 
 DIR_SKIP = {
 }
 
+# Number of records allowed to wait on a hashing worker, per worker,
+# before the walk blocks on the oldest one.  Keeps memory bounded and the
+# output in walk order.
+WORKER_QUEUE_DEPTH = 64
+
+# Entries a shard walks before handing the rest of its unit back as new
+# units, and how often it reports progress on stderr; see --shards
+SHARD_UNIT_ENTRIES = 50000
+SHARD_PROGRESS_EVERY = 10000
+
+# Walk directories in name order, so a walk can be resumed; see --sorted
+SORTED = False
+
+# Path components of the last checkpoint a resumed walk starts after;
+# see --resume-after
+RESUME_AFTER = None
+
+CHECKPOINT_MARKER = '%s CHECKPOINT %s' % ('/' * 40, '/' * 40)
+TELEMETRY_MARKER = '%s TELEMETRY %s' % ('/' * 40, '/' * 40)
+
+
+class Telemetry(object):
+    """
+    Counts the time spent on stat, mime detection, hashing and waiting on
+    the --rate-limit, and the bytes hashed and read, for --telemetry
+    records.  The counts are updated from the pool's worker threads, so
+    they are only changed and read while holding lock.
+    """
+
+    FIELDS = (
+        'stat_seconds',
+        'magic_seconds',
+        'hash_seconds',
+        'throttle_seconds',
+        'bytes_hashed',
+        'bytes_read',
+    )
+
+    def __init__(self):
+        self.stat_seconds = 0.0
+        self.magic_seconds = 0.0
+        self.hash_seconds = 0.0
+        self.throttle_seconds = 0.0
+        self.bytes_hashed = 0
+        self.bytes_read = 0
+        self.lock = threading.Lock()
+
+    def count(self, name, value):
+        with self.lock:
+            setattr(self, name, getattr(self, name) + value)
+
+    def counts(self):
+        with self.lock:
+            return dict((name, getattr(self, name)) for name in self.FIELDS)
+
+    def since(self, counts):
+        now = self.counts()
+
+        return dict((name, now[name] - counts[name]) for name in self.FIELDS)
+
+    def add(self, counts):
+        with self.lock:
+            for name in self.FIELDS:
+                setattr(self, name, getattr(self, name) + counts[name])
+
+    def reset_lock(self):
+        """
+        Replaces the lock in a forked worker, as another thread may have
+        held it when the process was forked
+        """
+
+        self.lock = threading.Lock()
+
+
+TELEMETRY = Telemetry()
+
+
+def init_worker_process():
+    TELEMETRY.reset_lock()
+
+
+class RateLimiter(object):
+    """
+    Token bucket that limits file content reads to rate bytes per second,
+    allowing bursts of up to a second's worth
+    """
+
+    def __init__(self, rate):
+        self.rate = float(rate)
+        self.allowance = self.rate
+        self.last = time.time()
+        self.lock = threading.Lock()
+
+    def consume(self, size):
+
+        with self.lock:
+            now = time.time()
+            self.allowance = min(
+                self.rate,
+                self.allowance + (now - self.last) * self.rate,
+            )
+            self.last = now
+            self.allowance -= size
+
+            wait = max(0.0, -self.allowance / self.rate)
+
+        if wait:
+            time.sleep(wait)
+            TELEMETRY.count('throttle_seconds', wait)
+
+
+# Limits file content reads; see --rate-limit
+RATE_LIMITER = None
+
+# Drop the pages of each file from the page cache once it has been read;
+# see --fadvise-dontneed
+FADVISE_DONTNEED = False
+
+# Content of recently walked files with more than one link, keyed by
+# (device, inode, size, mtime_ns), least recently used first.  Each value
+# is the first path seen and its CONTENT_FIELDS, or the pool job
+# computing them; see find_hardlink().
+HARDLINKS = OrderedDict()
+HARDLINK_CACHE_SIZE = 16384
+
+HEX_REGEX = re.compile('^[0-9a-f]+$')
+
+# Fields filled in by get_file_content(), in the order it returns them
+CONTENT_FIELDS = ('info', 'md5', 'sha256', 'hash_policy')
+
+# Content of a prior walk, keyed by path.  Each value is a
+# (fingerprint, content) tuple, content being the CONTENT_FIELDS;
+# see load_manifest().
+MANIFEST = {}
+
+# Hash policies recorded in the hash_policy field
+HASH_FULL = 'F'
+HASH_SAMPLED = 'S'
+HASH_NONE = 'N'
+
+# Digest algorithms computed for regular files; see --digest
+HASHERS = {'md5': md5, 'sha256': sha256}
+DIGESTS = ('md5', 'sha256')
+
+# Bytes read from each end of a file for a sampled digest
+SAMPLE_SIZE = 1048576
+
+# Bytes read once from the start of a file for mime detection and then
+# fed to the digests; the same as libmagic's default bytes_max
+HEAD_SIZE = 1048576
+
+# ELF files are classified from their headers in the first block, the
+# way libmagic's ELF reader does, rather than handing libmagic the file.
+# The rules followed are those of libmagic 5.44; earlier releases name
+# some PIEs differently, so with those libmagic reads the file itself.
+ELF_MAGIC = b'\x7fELF'
+ELF_MAGIC_VERSION = 544
+
+ELF_MIME_TYPES = {
+    1: 'application/x-object',
+    2: 'application/x-executable',
+    4: 'application/x-coredump',
+}
+
+ET_DYN = 3
+PT_DYNAMIC = 2
+DT_NULL = 0
+DT_FLAGS_1 = 0x6ffffffb
+DF_1_PIE = 0x08000000
+
+
+class HashPolicy(object):
+    """
+    Decides whether a regular file is fully hashed, gets a sampled digest
+    of its size, first and last SAMPLE_SIZE bytes, or is not hashed.
+    Full hash globs win over everything else, then the skip rules, then
+    the sample rules.  When owned_paths is given, files outside of it are
+    not hashed.
+    """
+
+    def __init__(
+            self,
+            sample_over=None,
+            skip_over=None,
+            full_globs=(),
+            sample_globs=(),
+            skip_globs=(),
+            sample_mimes=(),
+            skip_mimes=(),
+            owned_paths=None,
+    ):
+        self.sample_over = sample_over
+        self.skip_over = skip_over
+        self.full_globs = tuple(full_globs)
+        self.sample_globs = tuple(sample_globs)
+        self.skip_globs = tuple(skip_globs)
+        self.sample_mimes = tuple(sample_mimes)
+        self.skip_mimes = tuple(skip_mimes)
+        self.owned_paths = owned_paths
+
+    def get_policy(self, file_path, size, info=''):
+
+        if match_globs(file_path, self.full_globs):
+            return HASH_FULL
+
+        if (
+                (
+                    self.owned_paths is not None and
+                    file_path not in self.owned_paths
+                ) or
+                (self.skip_over is not None and size > self.skip_over) or
+                match_globs(file_path, self.skip_globs) or
+                (info and info.startswith(self.skip_mimes))
+        ):
+            return HASH_NONE
+
+        if (
+                (self.sample_over is not None and size > self.sample_over) or
+                match_globs(file_path, self.sample_globs) or
+                (info and info.startswith(self.sample_mimes))
+        ):
+            return HASH_SAMPLED
+
+        return HASH_FULL
+
+
+def match_globs(file_path, globs):
+    for glob_pattern in globs:
+        if fnmatch.fnmatchcase(file_path, glob_pattern):
+            return True
+
+    return False
+
+
+HASH_POLICY = HashPolicy()
+
+# uid and gid to name caches.  Ids without a name are cached as the id
+# itself, which is what gets reported for them.
+USER_NAMES = {}
+GROUP_NAMES = {}
+
+# pid of the walker; the shard and hashing processes are its children
+WALK_PID = os.getpid()
+
+
+def is_walk_process(name):
+    """
+    Returns whether the /proc entry name is the walker or one of its
+    child processes, whose entries change while they are read
+    """
+
+    if name in ('self', 'thread-self'):
+        return True
+
+    if not name.isdigit():
+        return False
+
+    if int(name) == WALK_PID:
+        return True
+
+    try:
+        with open('/proc/%s/stat' % name, 'r') as f:
+            proc_stat = f.read()
+    except (IOError, OSError):
+        return False
+
+    # the command name may hold spaces, so fields are counted after it
+    fields = proc_stat.rsplit(')', 1)[-1].split()
+
+    return len(fields) > 1 and fields[1] == str(WALK_PID)
+
+
 PRUNE_LIST = {
-    # Skip this app's pid.. if not, app will freeze
-    '/proc': re.compile(
-        "^" +
-        str(os.getpid()) +
-        "$"
-    ),
-    '/sys': re.compile('.*')
+    # Skip this app's processes.. if not, app will freeze
+    '/proc': is_walk_process,
+    '/sys': lambda name: True,
 }
 
 
+# Filesystem types pruned by --prune-default-fstypes: network, memory
+# backed and kernel pseudo filesystems, and container layers.  fuse
+# matches every fuse.<subtype>.
+DEFAULT_PRUNE_FSTYPES = (
+    'nfs',
+    'nfs4',
+    'cifs',
+    'smbfs',
+    'tmpfs',
+    'proc',
+    'sysfs',
+    'cgroup',
+    'cgroup2',
+    'fuse',
+    'fuseblk',
+    'overlay',
+)
+
+# Set from the command line by main(); see is_pruned()
+PRUNE_FSTYPES = set()
+PRUNE_DEVICES = set()
+ONE_FILESYSTEM = False
+
+# mount point -> filesystem type, read once from /proc/mounts
+MOUNTS = None
+
+
+def load_mounts():
+    """
+    Reads /proc/mounts once and returns a dictionary of mount point to
+    filesystem type.  Later mounts over the same point win.
+    """
+
+    global MOUNTS
+
+    if MOUNTS is not None:
+        return MOUNTS
+
+    MOUNTS = {}
+
+    try:
+        with open('/proc/mounts', 'r') as mounts:
+            for line in mounts:
+                info = line.strip().split(' ')
+
+                if len(info) > 2:
+                    MOUNTS[unescape_mount(info[1])] = info[2]
+    except (IOError, OSError):
+        pass
+
+    return MOUNTS
+
+
+def unescape_mount(path):
+    # /proc/mounts escapes space, tab, newline and backslash as octal
+    return re.sub(
+        r'\\([0-7]{3})',
+        lambda match: chr(int(match.group(1), 8)),
+        path,
+    )
+
+
+def is_pruned(dir_path, fstat=None, root_dev=None):
+    """
+    Returns True if the walk should not descend into dir_path.  The
+    directory itself is still reported, like find -xdev does.
+    """
+
+    if PRUNE_FSTYPES:
+        fstype = load_mounts().get(dir_path)
+
+        if fstype is not None and (
+                fstype in PRUNE_FSTYPES or
+                fstype.split('.')[0] in PRUNE_FSTYPES
+        ):
+            return True
+
+    if not PRUNE_DEVICES and not ONE_FILESYSTEM:
+        return False
+
+    if fstat is None:
+        try:
+            fstat = os.lstat(dir_path)
+        except OSError:
+            return False
+
+    if fstat.st_dev in PRUNE_DEVICES:
+        return True
+
+    return ONE_FILESYSTEM and fstat.st_dev != root_dev
+
+
 def remove_skipped(dest=None, dirs=None):
     if not dest or not dirs:
         return
@@ -372,7 +802,7 @@ def remove_skipped(dest=None, dirs=None):
     if dest in PRUNE_LIST.keys():
         prune_list = []
         for d in dirs:
-            if PRUNE_LIST[dest].match(d):
+            if PRUNE_LIST[dest](d):
                 prune_list.append(d)
         for d in prune_list:
             dirs.remove(d)
@@ -387,243 +817,1848 @@ def remove_skipped(dest=None, dirs=None):
             dirs.remove(skip)
 
 
-def walk_filesystem(root_dir='/'):
+def walk_filesystem(root_dir='/', content=True):
+
+    for file_path, fstat, parent_dev in walk_entries(root_dir):
+        yield get_file_info(
+            file_path,
+            content=content,
+            fstat=fstat,
+            parent_dev=parent_dev,
+        )
+
+
+def walk_entries(root_dir='/'):
+    """
+    Yields (path, lstat or None, parent device id or None) for / and every
+    entry below root_dir
+    """
+
     # yield root aka / information
-    yield get_file_info(os.path.sep)
+    if RESUME_AFTER is None:
+        yield os.path.sep, None, None
+
+    if scandir is None:
+        entries = walk_directories(root_dir)
+    else:
+        entries = scan_directories(root_dir)
+
+    for entry in entries:
+        yield entry
+
+
+def walk_directories(root_dir='/'):
+    """
+    Yields (path, None, None) for every entry below root_dir using os.walk.
+    Every entry is stat'ed again by get_file_info().
+    """
+
+    try:
+        root_dev = os.lstat(root_dir).st_dev
+    except OSError:
+        return
 
     for dest, dirs, files in os.walk(root_dir):
 
         remove_skipped(dest=dest, dirs=dirs)
 
+        if SORTED:
+            dirs.sort()
+            files.sort()
+
         if dest[-1] == os.path.sep:
             sep = ''
         else:
             sep = os.path.sep
 
-        for direct in dirs:
-            yield get_file_info(
-                sep.join([
-                    dest,
-                    direct,
-                ])
-            )
+        if not is_resumed(dest):
+            for direct in dirs:
+                yield sep.join([dest, direct]), None, None
 
-        for rec in files:
-            yield get_file_info(
-                sep.join([
-                    dest,
-                    rec,
-                ])
-            )
+            for rec in files:
+                yield sep.join([dest, rec]), None, None
 
+        # os.walk descends into whatever is left in dirs
+        dirs[:] = [
+            direct for direct in dirs
+            if not is_pruned(sep.join([dest, direct]), root_dev=root_dev) and
+            has_resumed_entries(sep.join([dest, direct]))
+        ]
 
-def get_type(file_path):
 
-    result = 'U'
+def scan_directories(root_dir='/'):
+    """
+    Yields (path, lstat, parent device id) for every entry below root_dir
+    using os.scandir.  The stat result comes from the DirEntry, so each
+    entry is stat'ed once, and the parent's device id lets get_type()
+    decide mount points without stat'ing the parent again.
+    """
 
     try:
-        fstat = os.lstat(file_path)
+        root_dev = os.lstat(root_dir).st_dev
     except OSError:
-        fstat = None
-        result = 'X'
+        return
 
-    if result == 'X':
-        pass
-    elif stat.S_ISREG(fstat.st_mode):
-        result = 'F'
-    elif stat.S_ISDIR(fstat.st_mode):
-        result = 'D'
-    elif stat.S_ISLNK(fstat.st_mode):
-        result = 'S'
-    elif os.path.ismount(file_path):
-        result = 'M'
-    elif stat.S_ISCHR(fstat.st_mode):
-        result = 'C'
-    elif stat.S_ISBLK(fstat.st_mode):
-        result = 'B'
-    elif stat.S_ISFIFO(fstat.st_mode):
-        result = 'O'
-    elif stat.S_ISSOCK(fstat.st_mode):
-        result = 'K'
+    stack = [(root_dir, root_dev)]
 
-    return {
-        'type': result,
-        'stat': fstat,
-    }
+    while stack:
+        dest, dest_dev = stack.pop()
 
+        entries, subdirs = scan_directory(dest, dest_dev, root_dev)
 
-def get_file_info(file_path):
+        for entry in entries:
+            yield entry
 
-    file_info = {
-        'path': file_path,
-        'type': 'U',
-        'target': '',
-        'target_type': '',
-        'uid': 0,
-        'gid': 0,
-        'user': '',
-        'group': '',
-        'md5': '',
-        'sha256': '',
-        'size': 0,
-        'mode': '',
-        'perm': '',
-        'info': '',
-    }
+        # depth first, in listing order, like os.walk
+        subdirs.reverse()
+        stack.extend(subdirs)
 
-    info = get_type(file_path)
-    file_info['type'] = info['type']
-    fstat = info['stat']
 
-    if file_info['type'] == 'S':
+def scan_directory(dest, dest_dev, root_dev):
+    """
+    Lists one directory for scan_directories().  Returns its
+    (path, lstat, parent device id) entries and the (path, device id) of
+    the subdirectories to descend into, in listing order.
+    """
+
+    try:
+        entries = list(scandir(dest))
+    except OSError:
+        # os.walk ignores unreadable directories as well
+        return [], []
+
+    if SORTED:
+        entries.sort(key=lambda entry: entry.name)
+
+    dirs = []
+    files = []
+
+    for entry in entries:
         try:
-            file_info['target'] = os.readlink(file_path)
+            is_dir = entry.is_dir(follow_symlinks=False)
         except OSError:
-            pass
+            is_dir = False
 
-        if file_info['target']:
-            if file_info['target'].startswith(os.path.sep):
-                target_path = file_info['target']
-            else:
-                target_path = '/'.join([
-                    os.path.dirname(file_path),
-                    file_info['target'],
-                ])
+        if is_dir:
+            dirs.append(entry)
+        else:
+            files.append(entry)
 
-            file_info['target_type'] = get_type(target_path).get('type')
+    names = [entry.name for entry in dirs]
+    remove_skipped(dest=dest, dirs=names)
 
-    if not fstat:
-        print(file_path)
-    file_info['uid'] = fstat.st_uid
-    file_info['gid'] = fstat.st_gid
+    if len(names) != len(dirs):
+        keep = set(names)
+        dirs = [entry for entry in dirs if entry.name in keep]
 
-    if (
-            is_magic and file_info['type'] == 'F' and
-            not file_path.startswith('/proc')
-    ):
-        file_info['info'] = from_file(file_path, mime=True)
+    results = []
+    subdirs = []
+    resumed = is_resumed(dest)
 
-    if file_info['type'] == 'F' and not file_path.startswith('/proc'):
-        file_info['md5'], file_info['sha256'] = generate_hashes(file_path)
+    started = time.time()
 
-    try:
-        file_info['user'] = pwd.getpwuid(fstat.st_uid).pw_name
-    except KeyError:
-        file_info['user'] = fstat.st_uid
+    for entry in dirs + files:
+        try:
+            fstat = entry.stat(follow_symlinks=False)
+        except OSError:
+            fstat = None
 
-    try:
-        file_info['group'] = grp.getgrgid(fstat.st_gid).gr_name
-    except KeyError:
-        file_info['group'] = fstat.st_gid
+        if not resumed:
+            results.append((entry.path, fstat, dest_dev))
 
-    file_info['size'] = fstat.st_size
-    # %o is used to return a standard string
-    # without a prefix of 0o
-    file_info['mode'] = '%o' % fstat.st_mode
-    file_info['perm'] = '%o' % stat.S_IMODE(fstat.st_mode)
+        if (
+                fstat is not None and
+                stat.S_ISDIR(fstat.st_mode) and
+                not is_pruned(entry.path, fstat, root_dev) and
+                has_resumed_entries(entry.path)
+        ):
+            subdirs.append((entry.path, fstat.st_dev))
 
-    return file_info
+    TELEMETRY.count('stat_seconds', time.time() - started)
 
+    return results, subdirs
 
-def get_mount_info(mountpoint=None):
 
-    result = ''
+def get_path_key(path):
+    """
+    Returns the components of path.  In a sorted walk, directories are
+    listed in the order of their keys.
+    """
 
-    if UNAME == 'Darwin':
-        return result
+    return tuple(x for x in path.split(os.path.sep) if x)
 
-    with open('/proc/mounts', 'r') as mounts:
 
-        line = mounts.readline()
+def is_resumed(dir_path):
+    """
+    Returns True if the entries of dir_path were written before the
+    checkpoint a resumed walk starts after.
+    """
 
-        while line:
-            fs = line.strip()
-            info = fs.split(' ')
+    return RESUME_AFTER is not None and get_path_key(dir_path) <= RESUME_AFTER
 
-            if len(info) > 1 and info[1] == mountpoint:
-                result = info[1]
 
-            line = mounts.readline()
+def has_resumed_entries(dir_path):
+    """
+    Returns True if the tree below dir_path holds directories listed after
+    the checkpoint a resumed walk starts after.
+    """
 
-    return result
+    if RESUME_AFTER is None:
+        return True
 
+    key = get_path_key(dir_path)
 
-def generate_hashes(file_path=None):
+    return key > RESUME_AFTER or RESUME_AFTER[:len(key)] == key
 
-    CHUNK_SIZE = 16384
 
-    md5sum = md5()
-    sha256sum = sha256()
+def walk_filesystem_pooled(root_dir='/', workers=2, worker_type='thread'):
+    """
+    Walks the filesystem on the calling thread and hands the hashing and
+    mime detection of regular files to a pool of workers.  Records are
+    yielded in the same order as walk_filesystem().
+    """
 
-    with open(file_path, 'rb') as f:
+    if worker_type == 'process':
+        from multiprocessing import Pool
+    else:
+        from multiprocessing.pool import ThreadPool as Pool
 
-        blob = f.read(CHUNK_SIZE)
+    if worker_type == 'process':
+        pool = Pool(workers, initializer=init_worker_process)
+    else:
+        pool = Pool(workers)
+    pending = deque()
+    window = workers * WORKER_QUEUE_DEPTH
 
-        while blob:
+    try:
+        for file_path, fstat, parent_dev in walk_entries(root_dir):
+            # the os.walk fallback has no stat to pass, so the one made
+            # here is kept for the hard link key
+            file_info, fstat = get_stat_info(
+                file_path,
+                fstat=fstat,
+                parent_dev=parent_dev,
+            )
 
-            md5sum.update(blob)
-            sha256sum.update(blob)
+            job = None
 
-            blob = f.read(CHUNK_SIZE)
+            if has_content(file_info):
+                link = find_hardlink(file_info, fstat)
 
-    return md5sum.hexdigest(), sha256sum.hexdigest()
+                if link is not None:
+                    file_info['link_of'] = link[0]
+                    job = LinkedContent(link[1])
+                elif set_cached_content(file_info):
+                    remember_hardlink(file_info, fstat, tuple(
+                        file_info[name] for name in CONTENT_FIELDS
+                    ))
+                else:
+                    job = pool.apply_async(
+                        get_counted_file_content,
+                        (file_info['path'], file_info['size'])
+                    )
+                    remember_hardlink(file_info, fstat, job)
 
+            pending.append((file_info, job))
 
-def main():
+            while len(pending) > window or (
+                    pending and
+                    (pending[0][1] is None or pending[0][1].ready())
+            ):
+                yield complete_file_info(*pending.popleft())
 
-    global UNAME
-    UNAME = plat.uname()
+        while pending:
+            yield complete_file_info(*pending.popleft())
 
-    if isinstance(UNAME, tuple):
-        UNAME = UNAME[0]
-    else:
-        UNAME = UNAME.system
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
 
-    slashes = '/' * 40
 
-    try:
-        sys.stdout.write('{0} START TTY {0}\n'.format(slashes))
-
-        keys = None
-        key_count = 0
-        first = False
-        count = 0
-
-        for rec in walk_filesystem():
-
-            if not first:
-                keys = rec.keys()
-                key_count = len(keys)
-                counter = 0
-                for key in keys:
-                    counter += 1
-                    if counter == key_count:
-                        eol = '\n'
-                    else:
-                        eol = '\t'
-
-                    sys.stdout.write(key)
-                    sys.stdout.write(eol)
-
-                sys.stdout.flush()
-                first = True
-
-            counter = 0
-            for value in rec.values():
-                counter += 1
-                if counter == key_count:
-                    eol = '\n'
-                else:
-                    eol = '\t'
+def walk_filesystem_sharded(root_dir='/', shards=2):
+    """
+    Walks the filesystem with a pool of shards processes.  The directories
+    below root_dir are the first work units; a shard that walks more than
+    SHARD_UNIT_ENTRIES entries of a unit hands the directories it has not
+    reached back as new units.  Each unit's records are spooled to a
+    temporary file and yielded once the unit is done, so records come out
+    grouped by unit rather than in walk_filesystem() order.
+    """
+
+    from multiprocessing import Pool
+
+    try:
+        from queue import Queue
+    except ImportError:
+        from Queue import Queue
+
+    # yield root aka / information
+    yield get_file_info(os.path.sep)
+
+    try:
+        root_dev = os.lstat(root_dir).st_dev
+    except OSError:
+        return
+
+    entries, units = scan_directory(root_dir, root_dev, root_dev)
+
+    for file_path, fstat, parent_dev in entries:
+        yield get_file_info(file_path, fstat=fstat, parent_dev=parent_dev)
+
+    pool = Pool(shards, initializer=init_worker_process)
+    done = Queue()
+    outstanding = 0
+
+    try:
+        while units or outstanding:
+            for unit in units:
+                pool.apply_async(
+                    walk_unit,
+                    (unit, root_dev),
+                    callback=done.put,
+                    error_callback=done.put,
+                )
+                outstanding += 1
+
+            result = done.get()
+            outstanding -= 1
+
+            if isinstance(result, BaseException):
+                raise result
+
+            records_file, units, counts = result
+            TELEMETRY.add(counts)
+
+            for rec in read_unit_records(records_file):
+                yield rec
+
+        pool.close()
+    finally:
+        pool.terminate()
+        pool.join()
+
+
+def walk_unit(unit, root_dev):
+    """
+    Walks the work unit (path, device id) in a shard process.  Returns the
+    name of the temporary file holding its records, the units left over
+    once SHARD_UNIT_ENTRIES entries have been walked and the work counted
+    for TELEMETRY.
+    """
+
+    from multiprocessing import current_process
+    import marshal
+    import tempfile
+
+    shard = current_process().name
+    start = time.time()
+    count = 0
+    before = TELEMETRY.counts()
+
+    fd, records_file = tempfile.mkstemp(prefix='walk_shard_')
+
+    stack = [unit]
+
+    with os.fdopen(fd, 'wb') as f:
+        while stack and count < SHARD_UNIT_ENTRIES:
+            dest, dest_dev = stack.pop()
+
+            entries, subdirs = scan_directory(dest, dest_dev, root_dev)
+
+            for file_path, fstat, parent_dev in entries:
+                marshal.dump(
+                    get_file_info(
+                        file_path,
+                        fstat=fstat,
+                        parent_dev=parent_dev,
+                    ),
+                    f,
+                )
+
+                count += 1
+
+                if count % SHARD_PROGRESS_EVERY == 0:
+                    sys.stderr.write('%s %s: %d entries in %.1fs\n' % (
+                        shard, unit[0], count, time.time() - start
+                    ))
+
+            subdirs.reverse()
+            stack.extend(subdirs)
+
+    sys.stderr.write('%s %s: done, %d entries in %.1fs, %d units left\n' % (
+        shard, unit[0], count, time.time() - start, len(stack)
+    ))
+
+    # in the order this shard would have walked them
+    stack.reverse()
+
+    return records_file, stack, TELEMETRY.since(before)
+
+
+def read_unit_records(records_file):
+
+    import marshal
+
+    try:
+        with open(records_file, 'rb') as f:
+            while True:
+                try:
+                    yield marshal.load(f)
+                except EOFError:
+                    break
+    finally:
+        os.remove(records_file)
+
+
+def complete_file_info(file_info, job=None):
+
+    if job is not None:
+        content, counts = job.get()
+        file_info.update(zip(CONTENT_FIELDS, content))
+
+        # process workers count into their own copy of TELEMETRY
+        if counts is not None:
+            TELEMETRY.add(counts)
+
+    return file_info
+
+
+class LinkedContent(object):
+    """
+    Stands in for the pool job of a hardlink's content, which is either
+    known or still being computed for the first link
+    """
+
+    def __init__(self, content):
+        self.content = content
+
+    def ready(self):
+        return isinstance(self.content, tuple) or self.content.ready()
+
+    def get(self):
+        if isinstance(self.content, tuple):
+            return self.content, None
+
+        # the first link's job already added its counts
+        return self.content.get()[0], None
+
+
+def get_counted_file_content(file_path, size=0):
+    """
+    Runs get_file_content() in a pool worker.  A process worker also
+    returns the work it counted, for the parent's TELEMETRY.
+    """
+
+    from multiprocessing import current_process
+
+    if current_process().name == 'MainProcess':
+        return get_file_content(file_path, size), None
+
+    before = TELEMETRY.counts()
+    content = get_file_content(file_path, size)
+
+    return content, TELEMETRY.since(before)
+
+
+def get_type(file_path, fstat=None, parent_dev=None):
+
+    result = 'U'
+
+    if fstat is None:
+        started = time.time()
+
+        try:
+            fstat = os.lstat(file_path)
+        except OSError:
+            fstat = None
+            result = 'X'
+
+        TELEMETRY.count('stat_seconds', time.time() - started)
+
+    if result == 'X':
+        pass
+    elif stat.S_ISREG(fstat.st_mode):
+        result = 'F'
+    elif stat.S_ISDIR(fstat.st_mode):
+        result = 'D'
+    elif stat.S_ISLNK(fstat.st_mode):
+        result = 'S'
+    elif is_mount(file_path, fstat, parent_dev):
+        result = 'M'
+    elif stat.S_ISCHR(fstat.st_mode):
+        result = 'C'
+    elif stat.S_ISBLK(fstat.st_mode):
+        result = 'B'
+    elif stat.S_ISFIFO(fstat.st_mode):
+        result = 'O'
+    elif stat.S_ISSOCK(fstat.st_mode):
+        result = 'K'
+
+    return {
+        'type': result,
+        'stat': fstat,
+    }
+
+
+def is_mount(file_path, fstat, parent_dev=None):
+    """
+    An entry is a mount point when its device differs from its parent
+    directory's.  Without the parent's device id this falls back to
+    os.path.ismount, which stats the entry and its parent.
+    """
+
+    if parent_dev is None:
+        return os.path.ismount(file_path)
+
+    return fstat.st_dev != parent_dev
+
+
+def has_content(file_info):
+    return (
+        file_info['type'] == 'F' and
+        not file_info['path'].startswith('/proc')
+    )
+
+
+def get_fingerprint(file_info):
+    return (
+        file_info['size'],
+        file_info['mtime_ns'],
+        file_info['ctime_ns'],
+        file_info['inode'],
+        file_info['dev'],
+    )
+
+
+def set_cached_content(file_info):
+    """
+    Copies the mime type and digests from the manifest into file_info when
+    the file's stat fingerprint has not changed since the prior walk and
+    the hash policy still gives the same result.  Returns True if the
+    cached values were used.
+    """
+
+    cached = MANIFEST.get(file_info['path'])
+
+    if cached is None or cached[0] != get_fingerprint(file_info):
+        return False
+
+    content = dict(zip(CONTENT_FIELDS, cached[1]))
+
+    if content['hash_policy'] != HASH_POLICY.get_policy(
+            file_info['path'],
+            file_info['size'],
+            content['info'],
+    ):
+        return False
+
+    if content['hash_policy'] != HASH_NONE and not all(
+            content[name] for name in DIGESTS
+    ):
+        return False
+
+    for name in HASHERS:
+        if name not in DIGESTS:
+            content[name] = ''
+
+    file_info.update(content)
+
+    return True
+
+
+def get_file_content(file_path, size=0):
+    """
+    Returns the mime type, md5 and sha256 digests and hash policy of a
+    regular file, in the order of CONTENT_FIELDS.  The file is opened once
+    and the block read for mime detection is reused by the digests.
+    """
+
+    info = ''
+    head = b''
+
+    with open(file_path, 'rb') as f:
+
+        if is_magic:
+            started = time.time()
+            head = read_content(f, HEAD_SIZE)
+            info = get_mime_type(file_path, f, head)
+            TELEMETRY.count('magic_seconds', time.time() - started)
+
+        policy = HASH_POLICY.get_policy(file_path, size, info)
+
+        started = time.time()
+
+        if policy == HASH_FULL:
+            md5_digest, sha256_digest = generate_hashes(f, head)
+        elif policy == HASH_SAMPLED:
+            md5_digest, sha256_digest = generate_sampled_hashes(f, head)
+        else:
+            md5_digest = sha256_digest = ''
+
+        TELEMETRY.count('hash_seconds', time.time() - started)
+
+        if FADVISE_DONTNEED:
+            drop_cached_pages(f)
+
+    return info, md5_digest, sha256_digest, policy
+
+
+def read_content(f, size):
+    """
+    Reads up to size bytes of file content, within the --rate-limit
+    """
+
+    blob = f.read(size)
+
+    TELEMETRY.count('bytes_read', len(blob))
+
+    if RATE_LIMITER is not None:
+        RATE_LIMITER.consume(len(blob))
+
+    return blob
+
+
+def drop_cached_pages(f):
+    # python 2 and some platforms do not have posix_fadvise
+    try:
+        os.posix_fadvise(f.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+    except (AttributeError, OSError):
+        pass
+
+
+def read_elf_bytes(f, head, offset, size):
+    """
+    Returns size bytes at offset, from head where it covers them and
+    otherwise from f, leaving the offset of f where it was.
+    """
+
+    if offset + size <= len(head):
+        return head[offset:offset + size]
+
+    position = f.tell()
+
+    try:
+        f.seek(offset)
+        return f.read(size)
+    finally:
+        f.seek(position)
+
+
+def get_elf_pie_flag(f, head, order, wide):
+    """
+    Returns whether the DT_FLAGS_1 entry of the dynamic section marks the
+    ELF object as a PIE.  Without such an entry it is not one, as with
+    libmagic.
+    """
+
+    if wide:
+        phoff, = struct.unpack_from(order + 'Q', head, 32)
+        phentsize, phnum = struct.unpack_from(order + 'HH', head, 54)
+        header, entry = order + 'I4xQ8x8xQ', order + 'qQ'
+    else:
+        phoff, = struct.unpack_from(order + 'I', head, 28)
+        phentsize, phnum = struct.unpack_from(order + 'HH', head, 42)
+        header, entry = order + 'II4x4xI', order + 'iI'
+
+    header_size = struct.calcsize(header)
+    entry_size = struct.calcsize(entry)
+
+    if phentsize < header_size:
+        return False
+
+    headers = read_elf_bytes(f, head, phoff, phnum * phentsize)
+
+    for offset in range(0, len(headers) - header_size + 1, phentsize):
+        p_type, p_offset, p_filesz = struct.unpack_from(
+            header, headers, offset,
+        )
+
+        if p_type != PT_DYNAMIC:
+            continue
+
+        dynamic = read_elf_bytes(f, head, p_offset, p_filesz)
+
+        for tag_offset in range(0, len(dynamic) - entry_size + 1, entry_size):
+            tag, value = struct.unpack_from(entry, dynamic, tag_offset)
+
+            if tag == DT_NULL:
+                return False
+
+            if tag == DT_FLAGS_1:
+                return bool(value & DF_1_PIE)
+
+        return False
+
+    return False
+
+
+def get_elf_mime_type(f, head):
+    """
+    Returns libmagic's mime type for the ELF header in head, or None when
+    the header is not one it can name.  A shared object is a PIE only when
+    its DT_FLAGS_1 says so; the dynamic section is only read from f in
+    the rare case it is past the end of head.
+    """
+
+    if len(head) < 64 or head[4:5] not in (b'\x01', b'\x02'):
+        return None
+
+    order = '<' if head[5:6] == b'\x01' else '>'
+    wide = head[4:5] == b'\x02'
+
+    try:
+        e_type, = struct.unpack_from(order + 'H', head, 16)
+
+        if e_type != ET_DYN:
+            return ELF_MIME_TYPES.get(e_type)
+
+        pie = get_elf_pie_flag(f, head, order, wide)
+    except struct.error:
+        return None
+
+    if pie:
+        return 'application/x-pie-executable'
+
+    return 'application/x-sharedlib'
+
+
+def get_mime_type(file_path, f, head):
+    """
+    Detects the mime type from the first block of the open file f, only
+    going back to libmagic's own reads where the block is not enough.
+    """
+
+    if not head:
+        # libmagic names empty files from their stat
+        return from_file(file_path, mime=True)
+
+    if head.startswith(ELF_MAGIC):
+        info = None
+
+        if MAGIC_VERSION >= ELF_MAGIC_VERSION:
+            info = get_elf_mime_type(f, head)
+
+        if info is None:
+            # libmagic reads from the current offset
+            f.seek(0)
+            info = from_descriptor(f.fileno(), mime=True)
+            f.seek(len(head))
+
+        return info
+
+    return from_buffer(head, mime=True)
+
+
+def get_file_info(file_path, content=True, fstat=None, parent_dev=None):
+
+    file_info, fstat = get_stat_info(
+        file_path,
+        fstat=fstat,
+        parent_dev=parent_dev,
+    )
+
+    if content and has_content(file_info):
+        link = find_hardlink(file_info, fstat)
+
+        if link is not None:
+            file_info['link_of'] = link[0]
+            file_info.update(zip(CONTENT_FIELDS, link[1]))
+        else:
+            if not set_cached_content(file_info):
+                file_info.update(zip(
+                    CONTENT_FIELDS,
+                    get_file_content(file_path, fstat.st_size),
+                ))
+
+            remember_hardlink(
+                file_info,
+                fstat,
+                tuple(file_info[name] for name in CONTENT_FIELDS),
+            )
+
+    return file_info
+
+
+def get_stat_info(file_path, fstat=None, parent_dev=None):
+    """
+    Returns the record of file_path without its content fields, and the
+    lstat it was made from.  fstat is used when the walk already has it.
+    """
+
+    file_info = {
+        'path': file_path,
+        'type': 'U',
+        'target': '',
+        'target_type': '',
+        'uid': 0,
+        'gid': 0,
+        'user': '',
+        'group': '',
+        'md5': '',
+        'sha256': '',
+        'size': 0,
+        'mode': '',
+        'perm': '',
+        'info': '',
+        'mtime_ns': 0,
+        'ctime_ns': 0,
+        'inode': 0,
+        'dev': 0,
+        'hash_policy': '',
+        'link_of': '',
+    }
+
+    info = get_type(file_path, fstat=fstat, parent_dev=parent_dev)
+    file_info['type'] = info['type']
+    fstat = info['stat']
+
+    if file_info['type'] == 'S':
+        try:
+            file_info['target'] = os.readlink(file_path)
+        except OSError:
+            pass
+
+        if file_info['target']:
+            if file_info['target'].startswith(os.path.sep):
+                target_path = file_info['target']
+            else:
+                target_path = '/'.join([
+                    os.path.dirname(file_path),
+                    file_info['target'],
+                ])
+
+            file_info['target_type'] = get_type(target_path).get('type')
+
+    if not fstat:
+        print(file_path)
+    file_info['uid'] = fstat.st_uid
+    file_info['gid'] = fstat.st_gid
+
+    file_info['user'] = get_user_name(fstat.st_uid)
+    file_info['group'] = get_group_name(fstat.st_gid)
+
+    file_info['size'] = fstat.st_size
+    # %o is used to return a standard string
+    # without a prefix of 0o
+    file_info['mode'] = '%o' % fstat.st_mode
+    file_info['perm'] = '%o' % stat.S_IMODE(fstat.st_mode)
+    file_info['mtime_ns'] = get_stat_ns(fstat, 'mtime')
+    file_info['ctime_ns'] = get_stat_ns(fstat, 'ctime')
+    file_info['inode'] = fstat.st_ino
+    file_info['dev'] = fstat.st_dev
+
+    return file_info, fstat
+
+
+def get_hardlink_key(file_info, fstat):
+    if fstat is None or fstat.st_nlink < 2 or not HARDLINK_CACHE_SIZE:
+        return None
+
+    return (
+        file_info['dev'],
+        file_info['inode'],
+        file_info['size'],
+        file_info['mtime_ns'],
+    )
+
+
+def find_hardlink(file_info, fstat):
+    """
+    Returns the (first path, content) of an earlier link to the same file,
+    or None.  Content is the CONTENT_FIELDS or the pool job computing them.
+    """
+
+    key = get_hardlink_key(file_info, fstat)
+
+    if key is None:
+        return None
+
+    link = HARDLINKS.pop(key, None)
+
+    if link is not None:
+        # most recently used goes last
+        HARDLINKS[key] = link
+
+    return link
+
+
+def remember_hardlink(file_info, fstat, content):
+
+    key = get_hardlink_key(file_info, fstat)
+
+    if key is None:
+        return
+
+    HARDLINKS[key] = (file_info['path'], content)
+
+    while len(HARDLINKS) > HARDLINK_CACHE_SIZE:
+        if OrderedDict is dict:
+            # no recency order to evict by
+            HARDLINKS.popitem()
+        else:
+            HARDLINKS.popitem(last=False)
+
+
+def load_id_names():
+    """
+    Seeds the uid and gid name caches with one pass over the user and group
+    databases.  The first entry for an id wins, as it does for getpwuid().
+    """
+
+    for user in pwd.getpwall():
+        USER_NAMES.setdefault(user.pw_uid, user.pw_name)
+
+    for group in grp.getgrall():
+        GROUP_NAMES.setdefault(group.gr_gid, group.gr_name)
+
+
+def get_user_name(uid):
+
+    try:
+        return USER_NAMES[uid]
+    except KeyError:
+        pass
+
+    try:
+        name = pwd.getpwuid(uid).pw_name
+    except KeyError:
+        name = uid
+
+    USER_NAMES[uid] = name
+
+    return name
+
+
+def get_group_name(gid):
+
+    try:
+        return GROUP_NAMES[gid]
+    except KeyError:
+        pass
+
+    try:
+        name = grp.getgrgid(gid).gr_name
+    except KeyError:
+        name = gid
+
+    GROUP_NAMES[gid] = name
+
+    return name
+
+
+def get_stat_ns(fstat, name):
+    # python 2 does not have the st_*_ns attributes
+    try:
+        return getattr(fstat, 'st_%s_ns' % name)
+    except AttributeError:
+        return int(getattr(fstat, 'st_%s' % name) * 1000000000)
+
+
+def load_manifest(manifest_file=None):
+    """
+    Loads a zlib compressed, tab separated manifest of a prior walk.
+    Columns are path, size, mtime_ns, ctime_ns, inode, dev, info, md5,
+    sha256 and hash_policy.  An empty hash_policy is a full hash.
+    """
+
+    manifest = {}
+
+    if not manifest_file:
+        return manifest
+
+    with open(manifest_file, 'rb') as f:
+        data = zlib.decompress(f.read()).decode('utf-8')
+
+    for line in data.split('\n'):
+        fields = line.split('\t')
+
+        if len(fields) != 10:
+            continue
+
+        manifest[fields[0]] = (
+            tuple(int(x) for x in fields[1:6]),
+            tuple(fields[6:9]) + (fields[9] or HASH_FULL,),
+        )
+
+    return manifest
+
+
+def load_path_list(path_file=None):
+    """
+    Loads a zlib compressed, newline separated list of paths, or None if
+    no file was given.
+    """
+
+    if not path_file:
+        return None
+
+    with open(path_file, 'rb') as f:
+        data = zlib.decompress(f.read()).decode('utf-8')
+
+    return frozenset(x for x in data.split('\n') if x)
+
+
+def get_mount_info(mountpoint=None):
+
+    result = ''
+
+    if UNAME == 'Darwin':
+        return result
+
+    if mountpoint in load_mounts():
+        result = mountpoint
+
+    return result
+
+
+class Digests(object):
+    """
+    Runs the digest algorithms selected with --digest over the same data
+    """
+
+    def __init__(self):
+        self.hashers = [(name, HASHERS[name]()) for name in DIGESTS]
+
+    def update(self, blob):
+        TELEMETRY.count('bytes_hashed', len(blob))
+
+        for name, hasher in self.hashers:
+            hasher.update(blob)
+
+    def hexdigests(self):
+        digests = dict(
+            (name, hasher.hexdigest()) for name, hasher in self.hashers
+        )
+
+        return digests.get('md5', ''), digests.get('sha256', '')
+
+
+def generate_hashes(f, head=b''):
+    """
+    Digests head and the rest of the open file f
+    """
+
+    CHUNK_SIZE = 16384
+
+    digests = Digests()
+    digests.update(head)
+
+    blob = read_content(f, CHUNK_SIZE)
+
+    while blob:
+
+        digests.update(blob)
+
+        blob = read_content(f, CHUNK_SIZE)
+
+    return digests.hexdigests()
+
+
+def generate_sampled_hashes(f, head=b''):
+    """
+    Digests the file size and the first and last SAMPLE_SIZE bytes of the
+    open file f.  head, when given, is the start of the file.
+    """
+
+    digests = Digests()
+
+    size = os.fstat(f.fileno()).st_size
+
+    digests.update(('%d\n' % size).encode('ascii'))
+
+    if len(head) < min(size, SAMPLE_SIZE):
+        f.seek(0)
+        head = read_content(f, SAMPLE_SIZE)
+
+    digests.update(head[:SAMPLE_SIZE])
+
+    f.seek(max(SAMPLE_SIZE, size - SAMPLE_SIZE))
+    digests.update(read_content(f, SAMPLE_SIZE))
+
+    return digests.hexdigests()
+
+
+class TextRecordWriter(object):
+    """
+    Writes records as tab separated lines, preceded by a header line
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        self.keys = None
+        self.count = 0
+
+    def write_record(self, rec):
+
+        if self.keys is None:
+            self.keys = list(rec.keys())
+            self.stream.write('\t'.join(self.keys))
+            self.stream.write('\n')
+            self.stream.flush()
+
+        self.stream.write('\t'.join([str(rec[key]) for key in self.keys]))
+        self.stream.write('\n')
+
+        self.count += 1
+        if self.count % 1000 == 0:
+            self.stream.flush()
+
+    def write_checkpoint(self, dir_path):
+        self.stream.write('%s\t%s\n' % (CHECKPOINT_MARKER, dir_path))
+        self.stream.flush()
+
+    def write_telemetry(self, values):
+        self.stream.write('%s\t%s\n' % (
+            TELEMETRY_MARKER,
+            json.dumps(values, sort_keys=True),
+        ))
+        self.stream.flush()
+
+    def close(self):
+        self.stream.flush()
+
+
+class BinaryRecordWriter(object):
+    """
+    Writes records as a zlib compressed stream of frames.  Each frame is a
+    kind byte, a varint payload length and the payload.  The first record
+    is preceded by a header frame of tab separated field names, and
+    checkpoint frames carry the path of a completed directory and
+    telemetry frames a JSON object of --telemetry values.  Strings
+    of the INTERNED_FIELDS are sent once in a string frame and referenced
+    by index afterwards, integers are sent as varints and digests as raw
+    bytes.  The stream is decoded by utils.walk_stream on the collector.
+    """
+
+    FRAME_HEADER = b'H'
+    FRAME_STRING = b'S'
+    FRAME_RECORD = b'R'
+    FRAME_CHECKPOINT = b'C'
+    FRAME_TELEMETRY = b'T'
+
+    VALUE_TEXT = 0
+    VALUE_INT = 1
+    VALUE_INTERNED = 2
+    VALUE_HEX = 3
+
+    INTERNED_FIELDS = (
+        'type',
+        'target_type',
+        'user',
+        'group',
+        'mode',
+        'perm',
+        'info',
+        'hash_policy',
+    )
+    HEX_FIELDS = ('md5', 'sha256')
+
+    def __init__(self, stream, flush_every=1000):
+        self.stream = stream
+        self.flush_every = flush_every
+        self.compressor = zlib.compressobj(6)
+        self.strings = {}
+        self.keys = None
+        self.count = 0
+
+    def write_frame(self, kind, payload):
+        frame = bytearray(kind)
+        write_varint(frame, len(payload))
+        frame.extend(payload)
+        self.stream.write(self.compressor.compress(bytes(frame)))
+
+    def write_record(self, rec):
+
+        if self.keys is None:
+            self.keys = list(rec.keys())
+            self.write_frame(
+                self.FRAME_HEADER,
+                to_bytes('\t'.join(self.keys)),
+            )
+
+        payload = bytearray()
+
+        for key in self.keys:
+            value = rec[key]
+
+            if key in self.INTERNED_FIELDS:
+                write_varint(payload, self.VALUE_INTERNED)
+                write_varint(payload, self.intern(value))
+            elif isinstance(value, (int, long_type)):
+                write_varint(payload, self.VALUE_INT)
+                write_varint(payload, zigzag(value))
+            elif key in self.HEX_FIELDS and is_hex(value):
+                raw = binascii.unhexlify(value)
+                write_varint(payload, self.VALUE_HEX)
+                write_varint(payload, len(raw))
+                payload.extend(raw)
+            else:
+                raw = to_bytes(value)
+                write_varint(payload, self.VALUE_TEXT)
+                write_varint(payload, len(raw))
+                payload.extend(raw)
+
+        self.write_frame(self.FRAME_RECORD, payload)
+
+        self.count += 1
+        if self.count % self.flush_every == 0:
+            self.flush()
+
+    def intern(self, value):
+        value = to_bytes(value)
+        index = self.strings.get(value)
+
+        if index is None:
+            index = self.strings[value] = len(self.strings)
+            self.write_frame(self.FRAME_STRING, value)
+
+        return index
+
+    def write_checkpoint(self, dir_path):
+        self.write_frame(self.FRAME_CHECKPOINT, to_bytes(dir_path))
+        self.flush()
+
+    def write_telemetry(self, values):
+        self.write_frame(
+            self.FRAME_TELEMETRY,
+            to_bytes(json.dumps(values, sort_keys=True)),
+        )
+        self.flush()
+
+    def flush(self):
+        # sync flush lets the collector decode everything sent so far
+        self.stream.write(self.compressor.flush(zlib.Z_SYNC_FLUSH))
+        self.stream.flush()
+
+    def close(self):
+        self.stream.write(self.compressor.flush())
+        self.stream.flush()
+
+
+class TelemetryReporter(object):
+    """
+    Writes a telemetry record through the record writer every interval
+    seconds, with the throughput since the last one, the totals of
+    TELEMETRY, the directory being written and the walker's RSS.
+
+    The records come from a timer thread, so they keep coming while one
+    large file is hashed or the walk waits on the rate limit.  The walk
+    writes its records while holding lock, so a telemetry record never
+    lands inside another.
+    """
+
+    def __init__(self, writer, interval):
+        self.writer = writer
+        self.interval = interval
+        self.start = self.last = time.time()
+        self.files = self.last_files = 0
+        self.last_bytes = 0
+        self.current_dir = ''
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+
+    def begin(self):
+        self.thread = threading.Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                with self.lock:
+                    self.report()
+            except (IOError, OSError):
+                # the reader has gone; the walk itself reports that
+                break
+
+    def end(self):
+        """
+        Stops the timer thread and writes the final telemetry record
+        """
+
+        self.stopped.set()
+
+        if self.thread is not None:
+            self.thread.join()
+
+        with self.lock:
+            self.report()
+
+    def record_written(self, rec):
+        """
+        Counts a written record; called with lock held
+        """
+
+        self.files += 1
+        self.current_dir = os.path.dirname(rec['path'])
+
+    def report(self, now=None):
+        now = now or time.time()
+        seconds = max(now - self.last, 1e-6)
+        values = TELEMETRY.counts()
+        bytes_hashed = values['bytes_hashed']
+
+        values.update({
+            'elapsed_seconds': now - self.start,
+            'files': self.files,
+            'files_per_second': (self.files - self.last_files) / seconds,
+            'bytes_per_second': (
+                (bytes_hashed - self.last_bytes) / seconds
+            ),
+            'current_dir': self.current_dir,
+            'rss_bytes': get_rss(),
+        })
+
+        self.writer.write_telemetry(values)
+
+        self.last = now
+        self.last_files = self.files
+        self.last_bytes = bytes_hashed
+
+
+def write_records(records, writer, checkpoint_every=0, reporter=None):
+    """
+    Writes the records of a walk.  With checkpoint_every, a checkpoint
+    naming the last finished directory is written once that many records
+    have been written since the last one.
+    """
+
+    last_dir = None
+    since_checkpoint = 0
+
+    if reporter is not None:
+        write_lock = reporter.lock
+    else:
+        write_lock = threading.Lock()
+
+    for rec in records:
+        with write_lock:
+            # a directory's entries are written together, so the previous
+            # directory is complete once the parent changes
+            if checkpoint_every:
+                parent = os.path.dirname(rec['path'])
+
+                if parent != last_dir:
+                    if since_checkpoint >= checkpoint_every:
+                        writer.write_checkpoint(last_dir)
+                        since_checkpoint = 0
+
+                    last_dir = parent
+
+                since_checkpoint += 1
+
+            writer.write_record(rec)
+
+            if reporter is not None:
+                reporter.record_written(rec)
+
+
+def report_read_rate(start, rate_limit):
+    """
+    Writes the file content read rate the walk achieved to stderr
+    """
+
+    seconds = max(time.time() - start, 1e-6)
+
+    sys.stderr.write(
+        'walk.py: read %d bytes in %.1fs, %.0f bytes/s with a limit of '
+        '%d bytes/s; %.1fs spent waiting on the limit\n' % (
+            TELEMETRY.bytes_read,
+            seconds,
+            TELEMETRY.bytes_read / seconds,
+            rate_limit,
+            TELEMETRY.throttle_seconds,
+        )
+    )
+
+
+def get_rss():
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            pages = int(f.read().split()[1])
+    except (IOError, OSError, IndexError, ValueError):
+        return 0
+
+    return pages * os.sysconf('SC_PAGE_SIZE')
+
+
+def write_varint(buf, value):
+    while value > 0x7f:
+        buf.append((value & 0x7f) | 0x80)
+        value >>= 7
+
+    buf.append(value)
+
+
+def zigzag(value):
+    if value < 0:
+        return (-value << 1) - 1
+
+    return value << 1
+
+
+def is_hex(value):
+    return bool(value) and len(value) % 2 == 0 and HEX_REGEX.match(value)
+
+
+def to_bytes(value):
+    if isinstance(value, bytes):
+        return value
+
+    if not isinstance(value, text_type):
+        value = text_type(value)
+
+    if str is bytes:
+        return value.encode('utf-8')
+
+    return value.encode('utf-8', 'surrogateescape')
+
+
+def parse_size(value):
+    """
+    Parses a byte count with an optional k, m or g suffix
+    """
+
+    units = {'k': 1024, 'm': 1024 ** 2, 'g': 1024 ** 3}
+    value = value.strip().lower()
+
+    if value and value[-1] in units:
+        return int(float(value[:-1]) * units[value[-1]])
+
+    return int(value)
+
+
+def set_priority(nice=0, ionice_idle=False):
+    """
+    Lowers the CPU and I/O priority of the walker.  Threads and processes
+    started afterwards inherit both.
+    """
+
+    if nice:
+        os.nice(nice)
+
+    if ionice_idle:
+        try:
+            subprocess.check_call(
+                ['ionice', '-c', '3', '-p', str(os.getpid())]
+            )
+        except (OSError, subprocess.CalledProcessError):
+            sys.stderr.write('walk.py: unable to set the idle I/O class\n')
+
+
+class OptionParser(object):
+    """
+    The part of argparse.ArgumentParser that parse_args() uses, on top of
+    optparse for python 2.6, which has no argparse
+    """
+
+    def __init__(self):
+        import optparse
+
+        def check_size(option, opt, value):
+            try:
+                return parse_size(value)
+            except ValueError:
+                raise optparse.OptionValueError(
+                    'option %s: invalid size: %r' % (opt, value)
+                )
+
+        class Option(optparse.Option):
+            TYPES = optparse.Option.TYPES + ('size',)
+            TYPE_CHECKER = dict(optparse.Option.TYPE_CHECKER, size=check_size)
+
+        self.parser = optparse.OptionParser(option_class=Option)
+
+    def add_argument(self, *flags, **kwargs):
+        if kwargs.get('type') is parse_size:
+            kwargs['type'] = 'size'
+
+        self.parser.add_option(*flags, **kwargs)
+
+    def error(self, message):
+        self.parser.error(message)
+
+    def parse_args(self, argv=None):
+        options, args = self.parser.parse_args(argv)
+
+        if args:
+            self.error('unrecognized arguments: %s' % ' '.join(args))
+
+        return options
+
+
+def make_option_parser():
+
+    try:
+        import argparse
+    except ImportError:
+        return OptionParser()
+
+    return argparse.ArgumentParser()
+
+
+def parse_args(argv=None):
+
+    parser = make_option_parser()
+
+    parser.add_argument(
+        '--workers',
+        dest='workers',
+        type=int,
+        default=0,
+        help='Hash and identify files with a pool of this many workers',
+    )
+
+    parser.add_argument(
+        '--worker-type',
+        dest='worker_type',
+        choices=('thread', 'process'),
+        default='thread',
+        help='Run the hashing workers as threads or processes',
+    )
+
+    parser.add_argument(
+        '--shards',
+        dest='shards',
+        type=int,
+        default=0,
+        help=(
+            'Walk the directory tree with this many processes, splitting '
+            'it into work units'
+        ),
+    )
+
+    parser.add_argument(
+        '--sorted',
+        dest='sorted',
+        action='store_true',
+        default=False,
+        help='Walk directories in name order',
+    )
+
+    parser.add_argument(
+        '--checkpoint-every',
+        dest='checkpoint_every',
+        type=int,
+        default=0,
+        help=(
+            'Write a checkpoint after the directory being finished once '
+            'this many records have been written since the last one; '
+            'implies --sorted'
+        ),
+    )
+
+    parser.add_argument(
+        '--resume-after',
+        dest='resume_after',
+        help=(
+            'Resume a sorted walk after the directory of its last '
+            'checkpoint; implies --sorted'
+        ),
+    )
+
+    parser.add_argument(
+        '--telemetry',
+        dest='telemetry',
+        type=float,
+        default=0,
+        help=(
+            'Write a throughput and resource usage record every this many '
+            'seconds'
+        ),
+    )
+
+    parser.add_argument(
+        '--rate-limit',
+        dest='rate_limit',
+        type=parse_size,
+        help='Read file content at no more than this many bytes/s (k, m, g)',
+    )
+
+    parser.add_argument(
+        '--nice',
+        dest='nice',
+        type=int,
+        default=0,
+        help='Add this to the walker\'s nice value',
+    )
+
+    parser.add_argument(
+        '--ionice-idle',
+        dest='ionice_idle',
+        action='store_true',
+        default=False,
+        help='Run the walker in the idle I/O scheduling class',
+    )
+
+    parser.add_argument(
+        '--fadvise-dontneed',
+        dest='fadvise_dontneed',
+        action='store_true',
+        default=False,
+        help=(
+            'Drop each file from the page cache once it has been read, '
+            'including pages other processes had cached'
+        ),
+    )
+
+    parser.add_argument(
+        '--hardlink-cache',
+        dest='hardlink_cache',
+        type=int,
+        default=HARDLINK_CACHE_SIZE,
+        help=(
+            'Reuse the digests and mime type of up to this many recently '
+            'seen files with several links; 0 turns the cache off'
+        ),
+    )
+
+    parser.add_argument(
+        '--format',
+        dest='format',
+        choices=('text', 'binary'),
+        default='text',
+        help='Write tab separated text or the compressed binary format',
+    )
+
+    parser.add_argument(
+        '--prune-fstype',
+        dest='prune_fstypes',
+        action='append',
+        default=[],
+        help=(
+            'Do not descend into mounts of these filesystem types; '
+            'comma separated, may be repeated'
+        ),
+    )
+
+    parser.add_argument(
+        '--prune-default-fstypes',
+        dest='prune_default_fstypes',
+        action='store_true',
+        default=False,
+        help='Prune network, memory backed and pseudo filesystems',
+    )
+
+    parser.add_argument(
+        '--prune-dev',
+        dest='prune_devices',
+        action='append',
+        type=int,
+        default=[],
+        help='Do not descend into this device id; may be repeated',
+    )
+
+    parser.add_argument(
+        '--xdev',
+        dest='one_filesystem',
+        action='store_true',
+        default=False,
+        help='Stay on the filesystem of the walk root, like find -xdev',
+    )
+
+    parser.add_argument(
+        '--digest',
+        dest='digest',
+        choices=('both', 'md5', 'sha256'),
+        default='both',
+        help='Digest algorithms computed for regular files',
+    )
+
+    parser.add_argument(
+        '--hash-sample-over',
+        dest='hash_sample_over',
+        type=parse_size,
+        help='Sample the digest of files larger than this (k, m, g)',
+    )
+
+    parser.add_argument(
+        '--hash-skip-over',
+        dest='hash_skip_over',
+        type=parse_size,
+        help='Do not hash files larger than this (k, m, g)',
+    )
+
+    for policy, policy_help in (
+            ('full', 'Always fully hash'),
+            ('sample', 'Sample the digest of'),
+            ('skip', 'Do not hash'),
+    ):
+        parser.add_argument(
+            '--hash-%s-glob' % policy,
+            dest='hash_%s_globs' % policy,
+            action='append',
+            default=[],
+            help='%s paths matching this glob; may be repeated' % policy_help,
+        )
+
+    for policy, policy_help in (
+            ('sample', 'Sample the digest of'),
+            ('skip', 'Do not hash'),
+    ):
+        parser.add_argument(
+            '--hash-%s-mime' % policy,
+            dest='hash_%s_mimes' % policy,
+            action='append',
+            default=[],
+            help='%s files whose mime type starts with this' % policy_help,
+        )
+
+    parser.add_argument(
+        '--hash-only-paths',
+        dest='hash_only_paths',
+        help='Only hash files listed in this zlib compressed path list',
+    )
+
+    parser.add_argument(
+        '--manifest',
+        dest='manifest',
+        help='Reuse digests from a prior walk for unchanged files',
+    )
+
+    options = parser.parse_args(argv)
+
+    if options.shards and options.workers:
+        parser.error('--shards and --workers cannot be combined')
+
+    if options.checkpoint_every or options.resume_after:
+        options.sorted = True
+
+    if options.shards and options.sorted:
+        parser.error('--shards does not walk in a sorted order')
+
+    return options
+
+
+def main(argv=None):
+
+    options = parse_args(argv)
+
+    global DIGESTS
+    if options.digest != 'both':
+        DIGESTS = (options.digest,)
+
+    global HASH_POLICY
+    HASH_POLICY = HashPolicy(
+        sample_over=options.hash_sample_over,
+        skip_over=options.hash_skip_over,
+        full_globs=options.hash_full_globs,
+        sample_globs=options.hash_sample_globs,
+        skip_globs=options.hash_skip_globs,
+        sample_mimes=options.hash_sample_mimes,
+        skip_mimes=options.hash_skip_mimes,
+        owned_paths=load_path_list(options.hash_only_paths),
+    )
+
+    global MANIFEST
+    MANIFEST = load_manifest(options.manifest)
+
+    global SORTED
+    SORTED = options.sorted
+
+    set_priority(options.nice, options.ionice_idle)
+
+    global FADVISE_DONTNEED
+    FADVISE_DONTNEED = options.fadvise_dontneed
+
+    global HARDLINK_CACHE_SIZE
+    HARDLINK_CACHE_SIZE = options.hardlink_cache
+
+    # each process of a pool gets an even share of the limit
+    readers = options.shards
+
+    if options.worker_type == 'process':
+        readers = readers or options.workers
+
+    global RATE_LIMITER
+    if options.rate_limit:
+        RATE_LIMITER = RateLimiter(options.rate_limit / float(readers or 1))
+
+    global RESUME_AFTER
+    if options.resume_after:
+        RESUME_AFTER = get_path_key(options.resume_after)
+
+    load_id_names()
+
+    global ONE_FILESYSTEM
+    ONE_FILESYSTEM = options.one_filesystem
+    PRUNE_DEVICES.update(options.prune_devices)
+
+    if options.prune_default_fstypes:
+        PRUNE_FSTYPES.update(DEFAULT_PRUNE_FSTYPES)
+
+    for fstypes in options.prune_fstypes:
+        PRUNE_FSTYPES.update(x for x in fstypes.split(',') if x)
+
+    global UNAME
+    UNAME = plat.uname()
+
+    if isinstance(UNAME, tuple):
+        UNAME = UNAME[0]
+    else:
+        UNAME = UNAME.system
+
+    slashes = '/' * 40
+
+    if options.format == 'binary':
+        writer = BinaryRecordWriter(getattr(sys.stdout, 'buffer', sys.stdout))
+    else:
+        if str is not bytes:
+            # paths that are not UTF-8 are written byte for byte, as in
+            # the binary format
+            sys.stdout = io.TextIOWrapper(
+                sys.stdout.buffer,
+                encoding='utf-8',
+                errors='surrogateescape',
+            )
+
+        writer = TextRecordWriter(sys.stdout)
+
+    try:
+        if options.format == 'text':
+            sys.stdout.write('{0} START TTY {0}\n'.format(slashes))
+
+        if options.shards > 0 and scandir is None:
+            sys.stderr.write(
+                'walk.py: --shards needs os.scandir, walking in one process\n'
+            )
+
+        if options.shards > 0 and scandir is not None:
+            records = walk_filesystem_sharded(shards=options.shards)
+        elif options.workers > 0:
+            records = walk_filesystem_pooled(
+                workers=options.workers,
+                worker_type=options.worker_type,
+            )
+        else:
+            records = walk_filesystem()
+
+        walk_start = time.time()
+        reporter = None
+
+        if options.telemetry > 0:
+            reporter = TelemetryReporter(writer, options.telemetry)
+            reporter.begin()
+
+        write_records(
+            records,
+            writer,
+            checkpoint_every=options.checkpoint_every,
+            reporter=reporter,
+        )
+
+        if reporter is not None:
+            reporter.end()
 
-                sys.stdout.write(str(value))
-                sys.stdout.write(eol)
+        writer.close()
 
-            count += 1
-            if count % 1000 == 0:
-                sys.stdout.flush()
+        if RATE_LIMITER is not None:
+            report_read_rate(walk_start, options.rate_limit)
 
-        sys.stdout.write('{0} END TTY {0}\n'.format(slashes))
+        if options.format == 'text':
+            sys.stdout.write('{0} END TTY {0}\n'.format(slashes))
     except broken_pipe_error as e:
         if e.errno == errno.EPIPE:
             pass